@@ -0,0 +1,39 @@
+"""
+Compares loading documents one by one with load_markdown to loading them
+with a single pandoc run using load_markdown_batch.
+
+Usage: python benchmarks/bench_batch.py [COUNT ...]
+"""
+
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from corpus import CorpusSpec, make_corpus
+
+from md_images.core import load_markdown, load_markdown_batch
+
+
+def main(counts: list[int]):
+    print(f"{'files':>6} {'per file [s]':>14} {'batched [s]':>12} {'speedup':>8}")
+    for count in counts:
+        with TemporaryDirectory() as tmp:
+            texts = make_corpus(Path(tmp), CorpusSpec(documents=count)).texts
+
+            start = perf_counter()
+            for text in texts:
+                load_markdown(text)
+            per_file = perf_counter() - start
+
+            start = perf_counter()
+            load_markdown_batch(texts)
+            batched = perf_counter() - start
+
+        print(
+            f"{count:>6} {per_file:>14.3f} {batched:>12.3f} {per_file / batched:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000])
@@ -0,0 +1,36 @@
+"""
+Measures the throughput of the built-in markdown scanner (--engine=fast)
+compared to the pandoc engine.
+
+Usage: python benchmarks/bench_scanner.py [COUNT]
+"""
+
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from corpus import CorpusSpec, make_corpus
+
+from md_images.model import Engine, load_infos
+
+
+def main(count: int):
+    with TemporaryDirectory() as tmp:
+        texts = make_corpus(Path(tmp), CorpusSpec(documents=count)).texts
+        size = sum(text.stat().st_size for text in texts)
+        print(f"{count} files, {size / 1024:.0f} KiB")
+        print(f"{'engine':>8} {'time [s]':>9} {'files/s':>9} {'MiB/s':>7}")
+        for engine in Engine:
+            start = perf_counter()
+            infos = load_infos(texts, engine=engine)
+            elapsed = perf_counter() - start
+            assert not any(isinstance(info, Exception) for info in infos)
+            print(
+                f"{engine.value:>8} {elapsed:>9.3f} {count / elapsed:>9.0f}"
+                f" {size / elapsed / 2**20:>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,133 @@
+"""
+Generates synthetic document corpora for the benchmarks.
+
+A corpus consists of markdown files and Jupyter notebooks spread over several
+directories, each directory with an ``img`` folder for the images of its
+documents. Images may be shared between documents, may have variants (files
+with the same name but another suffix) and may be missing.
+"""
+
+import json
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass
+class CorpusSpec:
+    """
+    The shape of a synthetic corpus.
+
+    Args:
+        documents: number of text files
+        images_per_document: number of image references in each text
+        fanout: number of directories the texts are spread over
+        variants: number of additional variants (e.g. foo.svg for foo.png) per image
+        notebook_fraction: fraction of the texts that are Jupyter notebooks
+        shared_fraction: fraction of image references pointing to an image that
+            is also used by another text in the same directory
+        missing_fraction: fraction of images that are not created on disk
+        seed: seed for the random generator, so corpora are reproducible
+    """
+
+    documents: int = 200
+    images_per_document: int = 5
+    fanout: int = 10
+    variants: int = 1
+    notebook_fraction: float = 0.1
+    shared_fraction: float = 0.2
+    missing_fraction: float = 0.05
+    seed: int = 42
+
+
+@dataclass
+class Corpus:
+    root: Path
+    texts: list[Path]
+    images: list[Path]
+
+
+VARIANT_SUFFIXES = [".svg", ".pdf", ".dot", ".jpg", ".tex"]
+
+PARAGRAPH = (
+    "Lorem ipsum dolor sit amet, *consectetur* adipiscing elit, sed do eiusmod "
+    "tempor incididunt ut labore et [dolore](https://example.com/{n}) magna aliqua."
+)
+
+
+def _markdown(title: str, images: list[str], n: int) -> list[str]:
+    """Markdown blocks for a text with the given images."""
+    blocks = [f"# {title}", PARAGRAPH.format(n=n)]
+    for i, image in enumerate(images):
+        if i % 3 == 0:
+            blocks.append(f"![Figure {i}]({image})")
+        elif i % 3 == 1:
+            blocks.append(f"Inline ![image {i}]({image}){{width=50%}} in text.")
+        else:
+            blocks.append(f"- item with ![image {i}]({image})")
+        blocks.append(PARAGRAPH.format(n=n * 100 + i))
+    blocks.append("```python\n# ![not an image](code.png)\nprint(42)\n```")
+    return blocks
+
+
+def _notebook(title: str, images: list[str], n: int) -> str:
+    cells = []
+    for block in _markdown(title, images, n):
+        cells.append({"cell_type": "markdown", "metadata": {}, "source": block})
+        if len(cells) % 4 == 0:
+            cells.append(
+                {
+                    "cell_type": "code",
+                    "execution_count": len(cells),
+                    "metadata": {},
+                    "source": "plot()",
+                    "outputs": [
+                        {
+                            "output_type": "display_data",
+                            "metadata": {},
+                            "data": {
+                                "image/png": "iVBORw0KGgo=",
+                                "text/plain": "<Figure>",
+                            },
+                        }
+                    ],
+                }
+            )
+    return json.dumps(
+        {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+    )
+
+
+def make_corpus(root: Path, spec: CorpusSpec = CorpusSpec()) -> Corpus:
+    """Writes a corpus as described by spec into the directory root."""
+    rng = random.Random(spec.seed)
+    texts, images = [], []
+    per_dir: dict[Path, list[str]] = {}
+    for n in range(spec.documents):
+        directory = root / f"part-{n % max(1, spec.fanout):03d}"
+        (directory / "img").mkdir(parents=True, exist_ok=True)
+        pool = per_dir.setdefault(directory, [])
+        refs = []
+        for i in range(spec.images_per_document):
+            if pool and rng.random() < spec.shared_fraction:
+                refs.append(rng.choice(pool))
+                continue
+            name = f"img/fig-{n:05d}-{i:02d}"
+            pool.append(name + ".png")
+            refs.append(name + ".png")
+            if rng.random() >= spec.missing_fraction:
+                for suffix in [".png"] + VARIANT_SUFFIXES[: spec.variants]:
+                    image = directory / (name + suffix)
+                    image.write_bytes(bytes(rng.randrange(256) for _ in range(64)))
+                    images.append(image)
+        title = f"Document {n}"
+        if rng.random() < spec.notebook_fraction:
+            text = directory / f"doc-{n:05d}.ipynb"
+            text.write_text(_notebook(title, refs, n), encoding="utf-8")
+        else:
+            text = directory / f"doc-{n:05d}.md"
+            text.write_text(
+                "\n\n".join(_markdown(title, refs, n)) + "\n", encoding="utf-8"
+            )
+        texts.append(text)
+    return Corpus(root, texts, images)
@@ -0,0 +1,331 @@
+"""
+Benchmarks md-images' core functions and CLI commands on a synthetic corpus.
+
+Each benchmark is repeated, each repetition with a new scratch directory for
+caches and copies. The results are written as JSON, so they can be compared
+across releases.
+
+Usage: python benchmarks/run.py [-o results.json] [--documents N] [...] [BENCHMARK ...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shlex
+import subprocess
+import sys
+from dataclasses import asdict, fields
+from functools import cached_property
+from importlib.metadata import version
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+import panflute as pf
+
+from corpus import Corpus, CorpusSpec, make_corpus
+
+from md_images.cache import ParseCache
+from md_images.copyplan import CopyPlan
+from md_images.core import (
+    DocInfo,
+    find_images,
+    guess_format,
+    load_json_batch,
+    load_markdown,
+    load_markdown_batch,
+)
+from md_images.model import Engine, MdFile, load_infos
+from md_images.prefer_variants import rank_variants
+from md_images.scanner import scan_file
+
+
+class Prepared:
+    """A corpus and inputs for benchmarks that should not measure parsing."""
+
+    def __init__(self, corpus: Corpus):
+        self.corpus = corpus
+        self.texts = corpus.texts
+
+    @cached_property
+    def docs(self) -> list[pf.Doc]:
+        return load_markdown_batch(self.texts)
+
+    @cached_property
+    def asts(self) -> list[dict]:
+        return load_json_batch(self.texts)
+
+    @cached_property
+    def infos(self) -> list[DocInfo]:
+        return [DocInfo.from_json(ast) for ast in self.asts]
+
+    def sources(self) -> list[MdFile]:
+        return [MdFile(text, info=info) for text, info in zip(self.texts, self.infos)]
+
+
+#: A benchmark function is called with the prepared corpus and a scratch directory.
+#: If it returns a number, that is taken as the duration, so it can exclude its setup.
+Benchmark = Callable[[Prepared, Path], float | None]
+
+#: name -> (group, benchmark function)
+BENCHMARKS: dict[str, tuple[str, Benchmark]] = {}
+
+
+def benchmark(name: str, group: str = "core"):
+    def register(func: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = (group, func)
+        return func
+
+    return register
+
+
+@benchmark("load_markdown")
+def _load_markdown(prepared: Prepared, scratch: Path):
+    for text in prepared.texts:
+        load_markdown(text)
+
+
+@benchmark("load_markdown_batch")
+def _load_markdown_batch(prepared: Prepared, scratch: Path):
+    load_markdown_batch(prepared.texts)
+
+
+@benchmark("load_json_batch")
+def _load_json_batch(prepared: Prepared, scratch: Path):
+    load_json_batch(prepared.texts)
+
+
+@benchmark("find_images")
+def _find_images(prepared: Prepared, scratch: Path):
+    docs = prepared.docs
+    start = perf_counter()
+    for doc in docs:
+        find_images(doc)
+    return perf_counter() - start
+
+
+@benchmark("DocInfo.from_json")
+def _from_json(prepared: Prepared, scratch: Path):
+    asts = prepared.asts
+    start = perf_counter()
+    for ast in asts:
+        DocInfo.from_json(ast)
+    return perf_counter() - start
+
+
+@benchmark("scan_file")
+def _scan_file(prepared: Prepared, scratch: Path):
+    for text in prepared.texts:
+        scan_file(text)
+
+
+@benchmark("load_infos[pandoc]")
+def _load_infos_pandoc(prepared: Prepared, scratch: Path):
+    load_infos(prepared.texts)
+
+
+@benchmark("load_infos[fast]")
+def _load_infos_fast(prepared: Prepared, scratch: Path):
+    load_infos(prepared.texts, engine=Engine.FAST)
+
+
+@benchmark("load_infos[warm cache]")
+def _load_infos_cached(prepared: Prepared, scratch: Path):
+    cache = ParseCache(scratch / "cache")
+    for text, info in zip(prepared.texts, prepared.infos):
+        cache.put(cache.key(text.read_bytes(), guess_format(text)), info)
+    start = perf_counter()
+    load_infos(prepared.texts, cache)
+    return perf_counter() - start
+
+
+@benchmark("rank_variants")
+def _rank_variants(prepared: Prepared, scratch: Path):
+    images = [img for source in prepared.sources() for img in source.image_paths]
+    start = perf_counter()
+    rank_variants(images, find_variants=True)
+    return perf_counter() - start
+
+
+@benchmark("MdFile.copy")
+def _copy(prepared: Prepared, scratch: Path):
+    sources = prepared.sources()
+    start = perf_counter()
+    for source in sources:
+        target = scratch / source.path.parent.name
+        target.mkdir(exist_ok=True)
+        try:
+            source.copy(target)
+        except FileNotFoundError:  # missing images
+            pass
+    return perf_counter() - start
+
+
+@benchmark("CopyPlan")
+def _copy_plan(prepared: Prepared, scratch: Path):
+    sources = prepared.sources()
+    start = perf_counter()
+    plan = CopyPlan()
+    for source in sources:
+        target = scratch / source.path.parent.name
+        target.mkdir(exist_ok=True)
+        source.plan_copy(plan, target)
+    plan.execute()
+    return perf_counter() - start
+
+
+def _cli(*args: str, cache: str = "cold", ok: tuple[int, ...] = (0,)) -> Benchmark:
+    """
+    Benchmark for running md-images with the given arguments in the corpus root.
+    The argument "{texts}" is replaced by all texts, {scratch} in the arguments by
+    the scratch directory. cache is one of "none" (--no-cache), "cold" or "warm"
+    (run once before measuring). Raises RuntimeError if md-images exits with a
+    status not in ok.
+    """
+
+    def run(prepared: Prepared, scratch: Path):
+        root = prepared.corpus.root
+        argv = []
+        for arg in args:
+            if arg == "{texts}":
+                argv.extend(os.path.relpath(text, root) for text in prepared.texts)
+            else:
+                argv.append(arg.format(scratch=scratch))
+        if cache == "none":
+            argv.append("--no-cache")
+        env = dict(os.environ, XDG_CACHE_HOME=str(scratch / "cache"))
+        command = [
+            sys.executable,
+            "-c",
+            "import sys; from md_images.cli import app; sys.exit(app())",
+            *argv,
+        ]
+
+        def execute():
+            # a failing command may be fast, so never report its time
+            result = subprocess.run(
+                command,
+                cwd=root,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,  # md-images logs to stdout
+                text=True,
+            )
+            if result.returncode not in ok:
+                raise RuntimeError(
+                    f"md-images {shlex.join(args)} failed with exit code "
+                    f"{result.returncode}:\n"
+                    + "\n".join(result.stdout.splitlines()[-20:])
+                )
+
+        if cache == "warm":
+            execute()
+        start = perf_counter()
+        execute()
+        return perf_counter() - start
+
+    return run
+
+
+# check and cp exit with 1 if images are missing, which the default corpus has
+for _name, _args, _cache, _ok in [
+    ("ls", ["ls", "{texts}"], "none", (0,)),
+    ("ls[fast]", ["ls", "-e", "fast", "{texts}"], "none", (0,)),
+    ("ls[warm cache]", ["ls", "{texts}"], "warm", (0,)),
+    ("dep", ["dep", "-d", ".pdf", "{texts}"], "none", (0,)),
+    ("dep -i", ["dep", "-i", ".d", "{texts}"], "none", (0,)),
+    (
+        "dep -i --incremental[warm]",
+        ["dep", "-i", ".d", "--incremental", "{texts}"],
+        "warm",
+        (0,),
+    ),
+    ("check", ["check", "-s", "source", "{texts}"], "none", (0, 1)),
+    ("cp", ["cp", "{texts}", "{scratch}/out"], "none", (0, 1)),
+    ("links", ["links", "-f", "url", "{texts}"], "none", (0,)),
+    ("index", ["index", "-o", "{scratch}/index.json", "{texts}"], "none", (0,)),
+]:
+    BENCHMARKS["cli " + _name] = ("cli", _cli(*_args, cache=_cache, ok=_ok))
+
+
+def measure(func: Benchmark, prepared: Prepared, repeat: int) -> list[float]:
+    """Runs func repeat times and returns the durations."""
+    times = []
+    for _ in range(repeat):
+        with TemporaryDirectory() as scratch:
+            start = perf_counter()
+            elapsed = func(prepared, Path(scratch))
+            if elapsed is None:
+                elapsed = perf_counter() - start
+        times.append(elapsed)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "benchmarks", nargs="*", help="names or groups (core, cli) to run, default all"
+    )
+    parser.add_argument("-o", "--output", type=Path, help="write the JSON results here")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    for field in fields(CorpusSpec):
+        parser.add_argument(
+            "--" + field.name.replace("_", "-"), type=field.type, default=field.default
+        )
+    args = parser.parse_args()
+    logging.getLogger("md_images").setLevel(logging.CRITICAL)  # e.g. missing images
+    if args.list:
+        for name, (group, _) in BENCHMARKS.items():
+            print(f"{group:5} {name}")
+        return
+    selected = [
+        name
+        for name, (group, _) in BENCHMARKS.items()
+        if not args.benchmarks or name in args.benchmarks or group in args.benchmarks
+    ]
+    spec = CorpusSpec(
+        **{field.name: getattr(args, field.name) for field in fields(CorpusSpec)}
+    )
+
+    results = []
+    with TemporaryDirectory() as tmp:
+        prepared = Prepared(make_corpus(Path(tmp), spec))
+        for name in selected:
+            group, func = BENCHMARKS[name]
+            times = measure(func, prepared, args.repeat)
+            results.append(
+                {
+                    "name": name,
+                    "group": group,
+                    "times": times,
+                    "min": min(times),
+                    "median": median(times),
+                }
+            )
+            print(
+                f"{name:30} {min(times):9.3f} s  (median {median(times):.3f} s)",
+                file=sys.stderr,
+            )
+
+    report = {
+        "md_images": version("md-images"),
+        "python": platform.python_version(),
+        "pandoc": ".".join(map(str, pf.tools.pandoc_version.version)),
+        "platform": platform.platform(),
+        "command": shlex.join(sys.argv),
+        "corpus": asdict(spec),
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+-- Converts many documents in a single pandoc run.
+--
+-- Usage: pandoc lua batch.lua FORMAT < paths
+--
+-- Reads NUL separated file names from stdin, parses each file with the given
+-- input format and writes one line per file to stdout: either the document
+-- as pandoc JSON, or an error message prefixed with '!'.
+
+local format = arg[1]
+
+local function convert(name)
+  local file, err = io.open(name, 'rb')
+  if not file then
+    error(err, 0)
+  end
+  local text = file:read('a')
+  file:close()
+  return pandoc.write(pandoc.read(text, format), 'json')
+end
+
+for name in io.read('a'):gmatch('[^\0]+') do
+  local ok, result = pcall(convert, name)
+  if ok then
+    io.write(result, '\n')
+  else
+    io.write('!', tostring(result):gsub('\n', ' '), '\n')
+  end
+  io.flush()
+end
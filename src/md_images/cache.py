@@ -0,0 +1,138 @@
+"""
+Persistent cache for the information md-images extracts from documents.
+
+Entries are keyed by a hash of the document's content, its input format and
+the pandoc version, so a cached entry is valid exactly as long as pandoc
+would produce the same result. Each entry is a small JSON file; the cache is
+bounded in size and evicts the least recently used entries first.
+"""
+
+import json
+import logging
+import os
+from dataclasses import asdict
+from hashlib import sha256
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from .core import DocInfo
+from .server import pandoc_version
+
+logger = logging.getLogger(__name__)
+
+#: Bump this whenever the semantics of the cached information change.
+CACHE_VERSION = 2  # 2: notebook sources extracted with notebook_markdown
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_dir() -> Path:
+    """The cache directory, following the XDG base directory specification."""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base, "md-images")
+
+
+class ParseCache:
+    """
+    Maps document contents to :class:`DocInfo` objects.
+
+    Args:
+        directory: where to store the cache entries, defaults to :func:`default_cache_dir`
+        max_size: maximum total size of all entries in bytes. When it is exceeded,
+            the least recently used entries are removed.
+    """
+
+    def __init__(self, directory: Path | None = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = (
+            Path(directory) if directory is not None else default_cache_dir()
+        )
+        self.max_size = max_size
+        self._size: int | None = None
+
+    def key(self, content: bytes, input_format: str) -> str:
+        h = sha256(content)
+        h.update(f"\0{input_format}\0{pandoc_version()}\0{CACHE_VERSION}".encode())
+        return h.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key[:2] / (key + ".json")
+
+    def get(self, key: str) -> DocInfo | None:
+        entry = self._entry(key)
+        try:
+            info = DocInfo(**json.loads(entry.read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError):
+            logger.debug("Ignoring corrupt cache entry %s", entry)
+            return None
+        try:
+            os.utime(entry)  # mark as recently used
+        except OSError:
+            pass
+        return info
+
+    def put(self, key: str, info: DocInfo) -> None:
+        entry = self._entry(key)
+        data = json.dumps(asdict(info)).encode("utf-8")
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(dir=entry.parent, suffix=".tmp", delete=False) as f:
+                f.write(data)
+            os.replace(f.name, entry)
+        except OSError as e:
+            logger.debug("Could not write cache entry %s: %s", entry, e)
+            return
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.prune()
+
+    def _entries(self) -> list[os.DirEntry]:
+        entries = []
+        try:
+            with os.scandir(self.directory) as buckets:
+                for bucket in buckets:
+                    if bucket.is_dir():
+                        with os.scandir(bucket.path) as files:
+                            entries.extend(f for f in files if f.name.endswith(".json"))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def size(self) -> int:
+        """Total size of all cache entries in bytes."""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def __len__(self) -> int:
+        return len(self._entries())
+
+    def prune(self, max_size: int | None = None) -> int:
+        """
+        Removes the least recently used entries until the cache is smaller than
+        90% of max_size. Returns the number of removed entries.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = [(entry, entry.stat()) for entry in self._entries()]
+        entries.sort(key=lambda item: item[1].st_mtime_ns)
+        size = sum(stat.st_size for _, stat in entries)
+        removed = 0
+        for entry, stat in entries:
+            if size <= max_size * 0.9:
+                break
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
+            removed += 1
+        self._size = size
+        logger.debug("Removed %d entries from the cache", removed)
+        return removed
+
+    def clear(self) -> int:
+        """Removes all entries. Returns the number of removed entries."""
+        return self.prune(max_size=0)
@@ -1,46 +1,97 @@
 import builtins
+import cProfile
+import inspect
+import json
+import sys
+from collections import Counter
+from functools import cache, partial, wraps
 from os import fspath
 from pathlib import Path
-from typing import Annotated, Literal
-from panflute import (
-    BulletList,
-    Doc,
-    Header,
-    Inline,
-    Link,
-    ListItem,
-    Plain,
-    Str,
-    convert_text,
-    stringify,
+from typing import (
+    TYPE_CHECKING,
+    Annotated,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    Literal,
+    Sequence,
 )
-from rich.console import Console
-from rich.syntax import Syntax
-from rich.logging import RichHandler
 
 from cyclopts import App, Parameter
 
 from md_images.core import relative_fspath
 
-from .model import MdFile, SourceSelection
-from .core import find_all
+from . import daemon
+from .cache import ParseCache
+from .contenthash import HashCache
+from .copyplan import CopyMode, CopyPlan
+from .index import DEFAULT_INDEX, ImageIndex
+from .depfile import dep_header, read_header, write_if_changed
+from .dirindex import DirectoryIndex
+from .model import Engine, MdFile, SourceSelection, load_files, load_infos
+from . import ninja as ninja_build
+from .core import DocInfo, find_all, link_key, load_markdown_batch
+from .parallel import STREAM_BATCH_SIZE, map_batches
+from .stats import stats
 
 import logging
 
-console = Console()
+if TYPE_CHECKING:
+    from panflute import BulletList
+    from rich.console import Console
 
+# md-images is often run many times from a build, so rich and panflute are only
+# imported when they are actually needed.
 
-def print(*args, **kwargs):
-    if console.is_terminal:
-        console.print(*args, **kwargs)
+
+@cache
+def _console() -> "Console":
+    from rich.console import Console
+
+    return Console()
+
+
+def _is_terminal() -> bool:
+    return sys.stdout.isatty() and _console().is_terminal
+
+
+def print(*args, flush: bool = False, **kwargs):
+    if _is_terminal():
+        _console().print(*args, **kwargs)
     else:
-        builtins.print(*args, **kwargs)
+        builtins.print(*args, flush=flush, **kwargs)
+
+
+def _print_new(paths: Iterable[Path], seen: set[Path], relative: bool = True):
+    """
+    Prints those of the given paths that have not been printed before, so
+    consumers of the output can start working before all texts are parsed.
+    """
+    new = sorted(set(paths) - seen)
+    if new:
+        seen.update(new)
+        print("\n".join(map(relative_fspath if relative else fspath, new)), flush=True)
+
+
+class _RichHandler(logging.Handler):
+    """Passes records on to a rich.logging.RichHandler, created on the first record."""
+
+    def __init__(self):
+        super().__init__()
+        self._handler: logging.Handler | None = None
+
+    def emit(self, record: logging.LogRecord):
+        if self._handler is None:
+            from rich.logging import RichHandler
+
+            self._handler = RichHandler(show_time=False)
+            self._handler.setFormatter(self.formatter)
+        self._handler.emit(record)
 
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    format="%(message)s", handlers=[RichHandler(show_time=False)], level=logging.INFO
-)
+logging.basicConfig(format="%(message)s", handlers=[_RichHandler()], level=logging.INFO)
 
 app = App(default_parameter=Parameter(negative=[]), help_format="rst")
 
@@ -57,18 +108,278 @@ Select = Annotated[
     SourceSelection, Parameter(["-s", "--select"], help=SourceSelection.__doc__)
 ]
 
+NoCache = Annotated[
+    bool,
+    Parameter(
+        "--no-cache",
+        help="Always parse the text files, do not read from or write to the parse cache.",
+    ),
+]
+
+
+EngineOption = Annotated[Engine, Parameter(["-e", "--engine"], help=Engine.__doc__)]
+
+Jobs = Annotated[
+    int | None,
+    Parameter(
+        ["-j", "--jobs"],
+        help="Number of text files to parse in parallel. Defaults to the number of CPUs.",
+    ),
+]
+
+
+StatsOption = Annotated[
+    bool,
+    Parameter(
+        "--stats",
+        help="Print how much time was spent in each phase and counts of expensive operations.",
+    ),
+]
+
+ProfileOption = Annotated[
+    Path | None,
+    Parameter(
+        "--profile",
+        help="Write profiling data to the given file: a Chrome trace of the phases "
+        "if it ends with .json, cProfile data for the main process otherwise.",
+    ),
+]
+
+
+def _print_stats():
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table("", "count", "time", title="md-images statistics")
+    for row in stats.rows():
+        table.add_row(*row)
+    Console(stderr=True).print(table)
+
+
+def _instrumented(command: Callable) -> Callable:
+    """
+    Adds the --stats and --profile options to the given command.
+    """
+
+    @wraps(command)
+    def wrapper(*args, stats_: bool = False, profile: Path | None = None, **kwargs):
+        trace = profile is not None and profile.suffix == ".json"
+        stats.reset(trace=trace)
+        profiler = cProfile.Profile() if profile is not None and not trace else None
+        try:
+            if profiler is not None:
+                return profiler.runcall(command, *args, **kwargs)
+            return command(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.dump_stats(profile)
+            elif trace:
+                stats.write_trace(profile)
+            if stats_:
+                _print_stats()
+
+    signature = inspect.signature(command)
+    wrapper.__signature__ = signature.replace(
+        parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter(
+                "stats_",
+                inspect.Parameter.KEYWORD_ONLY,
+                default=False,
+                annotation=StatsOption,
+            ),
+            inspect.Parameter(
+                "profile",
+                inspect.Parameter.KEYWORD_ONLY,
+                default=None,
+                annotation=ProfileOption,
+            ),
+        ]
+    )
+    return wrapper
+
+
+def _cache(no_cache: bool) -> ParseCache | None:
+    return None if no_cache else ParseCache()
+
+
+def _report_failure(text: Path, error: Exception, failed: list[Path]):
+    logger.error("Could not process %s: %s", text, str(error) or repr(error))
+    failed.append(text)
+
+
+def _sources(
+    texts: Sequence[Path],
+    cache: ParseCache | None,
+    jobs: int | None,
+    failed: list[Path],
+    engine: Engine = Engine.PANDOC,
+    select: SourceSelection | None = None,
+    batch_size: int | None = None,
+) -> Iterator[MdFile]:
+    """
+    Loads the given texts in parallel, reporting and skipping those that fail.
+    Unless caching is disabled, the md-images server is asked first, then also
+    for the image sources for select. See :func:`map_batches` for batch_size.
+    """
+    served = daemon.query(texts, engine, select) if cache is not None else None
+    if served is not None:
+        loaded = zip(texts, served)
+    else:
+        loaded = load_files(texts, cache, jobs, engine, batch_size)
+    for text, source in loaded:
+        if isinstance(source, Exception):
+            _report_failure(text, source, failed)
+        else:
+            yield source
+
+
+def _served_infos(
+    texts: Sequence[Path],
+    cache: ParseCache | None,
+    engine: Engine = Engine.PANDOC,
+) -> list[DocInfo | Exception]:
+    """Like load_infos, but asks the md-images server first."""
+    served = daemon.query(texts, engine)
+    if served is None:
+        return load_infos(texts, cache, engine)
+    return [
+        source if isinstance(source, Exception) else source.info for source in served
+    ]
+
+
+def _dep_rules(
+    texts: Sequence[Path],
+    suffix: list[str] | None,
+    cache: ParseCache | None,
+    engine: Engine = Engine.PANDOC,
+    load: Callable = load_infos,
+) -> list[str | Exception]:
+    return [
+        info if isinstance(info, Exception) else _rules(text, info, suffix)
+        for text, info in zip(texts, load(texts, cache, engine))
+    ]
+
+
+def _rules(text: Path, info: DocInfo, suffix: list[str] | None) -> str:
+    source = MdFile(text, info=info)
+    return "\n".join([source.rule(suf) for suf in suffix or []] or [source.rule()])
+
+
+DepStatus = Literal["written", "unchanged", "skipped"]
+
+
+def _dep_files(
+    texts: Sequence[Path],
+    suffix: list[str] | None,
+    individual_dependencies: str,
+    cache: ParseCache | None,
+    engine: Engine = Engine.PANDOC,
+    incremental: bool = False,
+    load: Callable = load_infos,
+) -> list[DepStatus | Exception]:
+    """
+    Writes a dependency file for each text, unless it already has the right
+    content. In incremental mode, texts whose dependency file has been generated
+    from the same content and options are not parsed at all.
+    """
+    result: dict[Path, DepStatus | Exception] = {}
+    headers: dict[Path, str] = {}
+    if incremental:
+        for text in texts:
+            try:
+                # the rules list the explicitly referenced images
+                header = dep_header(
+                    text.read_bytes(),
+                    suffix,
+                    engine.value,
+                    SourceSelection.EXPLICIT.value,
+                )
+            except OSError as e:
+                result[text] = e
+                continue
+            if read_header(text.with_suffix(individual_dependencies)) == header:
+                result[text] = "skipped"
+            else:
+                headers[text] = header
+    to_parse = [text for text in texts if text not in result]
+    for text, info in zip(to_parse, load(to_parse, cache, engine)):
+        if isinstance(info, Exception):
+            result[text] = info
+            continue
+        content = headers.get(text, "") + _rules(text, info, suffix) + "\n"
+        try:
+            written = write_if_changed(
+                text.with_suffix(individual_dependencies), content
+            )
+        except OSError as e:
+            result[text] = e
+            continue
+        result[text] = "written" if written else "unchanged"
+    return [result[text] for text in texts]
+
+
+def _write_dep_files(
+    texts: Sequence[Path],
+    suffix: list[str] | None,
+    individual_dependencies: str,
+    cache: ParseCache | None,
+    engine: Engine,
+    jobs: int | None,
+    incremental: bool,
+    failed: list[Path],
+):
+    make_files = partial(
+        _dep_files,
+        suffix=suffix,
+        individual_dependencies=individual_dependencies,
+        cache=cache,
+        engine=engine,
+        incremental=incremental,
+    )
+    counts = Counter()
+    if cache is not None and daemon.available():
+        # the server does the parsing, no need for worker processes
+        statuses = zip(texts, make_files(texts, load=_served_infos))
+    else:
+        statuses = map_batches(make_files, texts, jobs)
+    for text, status in statuses:
+        if isinstance(status, Exception):
+            _report_failure(text, status, failed)
+        else:
+            counts[status] += 1
+    if incremental:
+        logger.info(
+            "%d dependency files written, %d unchanged, %d skipped as up to date",
+            counts["written"],
+            counts["unchanged"],
+            counts["skipped"],
+        )
+
 
 @app.command
-def ls(texts: Texts, /, *, select: Select = SourceSelection.EXPLICIT):
+@_instrumented
+def ls(
+    texts: Texts,
+    /,
+    *,
+    select: Select = SourceSelection.EXPLICIT,
+    engine: EngineOption = Engine.PANDOC,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
+):
     """List image files included in the given text files"""
-    all_images = set()
-    for text in texts:
-        source = MdFile(text)
-        all_images.update(source.image_sources(select))
-    print("\n".join(relative_fspath(img) for img in all_images))
+    failed = []
+    seen = set()
+    for source in _sources(
+        texts, _cache(no_cache), jobs, failed, engine, select, STREAM_BATCH_SIZE
+    ):
+        _print_new(source.image_sources(select), seen)
+    return 1 if failed else 0
 
 
 @app.command
+@_instrumented
 def dep(
     texts: Texts,
     /,
@@ -85,6 +396,10 @@ def dep(
     individual_dependencies: Annotated[
         str | None, Parameter(["-i", "--individual-dependencies"])
     ] = None,
+    incremental: Annotated[bool, Parameter("--incremental")] = False,
+    engine: EngineOption = Engine.PANDOC,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
 ):
     """
     Print makefile rules for the given text files.
@@ -93,30 +408,124 @@ def dep(
         texts: file or files to analyze. Can actually be anything pandoc is able to read, not only markdown files.
         suffix: suffix for the target rules in the makefile. If you provide multiple suffixes separated by space, a rule will be created for each suffix. You can also provide a pattern using '%'
         individual_dependencies: if provided, write an individual dependenca file with the given suffix for each source file
+        incremental: with --individual-dependencies, skip source files whose dependency file is up to date
     """
-    for text in texts:
-        source = MdFile(text)
-        rules = "\n".join([source.rule(suf) for suf in suffix or []] or [source.rule()])
-        if individual_dependencies:
-            text.with_suffix(individual_dependencies).write_text(rules + "\n")
+    failed = []
+    if individual_dependencies:
+        _write_dep_files(
+            texts,
+            suffix,
+            individual_dependencies,
+            _cache(no_cache),
+            engine,
+            jobs,
+            incremental,
+            failed,
+        )
+        return 1 if failed else 0
+    if incremental:
+        logger.warning("--incremental has no effect without --individual-dependencies")
+    make_rules = partial(
+        _dep_rules, suffix=suffix, cache=_cache(no_cache), engine=engine
+    )
+    if not no_cache and daemon.available():
+        # the server does the parsing, no need for worker processes
+        rule_lists = zip(texts, make_rules(texts, load=_served_infos))
+    else:
+        rule_lists = map_batches(make_rules, texts, jobs, STREAM_BATCH_SIZE)
+    for text, rules in rule_lists:
+        if isinstance(rules, Exception):
+            _report_failure(text, rules, failed)
         else:
-            print(rules)
+            print(rules, flush=True)
+    return 1 if failed else 0
 
 
 @app.command
+@_instrumented
+def ninja(
+    texts: Texts,
+    /,
+    *,
+    suffix: Annotated[list[str], Parameter(["-d", "--suffix"])],
+    rule: Annotated[str, Parameter(["-r", "--rule"])] = "pandoc",
+    output: Annotated[Path | None, Parameter(["-o", "--output"])] = None,
+    dyndep: Annotated[Path, Parameter("--dyndep")] = Path("md-images.dd"),
+    dyndep_only: Annotated[bool, Parameter("--dyndep-only")] = False,
+    engine: EngineOption = Engine.PANDOC,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
+):
+    """
+    Write a ninja build file fragment for the given text files.
+
+    The fragment builds a target for each text and suffix with the given rule, which
+    you define in your build.ninja. It does not list the images: these are written to
+    a dyndep file that ninja keeps up to date by running this command with
+    --dyndep-only, so the fragment only needs to be regenerated when texts are added
+    or removed.
+
+    Args:
+        suffix: suffix for the targets, or a pattern using '%', like for dep. May be given multiple times.
+        rule: name of the ninja rule that builds a target from a text file
+        output: write the fragment to this file instead of stdout, unless it is up to date
+        dyndep: the dyndep file listing the images
+        dyndep_only: do not write the fragment, but parse the texts and write the dyndep file
+    """
+    if dyndep_only:
+        failed = []
+        sources = list(_sources(texts, _cache(no_cache), jobs, failed, engine))
+        if failed:  # ninja needs an entry for every target, so keep the old file
+            return 1
+        write_if_changed(dyndep, ninja_build.dyndep(sources, suffix))
+        return 0
+    command = ["md-images", "ninja", "--dyndep-only"]
+    for suf in suffix:
+        command += ["-d", suf]
+    if engine != Engine.PANDOC:
+        command += ["-e", engine.value]
+    if no_cache:
+        command.append("--no-cache")
+    fragment = ninja_build.manifest(texts, suffix, rule, dyndep, command)
+    if output is None:
+        print(fragment, end="")
+    else:
+        write_if_changed(output, fragment)
+    return 0
+
+
+@app.command
+@_instrumented
 def cp(
     texts: Texts,
     target: Path,
     /,
     select: Select = SourceSelection.SOURCE,
+    link: Annotated[bool, Parameter("--link")] = False,
+    dedupe: Annotated[bool, Parameter("--dedupe")] = False,
+    archive: Annotated[bool, Parameter("--archive")] = False,
+    engine: EngineOption = Engine.PANDOC,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
 ):
     """
     Copy text files including linked image files to the given target.
 
     If a single source file is provided and the target is not an existing directory,
     it is interpreted as the target file name, otherwise it is thought to be a directory.
-    All neccessery directories are created if they do not exist.
+    All neccessery directories are created if they do not exist. Files that are
+    referenced multiple times are copied only once, and files whose copy already has
+    the same size and modification time are skipped.
+
+    Args:
+        link: create hard links instead of copies where possible
+        dedupe: store files with the same content only once, and link the other copies to it
+        archive: write the texts and images into the target archive (.zip, .tar, .tar.gz, .tar.bz2 or .tar.xz), laid out like in a target directory
     """
+    if archive:
+        if link:
+            logger.warning("--link has no effect with --archive")
+        return _cp_archive(texts, target, select, dedupe, engine, jobs, no_cache)
     if target.is_dir():
         target_dir = target
     elif len(texts) > 1 and not target.exists():
@@ -130,16 +539,47 @@ def cp(
         target_dir = target.parent
 
     target_dir.mkdir(parents=True, exist_ok=True)
-    for text in texts:
-        source = MdFile(text)
+    failed = []
+    plan = CopyPlan(
+        CopyMode.LINK if link else CopyMode.COPY,
+        dedupe=dedupe,
+        hash_cache=None if no_cache else HashCache(),
+    )
+    for source in _sources(texts, _cache(no_cache), jobs, failed, engine):
         if target_dir == target:
-            dest = target_dir / text.name
+            dest = target_dir / source.path.name
         else:
             dest = target
-        source.copy(dest, select)
+        source.plan_copy(plan, dest, select)
+    failed.extend(plan.execute())
+    return 1 if failed else 0
+
+
+def _cp_archive(
+    texts: Sequence[Path],
+    archive: Path,
+    select: SourceSelection,
+    dedupe: bool,
+    engine: Engine,
+    jobs: int | None,
+    no_cache: bool,
+) -> int:
+    failed = []
+    plan = CopyPlan(dedupe=dedupe, hash_cache=None if no_cache else HashCache())
+    for source in _sources(texts, _cache(no_cache), jobs, failed, engine, select):
+        # plan_copy treats the current directory as the target directory, the
+        # archive's root; nothing is written there
+        source.plan_copy(plan, Path(), select)
+    try:
+        failed.extend(plan.write_archive(archive))
+    except (OSError, ValueError) as e:
+        logger.error("Could not write %s: %s", archive, e)
+        return 1
+    return 1 if failed else 0
 
 
 @app.command
+@_instrumented
 def check(
     texts: Texts,
     /,
@@ -147,6 +587,11 @@ def check(
     select: Select = SourceSelection.EXPLICIT,
     quiet: Annotated[bool, Parameter(["-q", "--quiet"])] = False,
     verbose: Annotated[bool, Parameter(["-v", "--verbose"])] = False,
+    summary_only: Annotated[bool, Parameter("--summary-only")] = False,
+    remote: Annotated[bool, Parameter("--remote")] = False,
+    engine: EngineOption = Engine.PANDOC,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
 ):
     """
     Checks if all images in the given text files exist.
@@ -154,24 +599,34 @@ def check(
     Args:
         quiet: only list missing files, nothing more
         verbose: also print potential alternatives for missing images
+        summary_only: do not list the missing images, only report their number
+        remote: also check that http(s) image URLs and link targets can be retrieved
     """
-    total_present, total_missing = [], []
-    for text in texts:
-        source = MdFile(text)
-        images = source.image_sources(select)
+    failed = []
+    files = DirectoryIndex(revalidate=False)  # each directory is read only once
+    total_present = total_missing = 0
+    remote_urls: dict[Path, list[str]] = {}
+    if remote:
+        from .remote import is_remote
+    for source in _sources(texts, _cache(no_cache), jobs, failed, engine, select):
+        if remote:
+            urls = [
+                url for url in source.info.images + source.info.links if is_remote(url)
+            ]
+            if urls:
+                remote_urls[source.path] = list(dict.fromkeys(urls))
+        images = source.image_sources(select, index=files)
         present, missing = [], []
         for image in images:
-            if image.exists():
+            if files.exists(image):
                 present.append(image)
             else:
                 missing.append(image)
-        if missing:
+        if missing and not summary_only:
             if verbose:
                 print(f"{source}: {len(missing)} missing images:")
                 for img in missing:
-                    alternatives = [
-                        str(alt) for alt in img.parent.glob(img.stem + ".*")
-                    ]
+                    alternatives = [str(alt) for alt in files.variants(img)]
                     msg = f" - {img}"
                     if alternatives:
                         msg += f' (existing variants: {" ".join(alternatives)})'
@@ -182,27 +637,243 @@ def check(
                 print(
                     f'{source.path}: {len(missing)} missing images: {" ".join(map(str, missing))}'
                 )
-        total_present.extend(present)
-        total_missing.extend(missing)
-    if total_missing:
-        if not quiet:
-            logger.error(
-                "%d images missing, %d present", len(total_missing), len(total_present)
-            )
+        total_present += len(present)
+        total_missing += len(missing)
+    broken_urls = _check_remote(remote_urls, no_cache, quiet, summary_only)
+    if broken_urls and not quiet:
+        logger.error("%d remote URLs broken", broken_urls)
+    if failed and not quiet:
+        logger.error("%d texts could not be read", len(failed))
+    if total_missing or failed or broken_urls:
+        if total_missing and not quiet:
+            logger.error("%d images missing, %d present", total_missing, total_present)
         return 1
     else:
         if not quiet:
-            logger.info("All %d images present", len(total_present))
+            logger.info("All %d images present", total_present)
+        return 0
+
+
+def _check_remote(
+    remote_urls: dict[Path, list[str]], no_cache: bool, quiet: bool, summary_only: bool
+) -> int:
+    """Checks the given texts' remote URLs and reports the broken ones. Returns their number."""
+    if not remote_urls:
         return 0
+    from .remote import RemoteCache, RemoteChecker
+
+    checker = RemoteChecker(None if no_cache else RemoteCache())
+    statuses = checker.check(url for urls in remote_urls.values() for url in urls)
+    broken_urls = 0
+    for text, urls in remote_urls.items():
+        broken = [statuses[url] for url in urls if not statuses[url].ok]
+        broken_urls += len(broken)
+        if not broken or summary_only:
+            continue
+        if quiet:
+            print("\n".join(status.url for status in broken))
+        else:
+            print(
+                f'{text}: {len(broken)} broken remote URLs: {" ".join(map(str, broken))}'
+            )
+    return broken_urls
+
+
+def _print_missing(missing: dict[Path, list[Path]]):
+    for text, images in missing.items():
+        print(
+            f'{text}: {len(images)} missing images: {" ".join(map(relative_fspath, images))}'
+        )
+    if missing:
+        logger.error("%d images missing", sum(map(len, missing.values())))
+    else:
+        logger.info("All images present")
+
+
+@app.command
+def watch(
+    texts: Texts,
+    /,
+    *,
+    select: Select = SourceSelection.EXPLICIT,
+    suffix: Annotated[list[str] | None, Parameter(["-d", "--suffix"])] = None,
+    individual_dependencies: Annotated[
+        str | None, Parameter(["-i", "--individual-dependencies"])
+    ] = None,
+    poll: Annotated[bool, Parameter("--poll")] = False,
+    interval: Annotated[float, Parameter("--interval")] = 0.5,
+    engine: EngineOption = Engine.PANDOC,
+    no_cache: NoCache = False,
+):
+    """
+    Watch the given text files and their images, and report missing images
+    and update dependency files whenever they change.
+
+    Args:
+        suffix: suffix for the target rules in the dependency files, see dep
+        individual_dependencies: keep a dependency file with the given suffix up to date for each text file
+        poll: check for changes by regularly looking at the watched files instead of using inotify
+        interval: seconds between two checks when polling
+    """
+    from .watch import WatchSession, default_watcher, watch_loop
+
+    session = WatchSession(
+        texts,
+        select,
+        suffix,
+        individual_dependencies,
+        _cache(no_cache),
+        engine,
+        report=_print_missing,
+    )
+    logger.info("Watching %d text files, press Ctrl+C to stop", len(texts))
+    try:
+        watch_loop(session, default_watcher(poll, interval))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+IndexFile = Annotated[
+    Path, Parameter("--index", help="The index file, see the index command.")
+]
+
+
+@app.command
+@_instrumented
+def index(
+    texts: Texts,
+    /,
+    *,
+    output: Annotated[Path, Parameter(["-o", "--output"])] = DEFAULT_INDEX,
+    engine: EngineOption = Engine.PANDOC,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
+):
+    """
+    Build an index of the images used by the given text files, for who-uses and orphans.
+
+    Args:
+        output: the index file to write. Paths in the index are relative to its directory.
+    """
+    failed = []
+    image_index = ImageIndex.build(
+        _sources(texts, _cache(no_cache), jobs, failed, engine),
+        root=output.absolute().parent,
+    )
+    image_index.save(output)
+    logger.info(
+        "Indexed %d text files and %d files in total",
+        len(image_index.images),
+        len(image_index.paths),
+    )
+    return 1 if failed else 0
+
+
+@app.command
+def who_uses(
+    images: Annotated[list[Path], Parameter(negative=[])],
+    /,
+    *,
+    exact: Annotated[bool, Parameter("--exact")] = False,
+    index_file: IndexFile = DEFAULT_INDEX,
+):
+    """
+    List the text files that use the given images, according to the index.
+
+    Args:
+        exact: only list texts referencing exactly the given file, not one of its variants
+    """
+    image_index = ImageIndex.load(index_file)
+    found = False
+    for image in images:
+        for text in image_index.who_uses(image, variants=not exact):
+            found = True
+            print(relative_fspath(text))
+    return 0 if found else 1
+
+
+@app.command
+def orphans(
+    directories: Annotated[list[Path], Parameter(negative=[])],
+    /,
+    *,
+    index_file: IndexFile = DEFAULT_INDEX,
+):
+    """
+    List the files in the given directories that no indexed text file uses,
+    neither directly nor as a variant of a referenced file.
+    """
+    image_index = ImageIndex.load(index_file)
+    for directory in directories:
+        for path in image_index.orphans(directory):
+            print(fspath(path))
+    return 0
+
+
+#: A link's deduplication key and its line of tabbed or url output
+KeyedLine = tuple[Hashable, str]
+
+
+def _links(
+    texts: Sequence[Path], format: str, cache: ParseCache | None
+) -> list[list[KeyedLine] | str | Exception]:
+    """
+    Extracts the links from the given texts. Returns, for each text, either keyed
+    lines for the tabbed or url format, or the JSON serialization of a pandoc
+    fragment for all other formats.
+    """
+    if format == "url":
+        return [
+            info if isinstance(info, Exception) else [(url, url) for url in info.links]
+            for info in load_infos(texts, cache)
+        ]
+    from panflute import BulletList, Header, Link, ListItem, Plain, Str
+
+    result: list[list[KeyedLine] | str | Exception] = []
+    for text, doc in zip(texts, load_markdown_batch(texts)):
+        if isinstance(doc, Exception):
+            result.append(doc)
+            continue
+        title = doc.get_metadata("title") or text.stem
+        links: list[Link] = find_all(doc, Link)  # type: ignore
+        if format == "tabbed":
+            lines = []
+            for link in links:
+                key = link_key(link)
+                lines.append((key, "\t".join([str(text), link.url, key[2]])))
+            result.append(lines)
+        else:
+            items = [ListItem(Plain(link)) for link in links]
+            bullet_list = BulletList()
+            bullet_list.content.extend(items)
+            header = Header(Link(Str(title), url=str(text)), level=2)
+            result.append(json.dumps([header.to_json(), bullet_list.to_json()]))
+    return result
+
+
+def _unique_items(bullet_list: "BulletList", seen: set[Hashable]):
+    """Removes the items whose link is in seen from a list built by :func:`_links`."""
+    items = []
+    for item in bullet_list.content:
+        key = link_key(item.content[0].content[0])
+        if key not in seen:
+            seen.add(key)
+            items.append(item)
+    bullet_list.content = items
 
 
 @app.command
+@_instrumented
 def links(
     texts: Texts,
     /,
     format: Annotated[
         Literal["tabbed", "url"] | str, Parameter(["-f", "--format"])
     ] = "tabbed",
+    unique_: Annotated[bool, Parameter("--unique")] = False,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
 ):
     """
     List all links in the given text file.
@@ -212,37 +883,96 @@ def links(
                 of source, URL and title, "url" generates a list of URLs only.
                 Additionally, you can pass any format pandoc is able to
                 generate.
+        unique_: list each link only once, where it first occurs. Links are
+                 the same if they have the same URL, title and text ("url": the same URL).
     """
-    result = []
-    for text in texts:
-        doc = MdFile(text).doc
-        title = doc.get_metadata("title") or text.stem
-        links: list[Link] = find_all(doc, Link)  # type: ignore
-        if format == "url":
-            result.extend(link.url for link in links)
-        elif format == "tabbed":
-            result.extend(
-                "\t".join([str(text), link.url, stringify(link)]) for link in links
-            )
+    cache = _cache(no_cache) if format == "url" else None
+    failed = []
+    seen: set[Hashable] = set()
+    result = []  # pandoc fragments, converted together in the end
+    extract_links = partial(_links, format=format, cache=cache)
+    for text, links in map_batches(extract_links, texts, jobs, STREAM_BATCH_SIZE):
+        if isinstance(links, Exception):
+            _report_failure(text, links, failed)
+        elif isinstance(links, str):
+            from panflute.elements import from_json
+
+            header, bullet_list = json.loads(links, object_hook=from_json)
+            if unique_:
+                _unique_items(bullet_list, seen)
+                if not bullet_list.content:
+                    continue
+            result.extend([header, bullet_list])
         else:
-            items = [ListItem(Plain(link)) for link in links]
-            bullet_list = BulletList()
-            bullet_list.content.extend(items)
-            result.append(Header(Link(Str(title), url=str(text)), level=2))
-            result.append(bullet_list)
+            lines = []
+            for key, line in links:
+                if unique_:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                lines.append(line)
+            if lines:
+                print("\n".join(lines), flush=True)
 
-    if format == "tabbed" or format == "url":
-        print("\n".join(result))
-    else:
-        print(
-            Syntax(
-                convert_text(result, input_format="panflute", output_format=format),
-                format,
-            )
-        )
+    if result:
+        from panflute import convert_text
+
+        output = convert_text(result, input_format="panflute", output_format=format)
+        if _is_terminal():
+            from rich.syntax import Syntax
+
+            print(Syntax(output, format))
+        else:
+            print(output)
+    return 1 if failed else 0
+
+
+@app.command
+def serve(
+    *,
+    socket: Annotated[Path | None, Parameter("--socket")] = None,
+    no_cache: NoCache = False,
+):
+    """
+    Keep texts' images and directory listings in memory and answer queries from other md-images calls.
+
+    While the server is running, ls, dep and check (and other commands that parse texts)
+    ask it instead of parsing the texts themselves, unless they are called with --no-cache.
+    Answers are revalidated by the files' modification times. Stop the server with Ctrl+C.
+
+    Args:
+        socket: the Unix socket to listen on. Defaults to $MD_IMAGES_SOCKET or serve.sock in the cache directory.
+        no_cache: do not read from or write to the parse cache for texts that are not in memory
+    """
+    try:
+        daemon.serve(socket, _cache(no_cache))
+    except OSError as e:
+        logger.error("Could not start the server: %s", e)
+        return 1
+    return 0
+
+
+cache_app = App(name="cache", help="Manage the parse cache.")
+app.command(cache_app)
+
+
+@cache_app.command
+def clear():
+    """Remove all entries from the parse cache."""
+    cache = ParseCache()
+    removed = cache.clear()
+    logger.info("Removed %d entries from %s", removed, cache.directory)
+
+
+@cache_app.command
+def info():
+    """Print location, number of entries and size of the parse cache."""
+    cache = ParseCache()
+    print(f"{cache.directory}: {len(cache)} entries, {cache.size()} bytes")
 
 
 @app.default
+@_instrumented
 def md_images(
     markdown: list[Path],
     /,
@@ -254,6 +984,9 @@ def md_images(
     individual_dependencies: Annotated[
         str | None, Parameter(["-i", "--individual-dependencies"])
     ] = None,
+    engine: EngineOption = Engine.PANDOC,
+    jobs: Jobs = None,
+    no_cache: NoCache = False,
 ):
     """
     Analyze the listed markdown files for images.
@@ -263,23 +996,32 @@ def md_images(
         suffix: suffix for the target rules in the makefile. If you provide multiple suffixes, a rule will be created for each suffix.
 
     """
-    all_dependencies = set()
-    all_rules = []
-    for source_file in markdown:
-        source = MdFile(source_file)
-        if list_:
-            all_dependencies.update(source.image_paths)
-        else:
-            rules = "\n".join(
-                [source.rule(suf) for suf in suffix or []] or [source.rule()]
-            )
-            if individual_dependencies:
-                source_file.with_suffix(individual_dependencies).write_text(
-                    rules + "\n"
-                )
-            all_rules.append(rules)
-    if not individual_dependencies:
-        if list_:
-            print("\n".join(map(str, all_dependencies)))
-        else:
-            print("\n".join(all_rules))
\ No newline at end of file
+    cache = _cache(no_cache)
+    failed = []
+    if list_:
+        seen = set()
+        for source in _sources(
+            markdown, cache, jobs, failed, engine, batch_size=STREAM_BATCH_SIZE
+        ):
+            _print_new(source.image_paths, seen, relative=False)
+    elif individual_dependencies:
+        _write_dep_files(
+            markdown,
+            suffix,
+            individual_dependencies,
+            cache,
+            engine,
+            jobs,
+            False,
+            failed,
+        )
+    else:
+        make_rules = partial(_dep_rules, suffix=suffix, cache=cache, engine=engine)
+        for source_file, rules in map_batches(
+            make_rules, markdown, jobs, STREAM_BATCH_SIZE
+        ):
+            if isinstance(rules, Exception):
+                _report_failure(source_file, rules, failed)
+            else:
+                print(rules, flush=True)
+    return 1 if failed else 0
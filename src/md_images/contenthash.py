@@ -0,0 +1,142 @@
+"""
+Content hashes of files, for finding files with the same content.
+
+Hashing large images is expensive, so the hashes are remembered in a
+:class:`HashCache`, keyed by the file's device, inode, modification time and
+size. As long as none of these change, the file is not read again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Sequence
+
+from .cache import default_cache_dir
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+#: Bump this whenever the format of the hash cache file changes.
+HASH_CACHE_VERSION = 1
+
+#: Entries not used for this many seconds are dropped when the cache is saved
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def _stat_key(st: os.stat_result) -> str:
+    return f"{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+
+class HashCache:
+    """
+    Maps file identities (device, inode, modification time, size) to the
+    SHA-256 hashes of their contents, stored in a single JSON file.
+
+    Args:
+        path: the cache file, defaults to ``hashes.json`` in the :func:`default_cache_dir`
+        max_age: seconds after which unused entries are dropped
+    """
+
+    def __init__(self, path: Path | None = None, max_age: float = DEFAULT_MAX_AGE):
+        self.path = (
+            Path(path) if path is not None else default_cache_dir() / "hashes.json"
+        )
+        self.max_age = max_age
+        self._entries: dict[str, list] | None = None  # key -> [digest, last used]
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, list]:
+        if self._entries is None:
+            entries = {}
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == HASH_CACHE_VERSION:
+                    entries = dict(data["entries"])
+            except FileNotFoundError:
+                pass
+            except (ValueError, TypeError, KeyError, AttributeError):
+                logger.debug("Ignoring corrupt hash cache %s", self.path)
+            self._entries = entries
+        return self._entries
+
+    def get(self, st: os.stat_result) -> str | None:
+        with self._lock:
+            entry = self._load().get(_stat_key(st))
+            if entry is None:
+                return None
+            entry[1] = time.time()
+            return entry[0]
+
+    def put(self, st: os.stat_result, digest: str):
+        with self._lock:
+            self._load()[_stat_key(st)] = [digest, time.time()]
+
+    def save(self):
+        """Writes the cache file, dropping entries that have not been used for max_age."""
+        now = time.time()
+        with self._lock:
+            entries = {
+                key: entry
+                for key, entry in self._load().items()
+                if now - entry[1] < self.max_age
+            }
+        data = json.dumps({"version": HASH_CACHE_VERSION, "entries": entries})
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(
+                "w", dir=self.path.parent, suffix=".tmp", delete=False, encoding="utf-8"
+            ) as f:
+                f.write(data)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            logger.debug("Could not write hash cache %s: %s", self.path, e)
+
+
+def hash_file(path: Path, cache: HashCache | None = None) -> str:
+    """The hex SHA-256 digest of the file's content, from the cache if possible."""
+    st = os.stat(path)
+    if cache is not None:
+        digest = cache.get(st)
+        if digest is not None:
+            stats.count("hash cache hits")
+            return digest
+    with stats.timer("hash"):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+    stats.count("bytes hashed", st.st_size)
+    digest = h.hexdigest()
+    if cache is not None:
+        cache.put(st, digest)
+    return digest
+
+
+def hash_files(
+    paths: Sequence[Path],
+    cache: HashCache | None = None,
+    max_workers: int | None = None,
+) -> list[str | Exception]:
+    """
+    Hashes the given files concurrently (hashlib releases the GIL for large
+    inputs), see :func:`hash_file`. Returns, for each path, its digest or the
+    exception that occurred while hashing it. The cache is saved afterwards.
+    """
+
+    def hash_or_error(path: Path) -> str | Exception:
+        try:
+            return hash_file(path, cache)
+        except OSError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        result = list(executor.map(hash_or_error, paths))
+    if cache is not None:
+        cache.save()
+    return result
@@ -0,0 +1,449 @@
+"""
+Copying many files at once.
+
+A :class:`CopyPlan` collects all files to copy first, so a file that is
+needed by several texts is copied only once. Files whose destination is
+already up to date are skipped, the remaining ones are copied concurrently.
+With deduplication, files with the same content are stored only once, even
+if they come from different paths.
+
+Instead of copying, :meth:`CopyPlan.write_archive` writes the planned files
+into a zip or tar archive, reading each file once and creating no directories.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import stat
+import tarfile
+import zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO
+
+from .contenthash import HashCache, hash_files
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+#: errors of copy_file_range that mean the filesystem does not support it
+_NO_COPY_FILE_RANGE = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.EINVAL,
+    errno.EPERM,
+}
+
+
+#: archive suffixes and the corresponding tarfile compression, "zip" for zip files
+ARCHIVE_FORMATS = {
+    ".zip": "zip",
+    ".tar": "",
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.bz2": "bz2",
+    ".tar.xz": "xz",
+    ".txz": "xz",
+}
+
+#: files with these suffixes are already compressed and stored as they are in zip files
+_COMPRESSED_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".zip"}
+
+
+def archive_format(path: Path) -> str | None:
+    """The format for the archive with the given name, see ARCHIVE_FORMATS."""
+    name = path.name.lower()
+    for suffix, format in ARCHIVE_FORMATS.items():
+        if name.endswith(suffix):
+            return format
+    return None
+
+
+class CopyMode(Enum):
+    """
+    How to transfer files. *copy* copies the file contents, using
+    reflinks or in-kernel copies where the filesystem supports them.
+    *link* creates hard links, falling back to copying across filesystems.
+    """
+
+    COPY = "copy"
+    LINK = "link"
+
+
+def _copy_data(src: Path, dest: Path):
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+                while os.copy_file_range(fsrc.fileno(), fdest.fileno(), 1 << 30):
+                    pass
+            return
+        except OSError as e:
+            if e.errno not in _NO_COPY_FILE_RANGE:
+                raise
+    shutil.copyfile(src, dest)
+
+
+def _detach(dest: Path):
+    """
+    Removes dest if writing to it would also change other files, i.e., if it
+    is a symbolic link or has several hard links (e.g., from deduplication).
+    """
+    try:
+        st = os.lstat(dest)
+    except FileNotFoundError:
+        return
+    if stat.S_ISLNK(st.st_mode) or st.st_nlink > 1:
+        dest.unlink()
+
+
+def copy_file(src: Path, dest: Path):
+    """Copies the file's data and metadata, like shutil.copy2."""
+    _detach(dest)
+    _copy_data(src, dest)
+    shutil.copystat(src, dest)
+    stats.count("bytes copied", dest.stat().st_size)
+
+
+def link_file(src: Path, dest: Path) -> bool:
+    """
+    Replaces dest with a hard link to src. If that is not possible, copies
+    src instead. Returns whether a link has been created.
+    """
+    try:
+        dest.unlink(missing_ok=True)
+        os.link(src, dest)
+        return True
+    except OSError as e:
+        logger.debug("Could not link %s to %s (%s), copying instead", src, dest, e)
+        copy_file(src, dest)
+        return False
+
+
+def dedupe_file(original: Path, dest: Path) -> str:
+    """
+    Replaces dest with a hard link to original, a file with the same content.
+    If that is not possible, creates a relative symbolic link instead.
+    Returns "linked" or "symlinked".
+    """
+    dest.unlink(missing_ok=True)
+    try:
+        os.link(original, dest)
+        return "linked"
+    except OSError as e:
+        logger.debug("Could not link %s to %s (%s), symlinking", dest, original, e)
+    os.symlink(os.path.relpath(original, dest.parent), dest)
+    return "symlinked"
+
+
+def _file_id(path: Path) -> tuple[int, int] | None:
+    """The device and inode of the file at path, or None if there is none."""
+    stats.count("stat calls")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def is_up_to_date(src: Path, dest: Path, mode: CopyMode = CopyMode.COPY) -> bool:
+    """
+    Whether dest is already a copy of src (same size and modification time),
+    or, in link mode, the same file.
+    """
+    stats.count("stat calls", 2)
+    try:
+        src_stat = src.stat()
+        dest_stat = dest.stat()
+    except OSError:
+        return False
+    if mode == CopyMode.LINK:
+        return os.path.samestat(src_stat, dest_stat)
+    return (
+        src_stat.st_size == dest_stat.st_size
+        and src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+    )
+
+
+class CopyPlan:
+    """
+    A deduplicated set of files to copy.
+
+    Args:
+        mode: whether to copy or hard link the files
+        max_workers: number of threads to copy with, default as for ThreadPoolExecutor
+        dedupe: transfer each distinct file content only once. The other
+            destinations with the same content become links to the first one.
+        hash_cache: with dedupe, remember the content hashes here
+    """
+
+    def __init__(
+        self,
+        mode: CopyMode = CopyMode.COPY,
+        max_workers: int | None = None,
+        dedupe: bool = False,
+        hash_cache: HashCache | None = None,
+    ):
+        self.mode = mode
+        self.max_workers = max_workers
+        self.dedupe = dedupe
+        self.hash_cache = hash_cache
+        self._files: dict[str, tuple[Path, Path]] = {}
+
+    def add(self, src: Path, dest: Path):
+        """Plans copying src to dest, unless dest is already planned."""
+        key = os.path.abspath(dest)
+        planned = self._files.get(key)
+        if planned is None:
+            self._files[key] = (src, dest)
+        elif os.path.abspath(planned[0]) != os.path.abspath(src):
+            logger.warning(
+                "Not copying %s to %s, since %s will be copied there",
+                src,
+                dest,
+                planned[0],
+            )
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _transfer(self, src: Path, dest: Path) -> str:
+        with stats.timer("copy"):
+            return self._transfer_file(src, dest)
+
+    def _transfer_file(self, src: Path, dest: Path) -> str:
+        if is_up_to_date(src, dest, self.mode):
+            return "up to date"
+        if self.mode == CopyMode.LINK:
+            return "linked" if link_file(src, dest) else "copied"
+        copy_file(src, dest)
+        return "copied"
+
+    def _duplicates(
+        self, files: list[tuple[Path, Path]]
+    ) -> tuple[list[tuple[Path, Path]], list[tuple[Path, Path, Path]]]:
+        """
+        Splits files into the first file for each content, and the remaining
+        ones as (src, dest, dest of the first file with the same content).
+        """
+        digests = hash_files([src for src, _ in files], self.hash_cache)
+        originals: dict[str, Path] = {}
+        unique, duplicates = [], []
+        for (src, dest), digest in zip(files, digests):
+            if isinstance(digest, Exception):  # reported when copying
+                unique.append((src, dest))
+            elif digest in originals:
+                duplicates.append((src, dest, originals[digest]))
+            else:
+                originals[digest] = dest
+                unique.append((src, dest))
+        return unique, duplicates
+
+    @staticmethod
+    def _split_sources(
+        files: list[tuple[Path, Path]],
+    ) -> tuple[list[tuple[Path, Path]], list[tuple[Path, Path]]]:
+        """
+        Splits off the files whose destination is one of the sources, e.g.,
+        when copying into the source tree. Deduplicating would replace these
+        sources with links, so they are only copied as usual.
+        """
+        sources = {_file_id(src) for src, _ in files} - {None}
+        in_place, rest = [], []
+        for src, dest in files:
+            (in_place if _file_id(dest) in sources else rest).append((src, dest))
+        if in_place:
+            logger.warning(
+                "Not deduplicating %d files whose destination is a source file",
+                len(in_place),
+            )
+        return in_place, rest
+
+    def _link_duplicate(self, original: Path, dest: Path) -> str:
+        with stats.timer("copy"):
+            stats.count("stat calls", 2)
+            try:
+                if os.path.samestat(dest.stat(), original.stat()):
+                    return "up to date"
+            except OSError:
+                pass
+            return dedupe_file(original, dest)
+
+    def write_archive(
+        self, archive: Path, base: Path = Path()
+    ) -> dict[Path, Exception]:
+        """
+        Writes all planned files into the given archive instead of copying
+        them, named by their destination relative to base. If some
+        destinations are outside base (e.g., images referenced as ``../img``),
+        names are relative to the common root of base and all destinations
+        instead, so no name starts with ``..``. The archive's
+        format is chosen by its suffix, see ARCHIVE_FORMATS. With dedupe,
+        files with the same content are stored as hard links in tar archives;
+        zip archives cannot contain links, so they store each file.
+
+        Returns:
+            the files that could not be added, mapped to the exception that occurred
+
+        Raises:
+            ValueError: if the archive's suffix is not supported
+            OSError: if the archive cannot be written
+        """
+        format = archive_format(archive)
+        if format is None:
+            raise ValueError(
+                f"unsupported archive format, use one of {', '.join(ARCHIVE_FORMATS)}"
+            )
+        root = os.path.commonpath(
+            [os.path.abspath(base), *self._files]  # keys are absolute destinations
+        )
+        files = sorted(
+            (
+                (src, os.path.relpath(key, root))
+                for key, (src, _) in self._files.items()
+            ),
+            key=lambda file: file[1],
+        )
+        duplicates = []
+        if self.dedupe and format != "zip":
+            files, duplicates = self._duplicates(files)
+        failed: dict[Path, Exception] = {}
+        counts = Counter()
+        partial = archive.with_name(f".{archive.name}.tmp")
+        try:
+            with open(partial, "wb") as f, stats.timer("archive"):
+                if format == "zip":
+                    self._write_zip(f, files, failed, counts)
+                else:
+                    self._write_tar(f, format, files, duplicates, failed, counts)
+            os.replace(partial, archive)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        logger.info(
+            "%d files archived, %d deduplicated in %s",
+            counts["archived"],
+            counts["deduplicated"],
+            archive,
+        )
+        return failed
+
+    @staticmethod
+    def _write_zip(
+        f: BinaryIO,
+        files: list[tuple[Path, str]],
+        failed: dict[Path, Exception],
+        counts: Counter,
+    ):
+        with zipfile.ZipFile(f, "w", strict_timestamps=False) as zf:
+            for src, name in files:
+                compression = (
+                    zipfile.ZIP_STORED
+                    if Path(name).suffix.lower() in _COMPRESSED_SUFFIXES
+                    else zipfile.ZIP_DEFLATED
+                )
+                try:
+                    zf.write(src, name, compress_type=compression)
+                except (OSError, ValueError) as e:
+                    logger.error("Could not archive %s: %s", src, e)
+                    failed[src] = e
+                else:
+                    stats.count("bytes archived", zf.getinfo(name).file_size)
+                    counts["archived"] += 1
+
+    @staticmethod
+    def _write_tar(
+        f: BinaryIO,
+        format: str,
+        files: list[tuple[Path, str]],
+        duplicates: list[tuple[Path, str, str]],
+        failed: dict[Path, Exception],
+        counts: Counter,
+    ):
+        with tarfile.open(fileobj=f, mode=f"w:{format}", dereference=True) as tf:
+            for src, name in files:
+                try:
+                    info = tf.gettarinfo(src, name)
+                    with open(src, "rb") as data:
+                        tf.addfile(info, data)
+                except OSError as e:
+                    logger.error("Could not archive %s: %s", src, e)
+                    failed[src] = e
+                else:
+                    stats.count("bytes archived", info.size)
+                    counts["archived"] += 1
+            original_sources = {name: src for src, name in files}
+            for src, name, original in duplicates:
+                if original_sources[original] in failed:
+                    failed[src] = failed[original_sources[original]]
+                    continue
+                try:
+                    info = tf.gettarinfo(src, name)
+                except OSError as e:
+                    logger.error("Could not archive %s: %s", src, e)
+                    failed[src] = e
+                    continue
+                info.type = tarfile.LNKTYPE
+                info.linkname = original
+                info.size = 0
+                tf.addfile(info)
+                counts["deduplicated"] += 1
+
+    def execute(self) -> dict[Path, Exception]:
+        """
+        Copies all planned files. Returns the files that could not be copied,
+        mapped to the exception that occurred.
+        """
+        files = list(self._files.values())
+        for directory in {dest.parent for _, dest in files}:
+            directory.mkdir(parents=True, exist_ok=True)
+        duplicates = []
+        if self.dedupe:
+            in_place, files = self._split_sources(files)
+            files, duplicates = self._duplicates(files)
+            files.extend(in_place)
+        counts = Counter()
+        failed: dict[Path, Exception] = {}
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            futures = [executor.submit(self._transfer, *file) for file in files]
+            for (src, dest), future in zip(files, futures):
+                try:
+                    status = future.result()
+                except OSError as e:
+                    logger.error("Could not copy %s to %s: %s", src, dest, e)
+                    failed[src] = e
+                else:
+                    logger.debug("%s %s to %s", status, src, dest)
+                    counts[status] += 1
+            # only now all originals are in place
+            original_sources = {dest: src for src, dest in files}
+            link_futures = {
+                dest: executor.submit(self._link_duplicate, original, dest)
+                for _, dest, original in duplicates
+                if original_sources[original] not in failed
+            }
+            for src, dest, original in duplicates:
+                if dest not in link_futures:
+                    failed[src] = failed[original_sources[original]]
+                    continue
+                try:
+                    status = link_futures[dest].result()
+                except OSError as e:
+                    logger.error("Could not link %s to %s: %s", dest, original, e)
+                    failed[src] = e
+                else:
+                    logger.debug(
+                        "%s %s to %s (same as %s)", status, src, dest, original
+                    )
+                    counts["deduplicated" if status != "up to date" else status] += 1
+        logger.info(
+            "%d files copied, %d linked, %d deduplicated, %d up to date",
+            counts["copied"],
+            counts["linked"],
+            counts["deduplicated"],
+            counts["up to date"],
+        )
+        return failed
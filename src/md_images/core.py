@@ -1,46 +1,223 @@
+from __future__ import annotations
+
+import json
+import logging
 import shlex
+from collections import defaultdict
+from dataclasses import dataclass, field
 from os import fspath
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import Iterable, List, Type, TypeVar, Union
+from shutil import which
+from subprocess import PIPE, Popen
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+)
 from urllib.parse import urlparse
 
-import panflute as pf
+from .dirindex import directory_index
+from .server import convert_json
+from .stats import stats
+
+if TYPE_CHECKING:
+    import panflute as pf
+
+logger = logging.getLogger(__name__)
+
+#: The input formats pandoc can read, as in ``panflute.tools.RAW_FORMATS``. Copied,
+#: since importing panflute takes longer than many md-images runs with a warm cache.
+_INPUT_FORMATS = frozenset("""
+    commonmark context creole docbook docx dokuwiki epub fb2 gfm haddock html icml
+    ipynb jats json latex man markdown markdown_github markdown_mmd
+    markdown_phpextra markdown_strict mediawiki muse native noteref odt opendocument
+    openxml opml org rst rtf t2t tex textile tikiwiki twiki vimwiki
+    """.split())
+
+
+def guess_format(markdown: Path) -> str:
+    """Returns the pandoc input format for the given file, based on its suffix."""
+    if markdown.suffix[1:] in _INPUT_FORMATS:
+        return markdown.suffix[1:]
+    return "markdown"
 
 
 def load_markdown(markdown: Path, input_format: str | None = None) -> pf.Doc:
-    if input_format is None and markdown.suffix[1:] in pf.tools.RAW_FORMATS:
-        input_format = markdown.suffix[1:]
+    import panflute as pf
+
+    text, input_format, title = _read_source(markdown, input_format)
+    doc = _tree(_pandoc_json(text, input_format))
+    if title is not None and "title" not in doc.metadata:
+        doc.metadata["title"] = pf.MetaString(title)
+    return doc
+
+
+def load_json(markdown: Path, input_format: str | None = None) -> dict:
+    """
+    Like :func:`load_markdown`, but returns pandoc's JSON representation of
+    the document as plain Python objects, without building the panflute tree.
+    """
+    text, input_format, title = _read_source(markdown, input_format)
+    ast = json.loads(_pandoc_json(text, input_format))
+    if title is not None:
+        ast["meta"].setdefault("title", {"t": "MetaString", "c": title})
+    return ast
+
+
+def _read_source(
+    markdown: Path, input_format: str | None
+) -> tuple[str, str, str | None]:
+    """Returns the text to pass to pandoc, its format and a default title."""
     if input_format is None:
-        input_format = "markdown"
+        input_format = guess_format(markdown)
     if input_format == "ipynb":
-        return _load_notebook(markdown)
-    return pf.convert_text(
-        markdown.read_text(encoding="utf-8"), input_format=input_format, standalone=True
-    )
+        text, title = notebook_markdown(markdown)
+        return text, "markdown", title
+    return markdown.read_text(encoding="utf-8"), input_format, None
 
 
-def _load_notebook(notebook: Path) -> pf.Doc:
-    with TemporaryDirectory() as tmp:
-        from subprocess import run
-
-        run(
-            [
-                "jupyter",
-                "nbconvert",
-                "--to",
-                "html",
-                "--output-dir",
-                tmp,
-                fspath(notebook),
-            ],
-            capture_output=True,
-            check=True,
-        )
-        return load_markdown(Path(tmp, notebook.name).with_suffix(".html"), "html")
+def _pandoc_json(text: str, input_format: str) -> str:
+    stats.count("pandoc calls")
+    stats.count("bytes parsed", len(text.encode("utf-8")))
+    with stats.timer("pandoc"):
+        return convert_json(text, input_format)
+
+
+def _tree(ast: str) -> pf.Doc:
+    from panflute.elements import from_json
+
+    with stats.timer("panflute tree"):
+        return json.loads(ast, object_hook=from_json)
+
+
+def notebook_markdown(notebook: Path) -> tuple[str, str]:
+    """
+    Reads a Jupyter notebook and returns the text of its markdown cells and its
+    title, without running jupyter.
+
+    Code cells and their outputs are skipped, so generated images are never
+    reported, like with :func:`_is_generated_image`. Images attached to markdown
+    cells are referenced with ``attachment:`` URLs and are thus not files.
+    The title is taken from the notebook's metadata or its file name.
+    """
+    with notebook.open(encoding="utf-8") as f:
+        nb = json.load(f)
+    cells = nb.get("cells")
+    if cells is None:  # nbformat 3
+        cells = [cell for ws in nb.get("worksheets", []) for cell in ws["cells"]]
+    sources = []
+    for cell in cells:
+        if cell.get("cell_type") == "markdown":
+            source = cell.get("source", "")
+            sources.append(source if isinstance(source, str) else "".join(source))
+    title = nb.get("metadata", {}).get("title") or notebook.stem
+    return "\n\n".join(sources), title
+
+
+_BATCH_SCRIPT = Path(__file__).with_name("batch.lua")
+_batch_supported = True
+
+D = TypeVar("D", "pf.Doc", dict)
+
+
+def load_markdown_batch(
+    markdowns: Sequence[Path], input_format: str | None = None
+) -> List[Union[pf.Doc, Exception]]:
+    """
+    Loads many documents, running a single pandoc process per input format.
+
+    Each document is still parsed on its own, so the result is the same as
+    calling :func:`load_markdown` for each file. If pandoc cannot run the
+    batch script (it requires pandoc 3 or newer), the files are loaded
+    one by one.
+
+    Returns:
+        for each of the given files, either the document or the exception
+        that occurred while loading it.
+    """
+    return _load_batch(markdowns, input_format, load_markdown, _tree)
+
+
+def load_json_batch(
+    markdowns: Sequence[Path], input_format: str | None = None
+) -> List[Union[dict, Exception]]:
+    """Like :func:`load_markdown_batch`, but returns the documents like :func:`load_json`."""
+    return _load_batch(markdowns, input_format, load_json, json.loads)
+
+
+def _load_batch(
+    markdowns: Sequence[Path],
+    input_format: str | None,
+    load: Callable[[Path, str], D],
+    parse: Callable[[str], D],
+) -> List[Union[D, Exception]]:
+    result: list = [None] * len(markdowns)
+    groups = defaultdict(list)
+    for index, markdown in enumerate(markdowns):
+        groups[input_format or guess_format(markdown)].append(index)
+    for format_, indexes in groups.items():
+        paths = [markdowns[index] for index in indexes]
+        docs = None
+        if _batch_supported and format_ != "ipynb" and len(paths) > 1:
+            try:
+                docs = [
+                    doc if isinstance(doc, Exception) else parse(doc)
+                    for doc in _convert_batch(paths, format_)
+                ]
+            except OSError as e:
+                logger.debug("Batch conversion failed, falling back: %s", e)
+        if docs is None:
+            docs = []
+            for path in paths:
+                try:
+                    docs.append(load(path, format_))
+                except Exception as e:
+                    docs.append(e)
+        for index, doc in zip(indexes, docs):
+            result[index] = doc
+    return result
+
+
+def _convert_batch(
+    markdowns: Sequence[Path], input_format: str
+) -> List[Union[str, Exception]]:
+    """Runs the batch script, returns the JSON text or an exception for each file."""
+    global _batch_supported
+    pandoc = which("pandoc")
+    if pandoc is None:
+        raise OSError("pandoc not found")
+    for markdown in markdowns:
+        try:
+            stats.count("bytes parsed", markdown.stat().st_size)
+        except OSError:
+            pass
+    proc = Popen(
+        [pandoc, "lua", fspath(_BATCH_SCRIPT), input_format],
+        stdin=PIPE,
+        stdout=PIPE,
+        stderr=PIPE,
+    )
+    paths = "\0".join(fspath(markdown) for markdown in markdowns)
+    stats.count("pandoc calls")
+    with stats.timer("pandoc"):
+        out, err = proc.communicate(paths.encode("utf-8"))
+    # one document per line; pandoc's JSON may contain other line breaks like U+2028
+    lines = out.decode("utf-8").rstrip("\n").split("\n") if out else []
+    if proc.returncode != 0 or len(lines) != len(markdowns):
+        if not lines:
+            _batch_supported = False
+        raise OSError(err.decode("utf-8", errors="replace"))
+    return [OSError(line[1:]) if line.startswith("!") else line for line in lines]
 
 
-T = TypeVar("T", pf.Element, pf.Image)
+T = TypeVar("T", "pf.Element", "pf.Image")
 
 
 def find_all(doc: pf.Doc, cls: Type[T]) -> List[T]:
@@ -50,7 +227,8 @@ def find_all(doc: pf.Doc, cls: Type[T]) -> List[T]:
         if isinstance(elem, cls):
             result.append(elem)
 
-    doc.walk(collect)
+    with stats.timer("walk"):
+        doc.walk(collect)
     return result
 
 
@@ -63,12 +241,178 @@ def _is_generated_image(img: pf.Image) -> bool:
 
 
 def find_images(doc: pf.Doc, filter_outputs=True) -> List[pf.Image]:
+    import panflute as pf
+
     result = find_all(doc, pf.Image)
     if filter_outputs:
         result = [img for img in result if not _is_generated_image(img)]
     return result
 
 
+@dataclass
+class DocInfo:
+    """
+    The parts of a document md-images actually needs, in a form that
+    can be stored without keeping the document tree around.
+
+    Attributes:
+        images: URLs of all images that are not generated output, in document order
+        links: URLs of all links, in document order
+        title: the stringified title metadata, if any
+    """
+
+    images: List[str] = field(default_factory=list)
+    links: List[str] = field(default_factory=list)
+    title: Optional[str] = None
+
+    @classmethod
+    def from_json(cls, ast: dict) -> "DocInfo":
+        with stats.timer("json walk"):
+            images, links = find_json_targets(ast)
+        title = None
+        if "title" in ast.get("meta", {}):
+            # only the title is converted to panflute, for pf.stringify
+            from panflute.elements import from_json as pf_from_json
+
+            meta = {
+                "pandoc-api-version": ast["pandoc-api-version"],
+                "meta": {"title": ast["meta"]["title"]},
+                "blocks": [],
+            }
+            title = _title(json.loads(json.dumps(meta), object_hook=pf_from_json))
+        return cls(images=images, links=links, title=title)
+
+    @classmethod
+    def from_doc(cls, doc: pf.Doc) -> "DocInfo":
+        import panflute as pf
+
+        return cls(
+            images=[img.url for img in find_images(doc)],
+            links=[link.url for link in find_all(doc, pf.Link)],
+            title=_title(doc),
+        )
+
+
+def _title(doc: pf.Doc) -> Optional[str]:
+    import panflute as pf
+
+    try:
+        return pf.stringify(doc.metadata["title"])
+    except Exception:
+        return None
+
+
+def find_json_targets(ast: dict, filter_outputs=True) -> tuple[List[str], List[str]]:
+    """
+    Finds the image and link URLs in a document in pandoc's JSON format,
+    without building the panflute tree.
+
+    The result is the same as collecting the urls of :func:`find_images` and of
+    all links from the corresponding panflute document, in the same order:
+    Like :func:`_is_generated_image`, images whose grandparent element has the
+    class *output* are skipped if filter_outputs is true.
+
+    Returns:
+        the list of image URLs and the list of link URLs
+    """
+    images: List[str] = []
+    links: List[str] = []
+
+    # Each visitor gets the node's JSON contents, the classes of the node's
+    # parent element and the classes of its grandparent element. For
+    # elements without attributes, the classes are None.
+
+    def children(items: list, own: list | None, parent: list | None):
+        for item in items:
+            visit(item, own, parent)
+
+    def visit(elem: dict, parent: list | None, grandparent: list | None):
+        tag = elem["t"]
+        c = elem.get("c")
+        if tag in _JSON_CONTAINERS:
+            children(c, None, parent)
+        elif tag == "Image" or tag == "Link":
+            children(c[1], c[0][1], parent)
+            if tag == "Link":
+                links.append(c[2][0])
+            elif not (
+                filter_outputs and grandparent is not None and "output" in grandparent
+            ):
+                images.append(c[2][0])
+        elif tag == "Span" or tag == "Div":
+            children(c[1], c[0][1], parent)
+        elif tag == "Header":
+            children(c[2], c[1][1], parent)
+        elif tag == "Quoted":
+            children(c[1], None, parent)
+        elif tag == "LineBlock" or tag == "BulletList":
+            for item in c:  # LineItem / ListItem
+                children(item, None, None)
+        elif tag == "OrderedList":
+            for item in c[1]:
+                children(item, None, None)
+        elif tag == "DefinitionList":
+            for term, definitions in c:  # DefinitionItem
+                children(term, None, None)
+                for definition in definitions:
+                    children(definition, None, None)
+        elif tag == "Cite":
+            children(c[1], None, parent)
+            for citation in c[0]:
+                children(citation["citationPrefix"], None, None)
+                children(citation["citationSuffix"], None, None)
+        elif tag == "Figure":
+            children(c[2], c[0][1], parent)
+            caption(c[1], c[0][1])
+        elif tag == "Table":
+            own = c[0][1]
+            head, bodies, foot = c[3], c[4], c[5]
+            rows(head[1])
+            for body in bodies:
+                rows(body[3])
+                rows(body[2])
+            rows(foot[1])
+            caption(c[1], own)
+        elif tag == "MetaMap":
+            for value in c.values():
+                visit(value, None, None)
+        elif tag == "MetaList":
+            children(c, None, None)
+
+    def caption(caption: list, parent: list | None):
+        short, blocks = caption
+        children(blocks, None, parent)
+        if short:
+            children(short, None, parent)
+
+    def rows(rows: list):
+        for row_attr, cells in rows:
+            for cell in cells:
+                children(cell[4], cell[0][1], row_attr[1])
+
+    for value in ast.get("meta", {}).values():
+        visit(value, None, None)
+    children(ast["blocks"], None, None)
+    return images, links
+
+
+_JSON_CONTAINERS = {
+    "Plain",
+    "Para",
+    "BlockQuote",
+    "Emph",
+    "Underline",
+    "Strong",
+    "Strikeout",
+    "Superscript",
+    "Subscript",
+    "SmallCaps",
+    "Note",
+    "MetaInlines",
+    "MetaBlocks",
+}
+
+
 def resolve_url(url: str, markdown: Path) -> Union[Path, str]:
     """
     Resolves an URL that has been found in the given source file.
@@ -104,18 +448,34 @@ def deppattern(pattern: str, markdown: Path) -> Union[str, Path]:
         return markdown.with_suffix(pattern)
 
 
-def unique(items: Iterable[T]) -> list[T]:
+def link_key(elem: pf.Link | pf.Image) -> tuple[str, str, str]:
+    """
+    Identifies a link or image by its URL, title and text, for :func:`unique`.
+    Two elements differing only in the formatting of their text are considered equal.
+    """
+    from panflute import stringify
+
+    return elem.url, elem.title, stringify(elem)
+
+
+def unique(items: Iterable[T], key: Callable[[T], Hashable] = repr) -> list[T]:
+    """
+    The items in their original order, without those whose key has been seen before.
+    """
     result = []
     seen = set()
     for item in items:
-        if repr(item) not in seen:
+        item_key = key(item)
+        if item_key not in seen:
             result.append(item)
-            seen.add(repr(item))
+            seen.add(item_key)
     return result
 
 
 def list_urls(doc: pf.Doc, output_format="markdown") -> str:
-    links = unique(find_all(doc, pf.Link))
+    import panflute as pf
+
+    links = unique(find_all(doc, pf.Link), key=link_key)
     if output_format == "url":
         return "\n".join(link.url for link in links)
     elif output_format == "tabbed":
@@ -133,7 +493,7 @@ def add_variants(images: Iterable[Path]) -> list[Path]:
     result = []
     for orig in images:
         result.append(orig)
-        result.extend(orig.parent.glob(orig.stem + ".*"))
+        result.extend(directory_index.variants(orig))
     return result
 
 
@@ -0,0 +1,275 @@
+"""
+A long-running md-images process answering queries over a Unix socket.
+
+Even with the parse cache, every md-images call pays for starting Python,
+reading cache entries and listing directories. ``md-images serve`` runs a
+:class:`QueryServer` that keeps the information extracted from each text and
+the directory listings used for finding image variants in memory. Entries are
+revalidated by the text's modification time and size, listings by the
+directory's modification time, so the answers are always current.
+
+``ls``, ``dep`` and ``check`` ask the server via :func:`query` if its socket
+exists, and do the work themselves if there is no server or it fails.
+
+The protocol is one JSON object per line: the client sends a request like
+``{"version": 1, "op": "load", "cwd": ..., "texts": [...], "engine": "pandoc",
+"select": "source"}`` and receives ``{"results": [...]}`` with one entry per
+text: either ``{"info": {...}, "sources": [...]}`` (sources only if a
+selection has been requested) or ``{"error": "message"}``.
+"""
+
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+from dataclasses import asdict
+from pathlib import Path
+from typing import Sequence
+
+from .cache import ParseCache, default_cache_dir
+from .core import DocInfo
+from .model import Engine, MdFile, SourceSelection, load_infos
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+#: Bump this whenever the protocol changes incompatibly.
+PROTOCOL_VERSION = 1
+
+#: Seconds the client waits for the server to accept the connection
+CONNECT_TIMEOUT = 1.0
+
+#: Seconds the client waits for an answer; parsing many new texts may take a while
+RESPONSE_TIMEOUT = 600.0
+
+#: The environment variable overriding :func:`default_socket`
+SOCKET_VARIABLE = "MD_IMAGES_SOCKET"
+
+
+class ServerError(OSError):
+    """The server could not be reached or gave an unusable answer."""
+
+
+def default_socket() -> Path:
+    """The server's socket: $MD_IMAGES_SOCKET, or ``serve.sock`` in the cache directory."""
+    path = os.environ.get(SOCKET_VARIABLE)
+    return Path(path) if path else default_cache_dir() / "serve.sock"
+
+
+class _Entry:
+    __slots__ = ("mtime_ns", "size", "source")
+
+    def __init__(self, st: os.stat_result, source: MdFile):
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.source = source
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "QueryServer"
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("version") != PROTOCOL_VERSION:
+                response = {"error": f"protocol version {PROTOCOL_VERSION} required"}
+            elif request.get("op") == "load":
+                response = {"results": self.server.load(request)}
+            else:
+                response = {"error": f"unknown operation {request.get('op')!r}"}
+        except Exception as e:  # report, never kill the server
+            logger.exception("Could not answer request")
+            response = {"error": str(e) or repr(e)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Answers queries about texts from memory, see the module documentation.
+
+    Args:
+        path: the socket to listen on. A stale socket file is replaced.
+        cache: the parse cache used for texts that are not in memory yet
+
+    Raises:
+        ServerError: if another server is already listening on path
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: Path | None = None, cache: ParseCache | None = None):
+        self.path = Path(path) if path is not None else default_socket()
+        self.cache = cache
+        self._entries: dict[tuple[Path, Engine], _Entry] = {}
+        self._lock = threading.Lock()
+        if available(self.path):
+            raise ServerError(f"A server is already listening on {self.path}")
+        if self.path.exists():
+            self.path.unlink()  # left behind by a server that died
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(os.fspath(self.path), _Handler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+    def sources(
+        self, texts: Sequence[Path], engine: Engine
+    ) -> list[MdFile | Exception]:
+        """The (absolute) texts, with their information loaded if they have changed."""
+        result: list = [None] * len(texts)
+        misses = []
+        for index, text in enumerate(texts):
+            try:
+                st = os.stat(text)
+            except OSError as e:
+                result[index] = e
+                continue
+            entry = self._entries.get((text, engine))
+            if (
+                entry is not None
+                and entry.mtime_ns == st.st_mtime_ns
+                and entry.size == st.st_size
+            ):
+                stats.count("server hits")
+                result[index] = entry.source
+            else:
+                misses.append((index, st))
+        if misses:
+            with self._lock:  # the parse cache and pandoc are not shared by threads
+                infos = load_infos([texts[i] for i, _ in misses], self.cache, engine)
+            for (index, st), info in zip(misses, infos):
+                if isinstance(info, Exception):
+                    result[index] = info
+                else:
+                    source = MdFile(texts[index], info=info)
+                    self._entries[texts[index], engine] = _Entry(st, source)
+                    result[index] = source
+        return result
+
+    def load(self, request: dict) -> list[dict]:
+        cwd = Path(request["cwd"])
+        engine = Engine(request.get("engine", Engine.PANDOC.value))
+        select = request.get("select")
+        texts = [cwd / text for text in request["texts"]]
+        results = []
+        for source in self.sources(texts, engine):
+            if isinstance(source, Exception):
+                results.append({"error": str(source) or repr(source)})
+                continue
+            result = {"info": asdict(source.info)}
+            if select is not None:
+                images = source.image_sources(SourceSelection(select))
+                result["sources"] = [os.fspath(path) for path in images]
+            results.append(result)
+        return results
+
+
+def serve(path: Path | None = None, cache: ParseCache | None = None):
+    """Runs a :class:`QueryServer` until interrupted."""
+    with QueryServer(path, cache) as server:
+        logger.info("Listening on %s", server.path)
+        # shutdown() waits for serve_forever() to return, so call it from another thread
+        signal.signal(
+            signal.SIGTERM,
+            lambda *_: threading.Thread(target=server.shutdown).start(),
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def _request(path: Path, request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(os.fspath(path))
+        sock.settimeout(RESPONSE_TIMEOUT)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ServerError("The server closed the connection")
+    response = json.loads(line)
+    if "error" in response:
+        raise ServerError(response["error"])
+    return response
+
+
+def query(
+    texts: Sequence[Path],
+    engine: Engine = Engine.PANDOC,
+    select: SourceSelection | None = None,
+    path: Path | None = None,
+) -> list[MdFile | Exception] | None:
+    """
+    Asks the server for the given texts' information and, if select is given,
+    their image sources.
+
+    Returns:
+        for each text, either the MdFile or the exception that occurred while
+        loading it; None if there is no server or it could not answer.
+    """
+    path = path if path is not None else default_socket()
+    if not path.exists():
+        return None
+    cwd = Path.cwd()
+    request = {
+        "version": PROTOCOL_VERSION,
+        "op": "load",
+        "cwd": os.fspath(cwd),
+        "texts": [os.fspath(text) for text in texts],
+        "engine": engine.value,
+        "select": None if select is None else select.value,
+    }
+    try:
+        with stats.timer("server query"):
+            response = _request(path, request)
+        results = []
+        for text, result in zip(texts, response["results"], strict=True):
+            if "error" in result:
+                results.append(ServerError(result["error"]))
+                continue
+            info = DocInfo(**result["info"])
+            sources = None
+            if select is not None:
+                sources = {select: _client_paths(text, info, cwd, result["sources"])}
+            results.append(MdFile(text, info=info, sources=sources))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.debug("Not using the server at %s: %s", path, e)
+        return None
+    return results
+
+
+def available(path: Path | None = None) -> bool:
+    """Whether a server is listening on the given socket."""
+    path = path if path is not None else default_socket()
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(os.fspath(path))
+    except OSError:
+        return False
+    return True
+
+
+def _client_paths(text: Path, info: DocInfo, cwd: Path, paths: list[str]) -> set[Path]:
+    """
+    Maps image sources the server found for cwd / text to the paths md-images
+    would have found for text itself. Each source is in the directory of one of
+    the text's image paths.
+    """
+    directories = {
+        cwd / path.parent: path.parent for path in MdFile(text, info=info).image_paths
+    }
+    result = set()
+    for path in map(Path, paths):
+        parent = directories.get(path.parent)
+        result.add(path if parent is None else parent / path.name)
+    return result
@@ -0,0 +1,59 @@
+"""
+Helpers for individual dependency files.
+
+Dependency files written in incremental mode start with a comment that records
+a hash of the source file and of the options used to generate the rules (target
+suffixes, engine, image selection and the directory the paths are relative
+to). As long as both match, the rules cannot have changed, so the source does
+not need to be parsed again.
+"""
+
+import json
+import os
+from hashlib import sha256
+from pathlib import Path
+
+HEADER_PREFIX = "# md-images-dep "
+
+
+def dep_header(
+    content: bytes,
+    suffixes: list[str] | None = None,
+    engine: str = "pandoc",
+    select: str = "explicit",
+    base: Path | None = None,
+) -> str:
+    """
+    The header line for a dependency file of a source with the given content,
+    generated with the given target suffixes, engine and image selection, with
+    paths relative to base (default: the current directory).
+    """
+    base = (base or Path.cwd()).resolve()
+    options = json.dumps([suffixes or [], engine, select, os.fspath(base)])
+    options_hash = sha256(options.encode("utf-8")).hexdigest()[:16]
+    return f"{HEADER_PREFIX}{sha256(content).hexdigest()} {options_hash}\n"
+
+
+def read_header(depfile: Path) -> str | None:
+    """The header line of the given dependency file, if it exists and has one."""
+    try:
+        with depfile.open(encoding="utf-8") as f:
+            line = f.readline()
+    except (OSError, UnicodeDecodeError):
+        return None
+    return line if line.startswith(HEADER_PREFIX) else None
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """
+    Writes content to path unless the file already has exactly this content,
+    so the modification time of unchanged files is preserved. Returns whether
+    the file has been written.
+    """
+    try:
+        if path.read_text(encoding="utf-8") == content:
+            return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    path.write_text(content, encoding="utf-8")
+    return True
@@ -0,0 +1,118 @@
+"""
+An in-memory index of directory listings.
+
+Looking for the variants of many images in the same directory with
+``path.parent.glob(path.stem + ".*")`` scans the directory once per image.
+The :class:`DirectoryIndex` lists each directory only once and maps each
+possible stem to the files starting with it. A listing is reused as long as
+the directory's modification time does not change.
+
+Existence answers agree with :meth:`Path.exists`: names that are symbolic
+links, or that only match a listed name when ignoring case (as on
+case-insensitive filesystems), are checked with a stat call.
+"""
+
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import NamedTuple
+
+from .stats import stats
+
+
+class _Listing(NamedTuple):
+    mtime_ns: int
+    names: frozenset[str]
+    symlinks: frozenset[str]
+    folded: frozenset[str]  # casefolded names
+    by_stem: dict[str, list[str]]
+
+
+class DirectoryIndex:
+    """
+    Answers existence and variant queries from cached directory listings.
+
+    Args:
+        revalidate: check the directory's modification time on each query, so
+            changes are noticed. Without, each directory is read only once,
+            which is enough for a single pass over a tree that does not change.
+    """
+
+    def __init__(self, revalidate: bool = True):
+        self.revalidate = revalidate
+        self._listings: dict[Path, _Listing | None] = {}
+
+    def _listing(self, directory: Path) -> _Listing | None:
+        if not self.revalidate and directory in self._listings:
+            return self._listings[directory]
+        stats.count("stat calls")
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            if self.revalidate:
+                self._listings.pop(directory, None)
+            else:
+                self._listings[directory] = None
+            return None
+        listing = self._listings.get(directory)
+        if listing is not None and listing.mtime_ns == mtime_ns:
+            return listing
+        stats.count("directory scans")
+        try:
+            with os.scandir(directory) as entries:
+                symlinks = set()
+                names = set()
+                for entry in entries:
+                    names.add(entry.name)
+                    if entry.is_symlink():
+                        symlinks.add(entry.name)
+        except OSError:
+            if not self.revalidate:
+                self._listings[directory] = None
+            return None
+        by_stem = defaultdict(list)
+        for name in names:
+            dot = name.find(".", 1)
+            while dot > 0:
+                by_stem[name[:dot]].append(name)
+                dot = name.find(".", dot + 1)
+        listing = _Listing(
+            mtime_ns,
+            frozenset(names),
+            frozenset(symlinks),
+            frozenset(name.casefold() for name in names),
+            dict(by_stem),
+        )
+        self._listings[directory] = listing
+        return listing
+
+    def exists(self, path: Path) -> bool:
+        """Whether the given file or directory exists, like :meth:`Path.exists`."""
+        listing = self._listing(path.parent)
+        if listing is None:
+            return False
+        name = path.name
+        if name in listing.names and name not in listing.symlinks:
+            return True
+        if name in listing.symlinks or name.casefold() in listing.folded:
+            stats.count("stat calls")
+            return path.exists()  # broken link, or case-insensitive filesystem
+        return False
+
+    def variants(self, path: Path) -> list[Path]:
+        """
+        All files in path's directory with path's stem and any suffix,
+        like ``path.parent.glob(path.stem + ".*")`` but without glob
+        patterns in the stem.
+        """
+        listing = self._listing(path.parent)
+        if listing is None:
+            return []
+        return [path.parent / name for name in listing.by_stem.get(path.stem, [])]
+
+    def clear(self):
+        self._listings.clear()
+
+
+#: The index shared by all variant lookups
+directory_index = DirectoryIndex()
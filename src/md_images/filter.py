@@ -0,0 +1,114 @@
+"""
+A pandoc JSON filter that writes a dependency file as a side effect.
+
+Builds that run pandoc on every text anyway can let it hand its parse to
+md-images instead of running ``md-images dep``, which would parse each text
+again::
+
+    pandoc --filter md-images-deps -M md-images-source=$< -M md-images-target=$@ -o $@ $<
+
+The document is passed through unchanged. The images are found like
+:meth:`DocInfo.from_json` does, i.e., generated images are skipped, and the
+dependency file contains the same rule as ``md-images dep``. Since pandoc does
+not tell filters the names of its input and output files, they are given as
+metadata or environment variables:
+
+``md-images-source`` / ``MD_IMAGES_SOURCE``
+    the text file; image paths are relative to its directory. If missing,
+    they are relative to the current directory.
+``md-images-target`` / ``MD_IMAGES_TARGET``
+    the target of the rule, defaults to the source
+``md-images-depfile`` / ``MD_IMAGES_DEPFILE``
+    the dependency file to write, defaults to the source (or, without a
+    source, the target) with the suffix ``.d``
+
+The metadata takes precedence over the environment. Without any of these,
+nothing is written.
+"""
+
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+from .core import DocInfo, find_json_targets, relative_fspath
+from .depfile import write_if_changed
+from .model import MdFile
+
+logger = logging.getLogger(__name__)
+
+SETTINGS = {
+    "source": "MD_IMAGES_SOURCE",
+    "target": "MD_IMAGES_TARGET",
+    "depfile": "MD_IMAGES_DEPFILE",
+}
+
+
+def _meta_text(ast: dict, key: str) -> str:
+    value = ast["meta"][key]
+    if value.get("t") == "MetaString":
+        return value["c"]
+    # e.g. MetaInlines from a YAML metadata block, stringified like the title
+    import panflute as pf
+    from panflute.elements import from_json as pf_from_json
+
+    meta = {
+        "pandoc-api-version": ast["pandoc-api-version"],
+        "meta": {key: value},
+        "blocks": [],
+    }
+    doc = json.loads(json.dumps(meta), object_hook=pf_from_json)
+    return pf.stringify(doc.metadata[key])
+
+
+def settings(ast: dict) -> dict[str, Path]:
+    """The source, target and depfile settings from the document's metadata or the environment."""
+    meta = ast.get("meta", {})
+    result = {}
+    for name, variable in SETTINGS.items():
+        key = "md-images-" + name
+        text = _meta_text(ast, key) if key in meta else os.environ.get(variable)
+        if text:
+            result[name] = Path(text)
+    return result
+
+
+def write_depfile(ast: dict) -> Path | None:
+    """
+    Writes the dependency file for the given document, if it is configured.
+    Returns the dependency file if it has been changed.
+    """
+    config = settings(ast)
+    if not config:
+        logger.warning("md-images-deps: no source, target or depfile given")
+        return None
+    source = config.get("source")
+    target = config.get("target")
+    depfile = config.get("depfile") or (source or target).with_suffix(".d")
+    info = DocInfo(*find_json_targets(ast))
+    if source is not None:
+        rule = MdFile(source, info=info).rule(target=target)
+    else:  # image paths are relative to the current directory
+        images = MdFile("-", info=info).image_paths
+        rule = f"{relative_fspath(target or depfile)} : {' '.join(map(relative_fspath, images))}"
+    if write_if_changed(depfile, rule + "\n"):
+        return depfile
+    return None
+
+
+def main():
+    """Passes the pandoc JSON document from stdin to stdout, writing its dependency file."""
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.WARNING)
+    data = sys.stdin.buffer.read()
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
+    try:
+        write_depfile(json.loads(data))
+    except (OSError, ValueError) as e:
+        logger.error("md-images-deps: could not write the dependency file: %s", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+A project-wide index of which texts use which images.
+
+The :class:`ImageIndex` is built once from the project's text files and
+stored as a JSON file. Afterwards, questions like "which texts use this image"
+or "which images are not used at all" can be answered without parsing the
+texts again.
+"""
+
+import json
+import os
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from .model import MdFile
+from .prefer_variants import rank_variants
+
+#: Bump this whenever the format of the index file changes.
+INDEX_VERSION = 1
+
+DEFAULT_INDEX = Path(".md-images-index.json")
+
+
+class ImageIndex:
+    """
+    Texts and the images they reference, in both directions.
+
+    All paths are stored relative to the index' root directory, each one only
+    once; the adjacency lists refer to them by number. Images that are variants
+    of each other (same name, different suffix) form a group, so texts
+    referencing ``fig.pdf`` are also found as users of ``fig.svg``.
+
+    Args:
+        root: the directory all paths are relative to, defaults to the current one
+    """
+
+    def __init__(self, root: Path | None = None):
+        self.root = Path(root if root is not None else ".").absolute()
+        self.paths: list[str] = []
+        self._ids: dict[str, int] = {}
+        self.images: dict[int, list[int]] = {}  # text -> images
+        self.users: dict[int, list[int]] = defaultdict(list)  # image -> texts
+        self.groups: dict[int, list[int]] = {}  # file -> all variants
+
+    def _id(self, path: Path | str) -> int:
+        name = sys.intern(os.path.relpath(os.path.abspath(path), self.root))
+        id_ = self._ids.get(name)
+        if id_ is None:
+            id_ = self._ids[name] = len(self.paths)
+            self.paths.append(name)
+        return id_
+
+    def _path(self, id_: int) -> Path:
+        return self.root / self.paths[id_]
+
+    def _find(self, path: Path | str) -> int | None:
+        return self._ids.get(os.path.relpath(os.path.abspath(path), self.root))
+
+    def add(self, source: MdFile):
+        """Adds a text file and its images. The text must not be in the index yet."""
+        text = self._id(source.path)
+        images = sorted({self._id(img) for img in source.image_paths})
+        self.images[text] = images
+        for image in images:
+            self.users[image].append(text)
+        for variants in rank_variants(source.image_paths, find_variants=True).values():
+            group = sorted({self._id(variant) for variant in variants})
+            for variant in group:
+                if variant in self.groups:
+                    group = sorted(set(group) | set(self.groups[variant]))
+            for variant in group:
+                self.groups[variant] = group
+
+    @classmethod
+    def build(cls, sources: Iterable[MdFile], root: Path | None = None) -> "ImageIndex":
+        index = cls(root)
+        for source in sources:
+            index.add(source)
+        return index
+
+    def texts(self) -> list[Path]:
+        """All indexed texts."""
+        return [self._path(text) for text in self.images]
+
+    def uses(self, text: Path | str) -> list[Path]:
+        """The images referenced by the given text."""
+        id_ = self._find(text)
+        return [self._path(image) for image in self.images.get(id_, [])]
+
+    def who_uses(self, image: Path | str, variants: bool = True) -> list[Path]:
+        """
+        The texts referencing the given image. If variants is true, also the texts
+        referencing one of the image's variants.
+        """
+        id_ = self._find(image)
+        if id_ is None:
+            return []
+        images = self.groups.get(id_, [id_]) if variants else [id_]
+        texts = {text for image in images for text in self.users.get(image, [])}
+        return [self._path(text) for text in sorted(texts)]
+
+    def orphans(self, directory: Path) -> Iterator[Path]:
+        """
+        Files below directory that are neither a text, nor referenced by a text,
+        nor a variant of a referenced file.
+        """
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for name in sorted(filenames):
+                path = Path(dirpath, name)
+                id_ = self._find(path)
+                if id_ is None or not (
+                    id_ in self.users or id_ in self.groups or id_ in self.images
+                ):
+                    yield path
+
+    def to_json(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "paths": self.paths,
+            "texts": [[text, images] for text, images in self.images.items()],
+            "groups": list(
+                {id(group): group for group in self.groups.values()}.values()
+            ),
+        }
+
+    def save(self, path: Path = DEFAULT_INDEX):
+        path.write_text(json.dumps(self.to_json()), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_INDEX) -> "ImageIndex":
+        """
+        Loads an index saved with :meth:`save`. Paths in the index are relative to
+        the directory containing the index file.
+
+        Raises:
+            ValueError: if the file is not an index of a supported version
+        """
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            raise ValueError(
+                f"{path} is not an md-images index (version {INDEX_VERSION})"
+            )
+        index = cls(path.absolute().parent)
+        index.paths = [sys.intern(name) for name in data["paths"]]
+        index._ids = {name: id_ for id_, name in enumerate(index.paths)}
+        for text, images in data["texts"]:
+            index.images[text] = images
+            for image in images:
+                index.users[image].append(text)
+        for group in data["groups"]:
+            for variant in group:
+                index.groups[variant] = group
+        return index
@@ -1,15 +1,31 @@
+from __future__ import annotations
+
 from enum import Enum
-from functools import cached_property
+from functools import partial
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from panflute import stringify
-
-from .core import find_images, load_markdown, relative_fspath, resolve_url
+from .cache import ParseCache
+from .copyplan import CopyMode, CopyPlan
+from .core import (
+    DocInfo,
+    guess_format,
+    load_json_batch,
+    load_markdown,
+    relative_fspath,
+    resolve_url,
+)
+from .dirindex import DirectoryIndex
+from .parallel import map_batches
 from .prefer_variants import rank_variants
-from typing import Callable
-from shutil import copy2
+from .scanner import scan_file
+from .stats import stats
+from typing import Callable, Iterator, Sequence
 import logging
 
+if TYPE_CHECKING:
+    import panflute as pf
+
 logger = logging.getLogger(__name__)
 
 
@@ -27,40 +43,133 @@ class SourceSelection(Enum):
     ALL = "all"
 
 
+class Engine(Enum):
+    """
+    How to find the images in the text files. *pandoc* parses every file
+    with pandoc. *fast* scans markdown files with a built-in scanner that
+    does not need pandoc and understands the common markdown constructs,
+    this also applies to the markdown cells of Jupyter notebooks; files in
+    other formats are still parsed with pandoc.
+    """
+
+    PANDOC = "pandoc"
+    FAST = "fast"
+
+
 class MdFile:
+    """
+    A text file and the images it references.
+
+    Nothing is parsed on construction. The extracted information is loaded on
+    first access to :attr:`info` (or the image and title properties based on
+    it), the panflute document only on first access to :attr:`doc`.
+
+    Args:
+        mdfile: the text file. May be anything pandoc can read.
+        cache: if given, the extracted information is looked up in and stored
+            to this cache, and the document is only parsed on a cache miss.
+        info: the information already extracted from the document, e.g.,
+            by another process. If given, the document is not parsed.
+        engine: how to extract the information from the document
+        sources: the image sources already determined for some selections,
+            e.g., by the md-images server, see :meth:`image_sources`
+    """
+
+    # projects may hold many thousands of these
+    __slots__ = (
+        "path",
+        "_cache",
+        "_engine",
+        "_info",
+        "_doc",
+        "_image_urls",
+        "_image_paths",
+        "_image_sources",
+    )
 
-    def __init__(self, mdfile: str | Path) -> None:
+    def __init__(
+        self,
+        mdfile: str | Path,
+        cache: ParseCache | None = None,
+        info: DocInfo | None = None,
+        engine: Engine = Engine.PANDOC,
+        sources: dict[SourceSelection, set[Path]] | None = None,
+    ) -> None:
         self.path = Path(mdfile)
-        self.doc = load_markdown(self.path)
+        self._cache = cache
+        self._engine = engine
+        self._info = info
+        self._doc: pf.Doc | None = None
+        self._image_urls: set[str] | None = None
+        self._image_paths: set[Path] | None = None
+        self._image_sources = sources or {}
+
+    @property
+    def info(self) -> DocInfo:
+        """
+        The information extracted from the document.
+
+        Raises:
+            Exception: whatever loading the document raised
+        """
+        if self._info is None:
+            if self._doc is not None:
+                info = DocInfo.from_doc(self._doc)
+            else:
+                info = load_infos([self.path], self._cache, self._engine)[0]
+                if isinstance(info, Exception):
+                    raise info
+            self._info = info
+        return self._info
+
+    @property
+    def doc(self) -> pf.Doc:
+        if self._doc is None:
+            self._doc = load_markdown(self.path)
+        return self._doc
+
+    @property
+    def title(self) -> str | None:
+        return self.info.title
 
     def __str__(self) -> str:
         result = str(self.path)
-        try:
-            title = stringify(self.doc.metadata["title"])
-            result += f" ({title})"
-        except Exception:
-            pass
+        if self.title is not None:
+            result += f" ({self.title})"
         return result
 
-    @cached_property
+    @property
     def image_urls(self) -> set[str]:
-        return {img.url for img in find_images(self.doc)}
+        if self._image_urls is None:
+            self._image_urls = set(self.info.images)
+        return self._image_urls
 
-    @cached_property
+    @property
     def image_paths(self) -> set[Path]:
-        resolved = [resolve_url(img, self.path) for img in self.image_urls]
-        return {path for path in resolved if isinstance(path, Path)}
+        if self._image_paths is None:
+            resolved = [resolve_url(img, self.path) for img in self.image_urls]
+            self._image_paths = {path for path in resolved if isinstance(path, Path)}
+        return self._image_paths
 
     def image_sources(
         self,
         selection: SourceSelection = SourceSelection.SOURCE,
         ranker: Callable[[Path], int] | None = None,
+        index: DirectoryIndex | None = None,
     ) -> set[Path]:
+        """
+        The image files for the given selection. Variants are looked up in
+        the given directory index, by default the shared one.
+        """
+        if ranker is None and selection in self._image_sources:
+            return set(self._image_sources[selection])
         result = set()
         if selection == SourceSelection.EXPLICIT or selection == SourceSelection.BOTH:
             result |= self.image_paths
         if selection != SourceSelection.EXPLICIT:
-            ranked = rank_variants(self.image_paths, find_variants=True, ranker=ranker)
+            ranked = rank_variants(
+                self.image_paths, find_variants=True, ranker=ranker, index=index
+            )
             if selection == SourceSelection.SOURCE or selection == SourceSelection.BOTH:
                 result |= {variants[0] for variants in ranked.values()}
             elif selection == SourceSelection.ALL:
@@ -68,21 +177,41 @@ class MdFile:
                     result.update(variants)
         return result
 
-    def rule(self, suffix: str | None = None, base: Path = Path()) -> str:
-        if suffix is None:
+    def target(self, suffix: str) -> Path:
+        """
+        The file generated from this text, given a suffix (like ``.pdf``) or a
+        pattern where ``%`` stands for the text's stem (like ``handout-%.pdf``).
+        """
+        if "%" in suffix:
+            return self.path.with_name(suffix.replace("%", self.path.stem))
+        return self.path.with_suffix(suffix)
+
+    def rule(
+        self, suffix: str | None = None, base: Path = Path(), target: Path | None = None
+    ) -> str:
+        if target is not None:
+            deps = [self.path]
+        elif suffix is None:
             target = self.path
             deps = []
         else:
-            if "%" in suffix:
-                target = self.path.with_name(suffix.replace("%", self.path.stem))
-            else:
-                target = self.path.with_suffix(suffix)
+            target = self.target(suffix)
             deps = [self.path]
         deps.extend(self.image_paths)
 
         return f"{relative_fspath(target, base)} : {' '.join(relative_fspath(dep, base) for dep in deps)}"
 
-    def copy(self, target: Path, selection: SourceSelection = SourceSelection.SOURCE):
+    def plan_copy(
+        self,
+        plan: CopyPlan,
+        target: Path,
+        selection: SourceSelection = SourceSelection.SOURCE,
+    ):
+        """
+        Adds this text file and its images to the given copy plan. If target is
+        an existing directory, the text file is copied into it, otherwise target
+        is the new file name. Images are placed relative to the text file.
+        """
         if target.is_dir():
             target_dir = target
             doc_target = target / self.path.name
@@ -90,17 +219,103 @@ class MdFile:
             target_dir = target.parent
             doc_target = target
 
-        target_dir.mkdir(parents=True, exist_ok=True)
-        copy2(self.path, doc_target)
+        plan.add(self.path, doc_target)
         images = self.image_sources(selection)
-        logger.info(
-            "Copied text file %s to %s, %d images will follow",
-            self.path,
-            doc_target,
-            len(images),
-        )
+        logger.debug("%s: planning to copy %d images", self.path, len(images))
         for img in images:
-            dest = target_dir / img.relative_to(self.path.parent)
-            dest.parent.mkdir(parents=True, exist_ok=True)
-            copy2(img, dest)
-            logger.debug("   %s: copied image file %s to %s", self.path, img, dest)
+            plan.add(img, target_dir / img.relative_to(self.path.parent))
+
+    def copy(
+        self,
+        target: Path,
+        selection: SourceSelection = SourceSelection.SOURCE,
+        mode: CopyMode = CopyMode.COPY,
+    ):
+        plan = CopyPlan(mode)
+        self.plan_copy(plan, target, selection)
+        failed = plan.execute()
+        if failed:
+            raise next(iter(failed.values()))
+
+
+def load_infos(
+    texts: Sequence[Path],
+    cache: ParseCache | None = None,
+    engine: Engine = Engine.PANDOC,
+) -> list[DocInfo | Exception]:
+    """
+    Extracts the information md-images needs from each of the given files.
+
+    With the pandoc engine, files not found in the cache are converted using
+    :func:`load_json_batch`, the panflute tree is not built.
+
+    Returns:
+        for each text, either its DocInfo or the exception that occurred while loading it.
+    """
+    result: list = [None] * len(texts)
+    pending = []
+    for index, text in enumerate(texts):
+        if engine == Engine.FAST and guess_format(text) in ("markdown", "ipynb"):
+            try:
+                with stats.timer("scan"):
+                    result[index] = scan_file(text)
+            except Exception as e:
+                result[index] = e
+        else:
+            pending.append(index)
+
+    keys = {}
+    misses = []
+    for index in pending:
+        text = texts[index]
+        if cache is not None:
+            try:
+                key = cache.key(text.read_bytes(), guess_format(text))
+            except OSError as e:
+                result[index] = e
+                continue
+            info = cache.get(key)
+            if info is not None:
+                stats.count("cache hits")
+                result[index] = info
+                continue
+            stats.count("cache misses")
+            keys[index] = key
+        misses.append(index)
+
+    docs = load_json_batch([texts[index] for index in misses])
+    for index, doc in zip(misses, docs):
+        if isinstance(doc, Exception):
+            result[index] = doc
+            continue
+        try:
+            info = DocInfo.from_json(doc)
+        except Exception as e:
+            result[index] = e
+            continue
+        if cache is not None:
+            cache.put(keys[index], info)
+        result[index] = info
+    return result
+
+
+def load_files(
+    texts: Sequence[Path],
+    cache: ParseCache | None = None,
+    jobs: int | None = None,
+    engine: Engine = Engine.PANDOC,
+    batch_size: int | None = None,
+) -> Iterator[tuple[Path, MdFile | Exception]]:
+    """
+    Loads the given text files in batches, in parallel, see :func:`map_batches`.
+
+    Yields:
+        the path and either the MdFile or the exception raised while loading it,
+        in the order of texts.
+    """
+    load = partial(load_infos, cache=cache, engine=engine)
+    for text, info in map_batches(load, texts, jobs, batch_size):
+        if isinstance(info, Exception):
+            yield text, info
+        else:
+            yield text, MdFile(text, info=info)
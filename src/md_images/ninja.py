@@ -0,0 +1,102 @@
+"""
+Build files for `ninja <https://ninja-build.org/>`_.
+
+The manifest fragment written by :func:`manifest` only depends on the list of
+texts and the target suffixes, so it does not need to be regenerated when a
+text starts or stops using an image. The images are instead listed in a single
+`dyndep file <https://ninja-build.org/manual.html#ref_dyndep>`_ written by
+:func:`dyndep`, which the fragment tells ninja how to keep up to date::
+
+    rule md_images_dyndep
+      command = md-images ninja --dyndep-only -d .pdf --dyndep $out $in
+      restat = 1
+
+    build md-images.dd : md_images_dyndep foo.md
+    build foo.pdf : pandoc foo.md || md-images.dd
+      dyndep = md-images.dd
+
+and the dyndep file adds the images as implicit inputs::
+
+    ninja_dyndep_version = 1
+    build foo.pdf : dyndep | img/header.png
+"""
+
+from collections.abc import Iterable, Sequence
+from os import PathLike
+from pathlib import Path
+from shlex import join
+
+from .core import relative_fspath
+from .model import MdFile
+
+DYNDEP_RULE = "md_images_dyndep"
+
+
+def escape(path: str | PathLike) -> str:
+    """Escapes a path for use in a ninja build statement."""
+    return (
+        relative_fspath(Path(path))
+        .replace("$", "$$")
+        .replace(" ", "$ ")
+        .replace(":", "$:")
+    )
+
+
+def _paths(paths: Iterable[str | PathLike]) -> str:
+    return " ".join(escape(path) for path in paths)
+
+
+def manifest(
+    texts: Sequence[Path],
+    suffixes: Sequence[str],
+    rule: str,
+    dyndep_file: Path,
+    command: Sequence[str],
+) -> str:
+    """
+    A build.ninja fragment that builds each text's targets with the given rule.
+
+    Args:
+        texts: the text files
+        suffixes: suffixes or ``%`` patterns for the targets, see :meth:`MdFile.target`
+        rule: name of the ninja rule that builds a target from a text. It is
+            not defined in the fragment.
+        dyndep_file: the dyndep file listing the images
+        command: the command that writes the dyndep file, without the output
+            and input files (appended as ``--dyndep $out $in``)
+    """
+    dd = escape(dyndep_file)
+    command_line = join([*command, "--dyndep"]).replace("$", "$$")
+    lines = [
+        "# Generated by md-images ninja, do not edit.",
+        "",
+        f"rule {DYNDEP_RULE}",
+        f"  command = {command_line} $out $in",
+        "  description = md-images $out",
+        "  restat = 1",
+        "",
+        f"build {dd} : {DYNDEP_RULE} {_paths(texts)}",
+        "",
+    ]
+    for text in texts:
+        source = MdFile(text)  # only computes paths, nothing is parsed
+        for suffix in suffixes:
+            lines.append(
+                f"build {escape(source.target(suffix))} : {rule} {escape(text)} || {dd}"
+            )
+            lines.append(f"  dyndep = {dd}")
+    return "\n".join(lines) + "\n"
+
+
+def dyndep(sources: Iterable[MdFile], suffixes: Sequence[str]) -> str:
+    """
+    The dyndep file for the :func:`manifest`, adding each text's images as
+    implicit inputs of its targets.
+    """
+    lines = ["ninja_dyndep_version = 1"]
+    for source in sources:
+        images = _paths(sorted(source.image_paths))
+        for suffix in suffixes:
+            line = f"build {escape(source.target(suffix))} : dyndep"
+            lines.append(f"{line} | {images}" if images else line)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,131 @@
+"""
+Helpers to process many text files concurrently.
+"""
+
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from math import ceil
+from pathlib import Path
+from typing import Callable, Iterator, Sequence, TypeVar
+
+from .stats import stats
+
+R = TypeVar("R")
+
+#: Upper bound for the number of texts handed to a worker at once
+MAX_BATCH_SIZE = 100
+
+#: Batch size for commands that print each text's results as soon as it is
+#: loaded. Results only come back per batch, so each text is its own batch;
+#: workers convert single texts with their persistent pandoc server, so this
+#: does not start more pandoc processes.
+STREAM_BATCH_SIZE = 1
+
+
+def default_jobs() -> int:
+    return os.cpu_count() or 1
+
+
+def _apply_each(
+    func: Callable[[Path], R], texts: Sequence[Path]
+) -> list[R | Exception]:
+    results: list[R | Exception] = []
+    for text in texts:
+        try:
+            results.append(func(text))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _with_stats(
+    func: Callable[[Sequence[Path]], list[R | Exception]],
+    trace: bool,
+    texts: Sequence[Path],
+) -> tuple[list[R | Exception], dict]:
+    """Runs func in a worker process and returns its result and the worker's stats."""
+    stats.reset(trace)
+    return func(texts), stats.snapshot()
+
+
+def map_batches(
+    func: Callable[[Sequence[Path]], list[R | Exception]],
+    texts: Sequence[Path],
+    jobs: int | None = None,
+    batch_size: int | None = None,
+) -> Iterator[tuple[Path, R | Exception]]:
+    """
+    Splits texts into batches and calls func for each batch, in a pool of
+    worker processes.
+
+    Results are yielded in input order, as soon as the batch they belong
+    to is available. func must return a list with one entry per text of
+    the batch, containing either the result or the exception that
+    occurred for that text. If func fails for a whole batch, that
+    exception is yielded for each text of the batch.
+
+    Args:
+        func: the function to call. Must be picklable, i.e. a module level
+            function or a functools.partial of one.
+        texts: the text files to process
+        jobs: maximum number of worker processes, defaults to the number of CPUs.
+            With 1, everything is run in the current process.
+        batch_size: number of texts per batch, by default chosen such that
+            each worker receives about two batches, up to MAX_BATCH_SIZE.
+    """
+    if jobs is None:
+        jobs = default_jobs()
+    jobs = max(1, min(jobs, len(texts)))
+    if batch_size is None:
+        batch_size = min(MAX_BATCH_SIZE, max(1, ceil(len(texts) / (2 * jobs))))
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    def results(batch: Sequence[Path], get: Callable[[], list[R | Exception]]):
+        try:
+            yield from zip(batch, get())
+        except Exception as e:
+            for text in batch:
+                yield text, e
+
+    if jobs <= 1 or len(batches) <= 1:
+        for batch in batches:
+            yield from results(batch, partial(func, batch))
+        return
+
+    def result_with_stats(future: Future) -> list[R | Exception]:
+        result, worker_stats = future.result()
+        stats.merge(worker_stats)
+        return result
+
+    trace = stats.spans is not None
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(_with_stats, func, trace, batch) for batch in batches
+        ]
+        try:
+            for batch, future in zip(batches, futures):
+                yield from results(batch, partial(result_with_stats, future))
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def map_texts(
+    func: Callable[[Path], R], texts: Sequence[Path], jobs: int | None = None
+) -> Iterator[tuple[Path, R | Exception]]:
+    """
+    Calls func for each of the given texts, in a pool of worker processes.
+
+    Results are yielded in input order, as soon as they are available.
+    If func raises an exception for a text, the exception is yielded
+    instead of the result, so the remaining texts are still processed.
+
+    Args:
+        func: the function to call. Must be picklable, i.e. a module level
+            function or a functools.partial of one.
+        texts: the text files to process
+        jobs: maximum number of worker processes, defaults to the number of CPUs.
+            With 1, everything is run in the current process.
+    """
+    return map_batches(partial(_apply_each, func), texts, jobs, batch_size=1)
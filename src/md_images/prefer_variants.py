@@ -3,10 +3,10 @@ from posix import fspath
 from collections import defaultdict
 from pathlib import Path
 from typing import Callable, Literal
-import cyclopts
 from shlex import join, quote
 
-app = cyclopts.App()
+from .dirindex import DirectoryIndex, directory_index
+from .stats import stats
 
 
 class SuffixRanks:
@@ -27,6 +27,7 @@ def rank_variants(
     files: Iterable[Path],
     find_variants: bool = False,
     ranker: Callable[[Path], int] | None = None,
+    index: DirectoryIndex | None = None,
 ) -> dict[Path, list[Path]]:
     """
     Group the given list of files by base name and rank the variants by suffix.
@@ -35,20 +36,24 @@ def rank_variants(
         files: List of files to consider.
         find_variants: If true, look for all files on disk matching foo.*, not only those listed.
         ranker: A function that assigns a rank to a file.
+        index: The directory index to look for variants in, defaults to the shared one.
 
     Returns:
         A dictionary mapping base names to a list of files, sorted by rank.
     """
     if ranker is None:
         ranker = SuffixRanks()
+    if index is None:
+        index = directory_index
     variant_map = defaultdict(set)
     for file in files:
         base = file.with_suffix("")
         variant_map[base].add(file)
 
     if find_variants:
-        for base, variants in variant_map.items():
-            variants.update(base.parent.glob(base.stem + ".*"))
+        with stats.timer("variant lookup"):
+            for base, variants in variant_map.items():
+                variants.update(index.variants(base))
 
     ranked_variants = {
         base: sorted(variants, key=ranker) for base, variants in variant_map.items()
@@ -56,7 +61,6 @@ def rank_variants(
     return ranked_variants
 
 
-@app.default
 def adjust_list(
     files: list[Path],
     find_variants: bool = False,
@@ -83,3 +87,16 @@ def adjust_list(
             print("\n".join(map(fspath, variants[1:])))
         elif output == "rules":
             print(join(map(fspath, variants[1:])), ":", quote(fspath(variants[0])))
+
+
+def __getattr__(name: str):
+    # The command line app is only built when it is used (by the prefer-variants
+    # script), so importing rank_variants does not import cyclopts.
+    if name == "app":
+        import cyclopts
+
+        app = cyclopts.App()
+        app.default(adjust_list)
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,344 @@
+"""
+Checks whether remote images and link targets can be retrieved.
+
+URLs are checked with HEAD requests (GET if the server does not support HEAD)
+from a pool of threads. Each thread keeps one connection per host open, and
+the number of concurrent requests per host is limited. The results are kept
+in a :class:`RemoteCache` for some time, so repeated runs (e.g., in CI) do not
+ask the same servers again; after that time, cached results are revalidated
+with conditional requests using the server's ETag or modification date.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from email.message import Message
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Iterable
+from urllib.parse import quote, urljoin, urlsplit
+
+from .cache import default_cache_dir
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+#: Bump this whenever the format of the remote cache file changes.
+REMOTE_CACHE_VERSION = 1
+
+#: Seconds a result is used without asking the server again
+DEFAULT_TTL = 24 * 60 * 60
+
+#: Maximum number of concurrent requests to the same host
+DEFAULT_PER_HOST = 4
+
+MAX_REDIRECTS = 5
+
+_REDIRECTS = {301, 302, 303, 307, 308}
+
+
+def is_remote(url: str) -> bool:
+    """Whether the URL can be checked by :class:`RemoteChecker`."""
+    return urlsplit(url).scheme in ("http", "https")
+
+
+@dataclass
+class UrlStatus:
+    """
+    The result of checking a URL.
+
+    Attributes:
+        url: the checked URL
+        status: the HTTP status code of the final response after following
+            redirects, or None if no response could be received
+        error: the reason if there was no response
+        etag: the ETag header of the response, for revalidation
+        last_modified: the Last-Modified header of the response, for revalidation
+        checked: when the status was last received or confirmed, as a timestamp
+    """
+
+    url: str
+    status: int | None
+    error: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    checked: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and 200 <= self.status < 400
+
+    def __str__(self) -> str:
+        return f"{self.url} ({self.status if self.status is not None else self.error})"
+
+
+class RemoteCache:
+    """
+    The results of previous URL checks, stored in a single JSON file.
+
+    Args:
+        path: the cache file, defaults to ``remote.json`` in the :func:`default_cache_dir`
+        ttl: seconds a result is considered fresh
+    """
+
+    def __init__(self, path: Path | None = None, ttl: float = DEFAULT_TTL):
+        self.path = (
+            Path(path) if path is not None else default_cache_dir() / "remote.json"
+        )
+        self.ttl = ttl
+        self._entries: dict[str, UrlStatus] | None = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, UrlStatus]:
+        if self._entries is None:
+            entries = {}
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == REMOTE_CACHE_VERSION:
+                    for entry in data["entries"]:
+                        status = UrlStatus(**entry)
+                        entries[status.url] = status
+            except FileNotFoundError:
+                pass
+            except (ValueError, TypeError, KeyError, AttributeError):
+                logger.debug("Ignoring corrupt remote cache %s", self.path)
+            self._entries = entries
+        return self._entries
+
+    def get(self, url: str) -> UrlStatus | None:
+        """The last known status of the URL, even if it is not fresh anymore."""
+        with self._lock:
+            return self._load().get(url)
+
+    def fresh(self, status: UrlStatus) -> bool:
+        return time.time() - status.checked < self.ttl
+
+    def put(self, status: UrlStatus):
+        with self._lock:
+            self._load()[status.url] = status
+
+    def save(self):
+        """Writes the cache file, dropping entries that are older than the TTL."""
+        with self._lock:
+            entries = [
+                asdict(status) for status in self._load().values() if self.fresh(status)
+            ]
+        data = json.dumps({"version": REMOTE_CACHE_VERSION, "entries": entries})
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(
+                "w", dir=self.path.parent, suffix=".tmp", delete=False, encoding="utf-8"
+            ) as f:
+                f.write(data)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            logger.debug("Could not write remote cache %s: %s", self.path, e)
+
+
+#: characters left as they are in request targets, all others are percent-encoded
+_TARGET_SAFE = "/%?=&:@!$'()*+,;~-._"
+
+
+def _request_parts(url: str) -> tuple[str, str, str]:
+    """
+    The scheme, the ASCII host (and port) and the percent-encoded request
+    target for the URL. pandoc leaves non-ASCII characters in URLs as they
+    are, but http.client only sends ASCII.
+
+    Raises:
+        ValueError: if the URL has no host, an invalid port or an invalid host name
+    """
+    parts = urlsplit(url)
+    if not parts.hostname:
+        raise ValueError(f"no host in {url}")
+    host = parts.hostname.encode("idna").decode("ascii")
+    if ":" in host:  # IPv6 address
+        host = f"[{host}]"
+    if parts.port is not None:
+        host += f":{parts.port}"
+    target = parts.path or "/"
+    if parts.query:
+        target += "?" + parts.query
+    return parts.scheme, host, quote(target, safe=_TARGET_SAFE)
+
+
+class _HostPool:
+    """
+    Up to *size* connections to one host. Idle connections are reused, and
+    requests wait while all connections are busy.
+    """
+
+    def __init__(self, scheme: str, netloc: str, size: int, timeout: float):
+        self.cls = HTTPSConnection if scheme == "https" else HTTPConnection
+        self.netloc = netloc
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: list[HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> HTTPConnection:
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        stats.count("remote connections")
+        return self.cls(self.netloc, timeout=self.timeout)
+
+    def release(self, connection: HTTPConnection, reusable: bool = True):
+        if reusable:
+            with self._lock:
+                self._idle.append(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle.clear()
+
+
+class RemoteChecker:
+    """
+    Checks URLs concurrently.
+
+    Args:
+        cache: if given, fresh results are taken from and new results stored to it
+        per_host: maximum number of concurrent requests (and connections) per host
+        max_workers: maximum number of concurrent requests in total
+        timeout: seconds to wait for a server
+    """
+
+    def __init__(
+        self,
+        cache: RemoteCache | None = None,
+        per_host: int = DEFAULT_PER_HOST,
+        max_workers: int = 16,
+        timeout: float = 10.0,
+    ):
+        self.cache = cache
+        self.per_host = per_host
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pools: dict[tuple[str, str], _HostPool] = {}
+        self._pools_lock = threading.Lock()
+
+    def _pool(self, scheme: str, netloc: str) -> _HostPool:
+        with self._pools_lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                pool = self._pools[scheme, netloc] = _HostPool(
+                    scheme, netloc, self.per_host, self.timeout
+                )
+            return pool
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+
+    def _request(
+        self, method: str, url: str, headers: dict[str, str]
+    ) -> tuple[int, Message]:
+        scheme, netloc, target = _request_parts(url)
+        headers = {"User-Agent": "md-images", **headers}
+        pool = self._pool(scheme, netloc)
+        for attempt in range(2):  # the server may have closed a kept-alive connection
+            connection = pool.acquire()
+            try:
+                stats.count("remote requests")
+                connection.request(method, target, headers=headers)
+                response = connection.getresponse()
+                if method == "HEAD":
+                    response.read()
+            except (OSError, HTTPException):
+                pool.release(connection, reusable=False)
+                if attempt:
+                    raise
+                continue
+            # after a GET, the body is not read, so the connection cannot be reused
+            pool.release(connection, method == "HEAD" and not response.will_close)
+            return response.status, response.headers
+        raise AssertionError("unreachable")
+
+    def _check(self, url: str, known: UrlStatus | None) -> UrlStatus:
+        headers = {}
+        if known is not None and known.ok:
+            if known.etag:
+                headers["If-None-Match"] = known.etag
+            if known.last_modified:
+                headers["If-Modified-Since"] = known.last_modified
+        current = url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                status, response_headers = self._request("HEAD", current, headers)
+                if status in (405, 501):  # HEAD not supported
+                    status, response_headers = self._request("GET", current, headers)
+                if status in _REDIRECTS and "Location" in response_headers:
+                    current = urljoin(current, response_headers["Location"])
+                    if not is_remote(current):
+                        break
+                    continue
+                break
+            else:
+                return UrlStatus(
+                    url, None, error="too many redirects", checked=time.time()
+                )
+        except (OSError, HTTPException, ValueError) as e:  # ValueError: invalid URL
+            return UrlStatus(url, None, error=str(e) or repr(e), checked=time.time())
+        if status == 304 and known is not None:
+            stats.count("remote revalidations")
+            return UrlStatus(
+                url,
+                known.status,
+                etag=known.etag,
+                last_modified=known.last_modified,
+                checked=time.time(),
+            )
+        return UrlStatus(
+            url,
+            status,
+            etag=response_headers.get("ETag"),
+            last_modified=response_headers.get("Last-Modified"),
+            checked=time.time(),
+        )
+
+    def check(self, urls: Iterable[str]) -> dict[str, UrlStatus]:
+        """
+        Checks each of the given URLs once.
+
+        Returns:
+            the status for each URL, in the order of their first occurrence
+        """
+        result: dict[str, UrlStatus | None] = dict.fromkeys(urls)
+        pending = []
+        for url in result:
+            known = self.cache.get(url) if self.cache is not None else None
+            if known is not None and self.cache.fresh(known):
+                stats.count("remote cache hits")
+                result[url] = known
+            else:
+                pending.append((url, known))
+        if not pending:
+            return result  # type: ignore
+        try:
+            with (
+                stats.timer("remote check"),
+                ThreadPoolExecutor(min(self.max_workers, len(pending))) as executor,
+            ):
+                for status in executor.map(lambda args: self._check(*args), pending):
+                    result[status.url] = status
+                    if self.cache is not None and status.status is not None:
+                        self.cache.put(status)
+        finally:
+            self.close()
+        if self.cache is not None:
+            self.cache.save()
+        return result  # type: ignore
@@ -0,0 +1,447 @@
+"""
+A pure Python scanner that finds images and links in pandoc markdown files
+without running pandoc.
+
+The scanner understands the constructs that matter for finding images:
+inline and reference style images and links, link reference definitions,
+autolinks, code spans, fenced and indented code blocks, HTML comments,
+fenced divs, footnotes and the YAML metadata block at the start of the file.
+For typical documents, it finds the same images and links as
+:func:`md_images.core.find_json_targets` on pandoc's output, but it is
+not a full markdown parser.
+"""
+
+import html
+import re
+from pathlib import Path
+from typing import List, NamedTuple
+
+from .core import DocInfo, guess_format, notebook_markdown
+
+_FENCE = re.compile(r" {0,3}(`{3,}|~{3,})")
+_DIV_FENCE = re.compile(r" {0,3}(:{3,})\s*(.*?)\s*:*\s*$")
+_YAML_END = re.compile(r"(---|\.\.\.)\s*$")
+_LINK_DEFINITION = re.compile(r" {0,3}\[(?!\^)((?:[^\\\[\]]|\\.)+)\]:[ \t]*(\S.*?)\s*$")
+_NOTE_DEFINITION = re.compile(r" {0,3}\[\^[^\]\s]+\]:")
+_LIST_MARKER = re.compile(r" {0,3}(?:[-*+]|\d+[.)]|#[.)]|[a-zA-Z][.)])[ \t]+")
+_BLOCKQUOTE = re.compile(r" {0,3}> ?")
+_HEADER = re.compile(r" {0,3}#{1,6}(?:[ \t]|$)")
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+# escaped characters are matched as well, so an escaped backtick opens no code span
+_CODE_SPAN = re.compile(r"\\.|(?<!`)(`+)(?!`).+?(?<!`)\1(?!`)", re.DOTALL)
+_AUTOLINK = re.compile(r"<([a-zA-Z][a-zA-Z0-9+.-]{1,31}:[^\s<>]*)>")
+_EMAIL_AUTOLINK = re.compile(r"<([^\s<>@]+@[^\s<>@]+\.[^\s<>@]+)>")
+_HTML_IMG = re.compile(
+    r"<img\s[^>]*?\bsrc\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s>]+))", re.I
+)
+_TITLE = re.compile(r"""\s+(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')\s*$""", re.DOTALL)
+_ESCAPE = re.compile(r"\\([!-/:-@\[-`{-~])")
+_SIMPLE_YAML = re.compile(
+    r"([A-Za-z][\w-]*):[ \t]+([^\s\"'\[\]{}|>&*!%@`#,?:-](?:[^:#]|:(?! )|(?<! )#)*?)\s*$"
+)
+_SPECIAL = re.compile(r"[*_`]+(?=\W|$)|(?<!\w)[*_`]+")
+
+# characters pandoc percent-encodes in URLs
+_URI_ESCAPES = {c: f"%{ord(c):02X}" for c in '<>|"{}[]^`'}
+
+
+def _escape_uri(url: str) -> str:
+    return "".join(
+        _URI_ESCAPES.get(c, f"%{ord(c):02X}" if c.isspace() else c) for c in url
+    )
+
+
+def _unescape(text: str) -> str:
+    return html.unescape(_ESCAPE.sub(r"\1", text))
+
+
+def _normalize_label(label: str) -> str:
+    return " ".join(label.split()).casefold()
+
+
+def _destination(text: str) -> str:
+    """The URL from a link destination, possibly followed by a title."""
+    text = text.strip()
+    text = _TITLE.sub("", text)
+    if text.startswith("<") and text.endswith(">"):
+        text = text[1:-1]
+    return _escape_uri(_unescape(text))
+
+
+class _Paragraph(NamedTuple):
+    text: str
+    output: bool  # directly inside a div with the class output
+
+
+class Scanner:
+    """
+    Finds images and links in a markdown text.
+
+    Args:
+        html_images: also report the src of raw HTML <img> tags. pandoc keeps
+            those as raw HTML, so this is off by default.
+    """
+
+    def __init__(self, html_images: bool = False):
+        self.html_images = html_images
+
+    def scan(self, text: str) -> DocInfo:
+        self.images: List[str] = []
+        self.links: List[str] = []
+        self.references: dict[str, str] = {}
+        lines = text.splitlines()
+        metadata, start = self._metadata(lines)
+        paragraphs = self._paragraphs(lines[start:])
+        title = None
+        if isinstance(metadata, dict):
+            for value in metadata.values():
+                self._scan_metadata(value)
+            value = metadata.get("title")
+            if value is not None and not isinstance(value, (dict, list, bool)):
+                title = _plain(str(value))
+        for paragraph in paragraphs:
+            self._scan_paragraph(paragraph)
+        return DocInfo(images=self.images, links=self.links, title=title)
+
+    def _metadata(self, lines: list[str]):
+        if (
+            not lines
+            or lines[0].rstrip() != "---"
+            or len(lines) < 2
+            or not lines[1].strip()
+        ):
+            return None, 0
+        for end in range(1, len(lines)):
+            if _YAML_END.match(lines[end]):
+                return _load_yaml(lines[1:end]), end + 1
+        return None, 0
+
+    def _scan_metadata(self, value):
+        if isinstance(value, str):
+            self._scan_paragraph(_Paragraph(value, False))
+        elif isinstance(value, dict):
+            for item in value.values():
+                self._scan_metadata(item)
+        elif isinstance(value, list):
+            for item in value:
+                self._scan_metadata(item)
+
+    def _paragraphs(self, lines: list[str]) -> list[_Paragraph]:
+        """
+        Splits the lines into paragraphs, skipping code blocks and collecting
+        link reference definitions.
+        """
+        paragraphs: list[_Paragraph] = []
+        current: list[str] = []
+        current_output = False
+        # for each open fenced div, whether it has the class output
+        divs: list[bool] = []
+        fence: str | None = None
+        in_list = False
+        blank = True
+
+        def flush():
+            nonlocal current
+            if current:
+                paragraphs.append(_Paragraph("\n".join(current), current_output))
+                current = []
+
+        for line in lines:
+            if fence is not None:
+                if line.lstrip(" ").startswith(fence) and not line.strip().strip(
+                    fence[0]
+                ):
+                    fence = None
+                continue
+            if not line.strip():
+                flush()
+                blank = True
+                continue
+            indented = line.startswith("    ") or line.startswith("\t")
+            if indented and blank and not in_list:
+                continue  # indented code block
+            if blank and not line[0].isspace():
+                in_list = False  # a list or note ends with an unindented block
+            stripped = line
+            nested = False
+            while True:
+                quote = _BLOCKQUOTE.match(stripped)
+                marker = _LIST_MARKER.match(stripped)
+                if quote:
+                    stripped = stripped[quote.end() :]
+                elif marker and (blank or not current or nested):
+                    stripped = stripped[marker.end() :]
+                    in_list = True
+                else:
+                    break
+                nested = True
+            nested = nested or (indented and in_list)
+            blank = False
+
+            match = _FENCE.match(stripped)
+            if match:
+                flush()
+                fence = match.group(1)
+                continue
+            match = _DIV_FENCE.match(stripped)
+            if match:
+                flush()
+                attributes = match.group(2)
+                if attributes:
+                    divs.append(_is_output(attributes))
+                elif divs:
+                    divs.pop()
+                continue
+            match = _LINK_DEFINITION.match(stripped)
+            if match and not current:
+                label = _normalize_label(match.group(1))
+                self.references.setdefault(label, _destination(match.group(2)))
+                continue
+            match = _NOTE_DEFINITION.match(stripped)
+            if match:
+                flush()
+                stripped = stripped[match.end() :]
+                nested = True
+                in_list = True
+            if _HEADER.match(stripped):
+                flush()
+                paragraphs.append(
+                    _Paragraph(
+                        stripped.lstrip(" #"), bool(divs and divs[-1] and not nested)
+                    )
+                )
+                continue
+            if not current:
+                current_output = bool(divs and divs[-1] and not nested)
+            if stripped.lstrip().startswith("|"):
+                current_output = False  # table or line block
+            current.append(stripped)
+        flush()
+        return paragraphs
+
+    def _scan_paragraph(self, paragraph: _Paragraph):
+        text = _HTML_COMMENT.sub("", paragraph.text)
+        text = _CODE_SPAN.sub(
+            lambda m: m.group() if m.group(1) is None else " " * len(m.group()), text
+        )
+        output = paragraph.output and not self._is_figure(text)
+        self._scan_inlines(text, output)
+
+    def _is_figure(self, text: str) -> bool:
+        """Whether the paragraph is a pandoc implicit figure, i.e., a single image with a caption"""
+        text = text.strip()
+        if not text.startswith("!["):
+            return False
+        end = _closing_bracket(text, 1)
+        if end is None or end == 2:
+            return False
+        target = self._target(text, 1, end)
+        if target is None:
+            return False
+        rest_text = text[target[0] :]
+        if rest_text.startswith("{"):
+            close = rest_text.find("}")
+            rest_text = rest_text[close + 1 :] if close >= 0 else rest_text
+        return not rest_text.strip()
+
+    def _reference(self, label: str, after: int) -> tuple[int, str] | None:
+        url = self.references.get(_normalize_label(label))
+        return None if url is None else (after, url)
+
+    def _scan_inlines(self, text: str, output: bool, in_output_span: bool = False):
+        # Like _is_generated_image, images are generated if their grandparent
+        # has the class output: with output, the images directly in text are,
+        # with in_output_span (text is the content of a span with the class
+        # output), those nested in one element, like *emphasis* or a link.
+        # depth counts unclosed brackets and emphasis delimiters.
+        depth = 0
+        pos = 0
+        length = len(text)
+        while pos < length:
+            char = text[pos]
+            if char == "\\":
+                pos += 2
+            elif char == "!" and text.startswith("![", pos):
+                end = _closing_bracket(text, pos + 1)
+                target = None
+                if end is not None:
+                    target = self._target(text, pos + 1, end)
+                if target is None:
+                    pos += 1
+                    continue
+                after, url = target
+                self._scan_inlines(text[pos + 2 : end], False)
+                if not (output and depth == 0 or in_output_span and depth == 1):
+                    self.images.append(url)
+                pos = after
+            elif char == "[":
+                end = _closing_bracket(text, pos)
+                target = None
+                if end is not None and text.startswith("{", end + 1):
+                    close = text.find("}", end + 1)
+                    if close >= 0:  # bracketed span with attributes
+                        attributes = text[end + 1 : close + 1]
+                        self._scan_inlines(
+                            text[pos + 1 : end], False, _is_output(attributes)
+                        )
+                        pos = close + 1
+                        continue
+                if end is not None and not text.startswith("^", pos + 1):
+                    target = self._target(text, pos, end)
+                if target is None:
+                    depth += 1
+                    pos += 1
+                    continue
+                after, url = target
+                self._scan_inlines(text[pos + 1 : end], in_output_span and depth == 0)
+                self.links.append(url)
+                pos = after
+            elif char == "]":
+                depth = max(0, depth - 1)
+                pos += 1
+            elif char == "<":
+                match = _AUTOLINK.match(text, pos)
+                if match:
+                    self.links.append(match.group(1))
+                    pos = match.end()
+                    continue
+                match = _EMAIL_AUTOLINK.match(text, pos)
+                if match:
+                    self.links.append("mailto:" + match.group(1))
+                    pos = match.end()
+                    continue
+                if self.html_images:
+                    match = _HTML_IMG.match(text, pos)
+                    if match:
+                        self.images.append(
+                            html.unescape(
+                                next(g for g in match.groups() if g is not None)
+                            )
+                        )
+                        pos = match.end()
+                        continue
+                pos += 1
+            elif char == "*" or char == "_":
+                end = pos
+                while end < length and text[end] == char:
+                    end += 1
+                before = text[pos - 1] if pos > 0 else " "
+                after = text[end] if end < length else " "
+                if not after.isspace() and (before.isspace() or before in "([{\"'"):
+                    depth += 1
+                elif not before.isspace() and (after.isspace() or not after.isalnum()):
+                    depth = max(0, depth - 1)
+                pos = end
+            else:
+                pos += 1
+
+    def _target(self, text: str, open_: int, close: int) -> tuple[int, str] | None:
+        after = close + 1
+        if text.startswith("(", after):
+            end = _closing_paren(text, after)
+            if end is not None:
+                return end + 1, _destination(text[after + 1 : end])
+            return None
+        label = text[open_ + 1 : close]
+        if text.startswith("[", after):
+            end = _closing_bracket(text, after)
+            if end is not None:
+                if end > after + 1:
+                    label = text[after + 1 : end]
+                after = end + 1
+        return self._reference(label, after)
+
+
+def _closing_bracket(text: str, open_: int) -> int | None:
+    """Position of the bracket closing the one at open_, or None"""
+    depth = 0
+    pos = open_
+    while pos < len(text):
+        char = text[pos]
+        if char == "\\":
+            pos += 2
+            continue
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    return None
+
+
+def _closing_paren(text: str, open_: int) -> int | None:
+    """Position of the parenthesis closing the one at open_, or None"""
+    pos = open_ + 1
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    if text.startswith("<", pos):  # <destination> may contain parentheses
+        close = text.find(">", pos)
+        if close >= 0 and "\n" not in text[pos:close]:
+            pos = close + 1
+    depth = 1
+    while pos < len(text):
+        char = text[pos]
+        if char == "\\":
+            pos += 2
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    return None
+
+
+def _load_yaml(lines: list[str]):
+    # Most metadata blocks are simple key: value lines, which are parsed
+    # directly since loading YAML takes longer than scanning the document.
+    simple = {}
+    for line in lines:
+        match = _SIMPLE_YAML.match(line)
+        if match is None:
+            break
+        simple[match.group(1)] = match.group(2)
+    else:
+        return simple
+    import yaml  # only here, importing it takes longer than most scans
+
+    try:
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        return yaml.load("\n".join(lines), Loader=loader)
+    except yaml.YAMLError:
+        return None
+
+
+def _is_output(attributes: str) -> bool:
+    if attributes.startswith("{"):
+        return ".output" in attributes.strip("{}").split()
+    return attributes.split()[0] == "output"
+
+
+def _plain(text: str) -> str:
+    """Roughly what pandoc's stringify returns for the given inline markdown"""
+    text = re.sub(
+        r"!?\[((?:[^\[\]]|\[[^\]]*\])*)\](?:\([^)]*\)|\[[^\]]*\])?", r"\1", text
+    )
+    text = _SPECIAL.sub("", text)
+    return " ".join(_unescape(text).split())
+
+
+def scan_markdown(text: str, html_images: bool = False) -> DocInfo:
+    """Finds the images, links and title in the given markdown text, see :class:`Scanner`."""
+    return Scanner(html_images).scan(text)
+
+
+def scan_file(markdown: Path) -> DocInfo:
+    """Scans a markdown file, or the markdown cells of a Jupyter notebook."""
+    if guess_format(markdown) == "ipynb":
+        text, title = notebook_markdown(markdown)
+        info = scan_markdown(text)
+        if info.title is None:
+            info.title = title
+        return info
+    return scan_markdown(markdown.read_text(encoding="utf-8"))
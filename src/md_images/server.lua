@@ -0,0 +1,35 @@
+-- Converts documents to pandoc JSON, one request at a time, until stdin is closed.
+--
+-- Usage: pandoc lua server.lua
+--
+-- Each request is a line 'FORMAT LENGTH' followed by LENGTH bytes of text in
+-- the given input format. For each request, one line is written to stdout:
+-- either the document as pandoc JSON, or an error message prefixed with '!'.
+
+local function convert(text, format)
+  return pandoc.write(pandoc.read(text, format), 'json')
+end
+
+while true do
+  local header = io.read('l')
+  if not header then
+    break
+  end
+  local format, length = header:match('^(%S+) (%d+)$')
+  local text = ''
+  if length and tonumber(length) > 0 then
+    text = io.read(tonumber(length)) or ''
+  end
+  local ok, result
+  if format then
+    ok, result = pcall(convert, text, format)
+  else
+    ok, result = false, 'invalid request: ' .. header
+  end
+  if ok then
+    io.write(result, '\n')
+  else
+    io.write('!', tostring(result):gsub('\n', ' '), '\n')
+  end
+  io.flush()
+end
@@ -0,0 +1,162 @@
+"""
+A long-running pandoc process for converting many single documents.
+
+Starting pandoc costs far more than parsing a typical small markdown file.
+:class:`PandocServer` starts ``pandoc lua server.lua`` once and sends it one
+document after the other over stdin. :func:`convert_json` uses a shared server
+per process and falls back to running pandoc for each document if the server
+cannot be started (e.g., with pandoc 2, which has no ``pandoc lua``).
+
+pandoc's own HTTP server (``pandoc server``) is not used, since many pandoc
+builds cannot run it, and it would additionally need a free port.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from os import fspath
+from pathlib import Path
+from shutil import which
+from functools import cache
+from subprocess import DEVNULL, PIPE, Popen, TimeoutExpired, run
+
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+_SERVER_SCRIPT = Path(__file__).with_name("server.lua")
+
+
+class PandocServerError(OSError):
+    """The server process could not be started or has died."""
+
+
+class PandocServer:
+    """
+    A pandoc process converting documents to pandoc JSON on request.
+
+    Raises:
+        PandocServerError: if pandoc cannot be found or started
+    """
+
+    def __init__(self, pandoc: str | None = None):
+        pandoc = pandoc or which("pandoc")
+        if pandoc is None:
+            raise PandocServerError("pandoc not found")
+        try:
+            self._process = Popen(
+                [pandoc, "lua", fspath(_SERVER_SCRIPT)],
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=DEVNULL,
+            )
+        except OSError as e:
+            raise PandocServerError(f"Could not start pandoc: {e}") from e
+        self._lock = threading.Lock()
+        self.pid = os.getpid()  # of the process owning the server
+        stats.count("pandoc server starts")
+
+    def convert(self, text: str, input_format: str) -> str:
+        """
+        Converts text in the given format to pandoc JSON.
+
+        Raises:
+            OSError: if pandoc could not convert the text
+            PandocServerError: if the server does not respond
+        """
+        data = text.encode("utf-8")
+        with self._lock:
+            try:
+                self._process.stdin.write(f"{input_format} {len(data)}\n".encode())
+                self._process.stdin.write(data)
+                self._process.stdin.flush()
+                line = self._process.stdout.readline()
+            except (OSError, ValueError) as e:
+                raise PandocServerError(f"pandoc server failed: {e}") from e
+        if not line.endswith(b"\n"):
+            raise PandocServerError(
+                f"pandoc server exited with code {self._process.poll()}"
+            )
+        result = line[:-1].decode("utf-8")
+        if result.startswith("!"):
+            raise OSError(result[1:])
+        return result
+
+    def close(self):
+        """Stops the server process."""
+        if self._process.poll() is None:
+            self._process.stdin.close()
+            try:
+                self._process.wait(timeout=5)
+            except TimeoutExpired:
+                self._process.kill()
+        self._process.stdout.close()
+
+    def __enter__(self) -> "PandocServer":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_server: PandocServer | None = None
+_server_supported = True
+
+
+def _shared_server() -> PandocServer | None:
+    global _server, _server_supported
+    if _server is not None and _server.pid != os.getpid():
+        _server = None  # inherited by a forked worker process, belongs to the parent
+    if _server is None and _server_supported:
+        try:
+            server = PandocServer()
+        except PandocServerError as e:
+            logger.debug("Not using a pandoc server: %s", e)
+            _server_supported = False
+            return None
+        try:
+            server.convert("", "markdown")  # fails early with pandoc 2
+        except PandocServerError as e:
+            logger.debug("Not using a pandoc server: %s", e)
+            _server_supported = False
+            server.close()
+            return None
+        _server = server
+        atexit.register(server.close)
+    return _server
+
+
+def convert_json(text: str, input_format: str) -> str:
+    """
+    Converts text in the given format to a standalone pandoc JSON document,
+    like ``pf.convert_text(..., output_format="json", standalone=True)``, but using
+    the process' pandoc server if possible.
+    """
+    global _server, _server_supported
+    server = _shared_server()
+    if server is not None:
+        try:
+            return server.convert(text, input_format)
+        except PandocServerError as e:
+            logger.debug("pandoc server failed, falling back: %s", e)
+            _server, _server_supported = None, False
+            server.close()
+    import panflute as pf
+
+    return pf.convert_text(
+        text, input_format=input_format, output_format="json", standalone=True
+    )
+
+
+@cache
+def pandoc_version() -> str:
+    """
+    The version of the pandoc on the PATH, like ``str(panflute.tools.pandoc_version)``
+    but without importing panflute.
+    """
+    pandoc = which("pandoc")
+    if pandoc is None:
+        raise OSError("pandoc not found")
+    output = run([pandoc, "--version"], capture_output=True, check=True).stdout
+    return output.decode("utf-8").splitlines()[0].split(" ")[1]
@@ -0,0 +1,107 @@
+"""
+Counters and timers for finding out where md-images spends its time.
+
+The module-level :data:`stats` object collects the numbers for the current
+process. Code that does something expensive counts it with
+:meth:`Stats.count` or times it with :meth:`Stats.timer`; both are cheap
+enough to stay enabled all the time. Worker processes send their numbers
+back to the main process, see :func:`md_images.parallel.map_batches`.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+class Stats:
+    """
+    Named counters and timers.
+
+    Timers record the total time and the number of calls per name. If tracing
+    is enabled, each timed span is recorded as well, for a Chrome trace.
+    """
+
+    def __init__(self):
+        self.counters: Counter[str] = Counter()
+        self.times: defaultdict[str, float] = defaultdict(float)
+        self.calls: Counter[str] = Counter()
+        self.spans: list[dict] | None = None
+        self._lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.times[name] += end - start
+                self.calls[name] += 1
+                if self.spans is not None:
+                    self.spans.append(
+                        {
+                            "name": name,
+                            "ph": "X",
+                            "ts": start * 1e6,
+                            "dur": (end - start) * 1e6,
+                            "pid": os.getpid(),
+                            "tid": threading.get_ident(),
+                        }
+                    )
+
+    def snapshot(self) -> dict:
+        """The numbers collected so far, as a picklable dict for :meth:`merge`."""
+        return {
+            "counters": dict(self.counters),
+            "times": dict(self.times),
+            "calls": dict(self.calls),
+            "spans": self.spans,
+        }
+
+    def merge(self, snapshot: dict):
+        """Adds the numbers from another process' :meth:`snapshot`."""
+        self.counters.update(snapshot["counters"])
+        for name, seconds in snapshot["times"].items():
+            self.times[name] += seconds
+        self.calls.update(snapshot["calls"])
+        if self.spans is not None and snapshot["spans"]:
+            self.spans.extend(snapshot["spans"])
+
+    def reset(self, trace: bool | None = None):
+        """Clears all numbers. trace enables or disables span recording."""
+        if trace is None:
+            trace = self.spans is not None
+        self.counters.clear()
+        self.times.clear()
+        self.calls.clear()
+        self.spans = [] if trace else None
+
+    def rows(self) -> list[tuple[str, str, str]]:
+        """Summary rows of name, count and total time (for timers)."""
+        rows = [
+            (name, str(self.calls[name]), f"{self.times[name]:.3f} s")
+            for name in sorted(self.times)
+        ]
+        rows.extend(
+            (name, f"{self.counters[name]:,}", "") for name in sorted(self.counters)
+        )
+        return rows
+
+    def write_trace(self, path: Path):
+        """Writes the recorded spans in Chrome's trace event format."""
+        events = list(self.spans or [])
+        path.write_text(json.dumps({"traceEvents": events}), encoding="utf-8")
+
+
+#: The statistics of the current process
+stats = Stats()
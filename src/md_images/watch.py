@@ -0,0 +1,371 @@
+"""
+Keeping dependency files and image checks up to date while texts are edited.
+
+A :class:`WatchSession` holds all text files and the images they reference in
+memory. When it is told which files changed, it re-parses only the changed
+texts and re-checks only the affected images. Changes are detected by an
+:class:`InotifyWatcher` on Linux or by a :class:`PollingWatcher` elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Iterable, Protocol
+
+from .cache import ParseCache
+from .depfile import write_if_changed
+from .dirindex import directory_index
+from .model import Engine, MdFile, SourceSelection, load_infos
+
+logger = logging.getLogger(__name__)
+
+
+def _key(path: Path) -> Path:
+    return Path(os.path.abspath(path))
+
+
+class WatchSession:
+    """
+    The texts being watched and the images they reference.
+
+    Args:
+        texts: the text files to watch
+        select: which images to check, see :class:`SourceSelection`
+        suffix: target suffixes for the dependency rules, see `md-images dep`
+        individual_dependencies: if given, keep a dependency file with this suffix
+            up to date for each text
+        cache: the parse cache to use, if any
+        engine: how to parse the texts
+        report: called with the missing images per text whenever they change
+    """
+
+    def __init__(
+        self,
+        texts: Iterable[Path],
+        select: SourceSelection = SourceSelection.EXPLICIT,
+        suffix: list[str] | None = None,
+        individual_dependencies: str | None = None,
+        cache: ParseCache | None = None,
+        engine: Engine = Engine.PANDOC,
+        report: Callable[[dict[Path, list[Path]]], None] | None = None,
+    ):
+        self.texts = {_key(text): Path(text) for text in texts}
+        self.select = select
+        self.suffix = suffix
+        self.individual_dependencies = individual_dependencies
+        self.cache = cache
+        self.engine = engine
+        self.report = report
+        self.sources: dict[Path, MdFile] = {}
+        self.images: dict[Path, set[Path]] = {}  # text -> images
+        self.users: dict[Path, set[Path]] = defaultdict(set)  # image -> texts
+        self.stems: dict[tuple[Path, str], set[Path]] = defaultdict(set)
+        self.present: dict[Path, bool] = {}
+        self._reported: dict[Path, list[Path]] | None = None
+        self._parse(list(self.texts))
+        self._report()
+
+    def paths(self) -> set[Path]:
+        """All files whose changes are relevant, as absolute paths."""
+        return set(self.texts) | set(self.users)
+
+    def _parse(self, keys: list[Path]):
+        texts = [self.texts[key] for key in keys]
+        for key, text, info in zip(
+            keys, texts, load_infos(texts, self.cache, self.engine)
+        ):
+            if isinstance(info, Exception):
+                logger.error("Could not process %s: %s", text, str(info) or repr(info))
+                self.sources.pop(key, None)
+                self._set_images(key, set())
+                continue
+            source = MdFile(text, info=info)
+            self.sources[key] = source
+            self._update_images(key)
+            if self.individual_dependencies:
+                rules = [source.rule(suf) for suf in self.suffix or []]
+                depfile = text.with_suffix(self.individual_dependencies)
+                try:
+                    if write_if_changed(
+                        depfile, "\n".join(rules or [source.rule()]) + "\n"
+                    ):
+                        logger.info("Updated %s", depfile)
+                except OSError as e:
+                    logger.error("Could not write %s: %s", depfile, e)
+
+    def _update_images(self, key: Path):
+        self._set_images(
+            key, {_key(img) for img in self.sources[key].image_sources(self.select)}
+        )
+
+    def _set_images(self, key: Path, images: set[Path]):
+        old = self.images.get(key, set())
+        for image in old - images:
+            self.users[image].discard(key)
+            if not self.users[image]:
+                del self.users[image]
+                del self.present[image]
+        for image in images - old:
+            self.users[image].add(key)
+            if image not in self.present:
+                self.present[image] = image.exists()
+        if self.select != SourceSelection.EXPLICIT:
+            for image in old:
+                self.stems[image.parent, image.with_suffix("").stem].discard(key)
+            for image in images:
+                self.stems[image.parent, image.with_suffix("").stem].add(key)
+        self.images[key] = images
+
+    def _variant_users(self, path: Path) -> set[Path]:
+        """Texts that might select path as a variant of one of their images."""
+        result = set()
+        dot = path.name.find(".", 1)
+        while dot > 0:
+            result |= self.stems.get((path.parent, path.name[:dot]), set())
+            dot = path.name.find(".", dot + 1)
+        return result
+
+    def update(self, changed: Iterable[Path]):
+        """
+        Processes changes to the given files: re-parses changed texts, re-checks
+        changed images and reports missing images if that changed.
+        """
+        changed = {_key(path) for path in changed}
+        if self.select != SourceSelection.EXPLICIT:
+            directory_index.clear()
+        texts = [key for key in self.texts if key in changed]
+        if texts:
+            self._parse(texts)
+        if self.select != SourceSelection.EXPLICIT:
+            affected = set()
+            for path in changed:
+                affected |= self._variant_users(path)
+            for key in affected - set(texts):
+                if key in self.sources:
+                    self._update_images(key)
+        for path in changed:
+            if path in self.present:
+                self.present[path] = path.exists()
+        self._report()
+
+    def missing(self) -> dict[Path, list[Path]]:
+        """The missing images for each text that has some."""
+        result = {}
+        for key, text in self.texts.items():
+            missing = sorted(
+                img for img in self.images.get(key, ()) if not self.present[img]
+            )
+            if missing:
+                result[text] = missing
+        return result
+
+    def _report(self):
+        missing = self.missing()
+        if missing != self._reported:
+            self._reported = missing
+            if self.report is not None:
+                self.report(missing)
+
+
+class Watcher(Protocol):
+    def watch(self, paths: set[Path]) -> None:
+        """Sets the absolute paths of the files to watch."""
+
+    def changes(self, timeout: float | None = None) -> set[Path]:
+        """Waits for changes and returns the paths that changed."""
+
+    def close(self) -> None: ...
+
+
+class PollingWatcher:
+    """
+    Detects changes by regularly checking the modification time and size of
+    all watched files.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._stats: dict[Path, tuple[int, int] | None] = {}
+
+    @staticmethod
+    def _stat(path: Path) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def watch(self, paths: set[Path]):
+        self._stats = {
+            path: self._stats[path] if path in self._stats else self._stat(path)
+            for path in paths
+        }
+
+    def changes(self, timeout: float | None = None) -> set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path, old in self._stats.items():
+                new = self._stat(path)
+                if new != old:
+                    self._stats[path] = new
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_EVENT = struct.Struct("iIII")
+_DIR_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+
+class InotifyWatcher:
+    """
+    Detects changes using Linux' inotify API. Watches the directories containing
+    the watched files, so files that are replaced, created or deleted are noticed.
+    Directories that do not exist yet are watched via their nearest existing
+    ancestor.
+
+    Raises:
+        OSError: if inotify is not available
+    """
+
+    #: time to wait for further events after the first one, to handle them together
+    settle_time = 0.05
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, "inotify is not available") from e
+        self._fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._paths: set[Path] = set()
+        self._dirs: dict[Path, int] = {}  # directory -> watch descriptor
+        self._wds: dict[int, Path] = {}
+
+    def _add_watch(self, directory: Path) -> bool:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _DIR_MASK)
+        if wd < 0:
+            return False
+        self._dirs[directory] = wd
+        self._wds[wd] = directory
+        return True
+
+    def watch(self, paths: set[Path]):
+        self._paths = set(paths)
+        self._sync()
+
+    def _sync(self):
+        for directory in {path.parent for path in self._paths}:
+            while directory not in self._dirs and not self._add_watch(directory):
+                if directory.parent == directory:
+                    break
+                directory = directory.parent
+
+    def _read(self) -> tuple[set[Path], bool]:
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return set(), False
+        changed, overflow = set(), False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            directory = self._wds.get(wd)
+            if directory is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                del self._dirs[directory], self._wds[wd]
+                overflow = True
+            elif name:
+                changed.add(directory / os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    overflow = True
+        return changed, overflow
+
+    def changes(self, timeout: float | None = None) -> set[Path]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        time.sleep(self.settle_time)
+        changed, overflow = self._read()
+        while True:
+            more, more_overflow = self._read()
+            if not more and not more_overflow:
+                break
+            changed |= more
+            overflow |= more_overflow
+        if overflow:
+            # directories appeared or vanished, or events were lost
+            self._sync()
+            changed |= self._paths
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def default_watcher(poll: bool = False, interval: float = 0.5) -> Watcher:
+    """An inotify based watcher if available and poll is false, else a polling one."""
+    if not poll:
+        try:
+            return InotifyWatcher()
+        except OSError as e:
+            logger.debug("Falling back to polling: %s", e)
+    return PollingWatcher(interval)
+
+
+def watch_loop(session: WatchSession, watcher: Watcher):
+    """Feeds the changes detected by watcher into session, until interrupted."""
+    try:
+        while True:
+            watcher.watch(session.paths())
+            changed = watcher.changes()
+            if changed:
+                session.update(changed)
+    finally:
+        watcher.close()
@@ -5,3 +5,11 @@ import pytest
 @pytest.fixture
 def mdfile():
     return Path(__file__).parent / "test.md"
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path_factory, monkeypatch):
+    """Keep the parse cache of the tests away from the user's cache."""
+    cache_home = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    return cache_home
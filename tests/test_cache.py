@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from md_images import cache as cache_module
+from md_images.cache import ParseCache, default_cache_dir
+from md_images.core import DocInfo
+from md_images.model import MdFile
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ParseCache(tmp_path / "cache")
+
+
+def test_default_dir(cache_home):
+    assert default_cache_dir() == cache_home / "md-images"
+
+
+def test_roundtrip(cache):
+    key = cache.key(b"![Image](example.png)", "markdown")
+    assert cache.get(key) is None
+    info = DocInfo(images=["example.png"], links=[], title="Test")
+    cache.put(key, info)
+    assert cache.get(key) == info
+    assert len(cache) == 1
+
+
+def test_key_depends_on_format(cache):
+    assert cache.key(b"foo", "markdown") != cache.key(b"foo", "html")
+    assert cache.key(b"foo", "markdown") != cache.key(b"bar", "markdown")
+
+
+def test_key_depends_on_cache_version(cache, monkeypatch):
+    key = cache.key(b"text", "markdown")
+    monkeypatch.setattr(cache_module, "CACHE_VERSION", cache_module.CACHE_VERSION + 1)
+    assert cache.key(b"text", "markdown") != key
+
+
+def test_lru_eviction(cache):
+    keys = [cache.key(str(i).encode(), "markdown") for i in range(10)]
+    for i, key in enumerate(keys):
+        cache.put(key, DocInfo(images=[f"{i}.png"]))
+        os.utime(cache._entry(key), ns=(i * 10**9, i * 10**9))
+    cache.get(keys[0])  # recently used now
+    entry_size = cache._entry(keys[0]).stat().st_size
+    cache.prune(max_size=5 * entry_size)
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[9]) is not None
+    assert cache.size() <= 5 * entry_size
+
+
+def test_clear(cache):
+    cache.put(cache.key(b"foo", "markdown"), DocInfo())
+    assert cache.clear() == 1
+    assert len(cache) == 0
+
+
+def test_mdfile_uses_cache(mdfile, cache, monkeypatch):
+    first = MdFile(mdfile, cache)
+    assert len(cache) == 0  # nothing is parsed before it is needed
+    assert first.image_urls == {"example.png"}
+    assert len(cache) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("document should not be parsed")
+
+    monkeypatch.setattr("md_images.model.load_markdown", fail)
+    second = MdFile(mdfile, cache)
+    assert second.image_urls == first.image_urls == {"example.png"}
+    assert str(second) == str(first)
@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import pytest
+
+from md_images import cli, model
+from md_images.cli import check, dep, links, ls
+from md_images.model import SourceSelection
+from md_images.stats import stats
+
+
+@pytest.fixture
+def texts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in "abc":
+        Path(f"{name}.md").write_text(f"![]({name}.png)\n")
+    return [Path(f"{name}.md") for name in "abc"]
+
+
+@pytest.fixture
+def examples(monkeypatch):
+    monkeypatch.chdir(Path(__file__).parent)
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """Records which texts are loaded and what is printed, in order."""
+    events = []
+    load_json_batch = model.load_json_batch
+
+    def recording_load_json_batch(texts, *args, **kwargs):
+        events.extend(("load", text.name) for text in texts)
+        return load_json_batch(texts, *args, **kwargs)
+
+    monkeypatch.setattr(model, "load_json_batch", recording_load_json_batch)
+    monkeypatch.setattr(
+        cli, "print", lambda *args, **kwargs: events.append(("print", *args))
+    )
+    return events
+
+
+@pytest.mark.parametrize("command", [ls, dep])
+def test_streams_per_file(texts, events, command):
+    command(texts, jobs=1, no_cache=True)
+    assert [event[0] for event in events] == ["load", "print"] * 3
+
+
+def test_check_reads_directories_once(texts):
+    Path("a.svg").touch()
+    Path("b.png").touch()
+    assert check(texts, select=SourceSelection.BOTH, no_cache=True, jobs=1) == 1
+    assert stats.counters["directory scans"] == 1
+
+
+def test_ls_deduplicates(examples, capsys):
+    assert ls([Path("test.md"), Path("test.md")], jobs=1, no_cache=True) == 0
+    assert capsys.readouterr().out == "example.png\n"
+
+
+def test_rules_per_file(examples, capsys):
+    dep(
+        [Path("test.md"), Path("urllist-example.md")],
+        suffix=[".pdf"],
+        jobs=1,
+        no_cache=True,
+    )
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "test.pdf : test.md example.png"
+    assert lines[1].startswith("urllist-example.pdf :")
+
+
+def test_check_summary_only(texts, capsys, caplog):
+    Path("a.md").write_text("![](a.png) ![](missing.png) ![](missing/other.png)\n")
+    Path("a.png").touch()
+    assert check([Path("a.md")], summary_only=True, jobs=1, no_cache=True) == 1
+    assert "missing.png" not in capsys.readouterr().out
+    assert "2 images missing, 1 present" in caplog.text
+
+
+def test_check_unreadable_text(texts, caplog):
+    Path("a.png").touch()
+    assert check([Path("a.md"), Path("missing.md")], jobs=1, no_cache=True) == 1
+    assert "1 texts could not be read" in caplog.text
+    assert "images missing" not in caplog.text
+
+
+def test_links_unique(examples, tmp_path, capsys):
+    text = tmp_path / "links.md"
+    text.write_text("[a](https://x.org) [*a*](https://x.org) [b](https://x.org)\n")
+    links([Path("test.md"), text, Path("test.md")], unique_=True, jobs=1)
+    assert capsys.readouterr().out == (
+        "test.md\thttps://example.com\tlink\n"
+        f"{text}\thttps://x.org\ta\n"
+        f"{text}\thttps://x.org\tb\n"
+    )
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import shutil
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from md_images.cli import cp
+from md_images.contenthash import HashCache, hash_file
+from md_images.copyplan import CopyMode, CopyPlan, is_up_to_date
+from md_images.stats import stats
+
+
+@pytest.fixture
+def files(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ["a.png", "b.png"]:
+        (src / name).write_bytes(name.encode() * 1000)
+    return src
+
+
+def test_copy(files, tmp_path):
+    plan = CopyPlan()
+    plan.add(files / "a.png", tmp_path / "out" / "a.png")
+    plan.add(files / "b.png", tmp_path / "out" / "sub" / "b.png")
+    assert plan.execute() == {}
+    for src, dest in [("a.png", "a.png"), ("b.png", "sub/b.png")]:
+        assert (tmp_path / "out" / dest).read_bytes() == (files / src).read_bytes()
+        assert is_up_to_date(files / src, tmp_path / "out" / dest)
+
+
+def test_dedupe(files, tmp_path):
+    plan = CopyPlan()
+    plan.add(files / "a.png", tmp_path / "out" / "a.png")
+    plan.add(files / "a.png", tmp_path / "out" / ".." / "out" / "a.png")
+    plan.add(files / "b.png", tmp_path / "out" / "a.png")
+    assert len(plan) == 1
+    plan.execute()
+    assert (tmp_path / "out" / "a.png").read_bytes() == (files / "a.png").read_bytes()
+
+
+def test_skip_up_to_date(files, tmp_path):
+    dest = tmp_path / "a.png"
+    plan = CopyPlan()
+    plan.add(files / "a.png", dest)
+    plan.execute()
+    dest.write_bytes(b"x" * dest.stat().st_size)  # same size, new mtime
+    stat = (files / "a.png").stat()
+    os.utime(dest, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    plan.execute()
+    assert dest.read_bytes() == b"x" * stat.st_size
+    os.utime(dest, ns=(0, 0))
+    plan.execute()
+    assert dest.read_bytes() == (files / "a.png").read_bytes()
+
+
+def test_link(files, tmp_path):
+    dest = tmp_path / "a.png"
+    shutil.copy(files / "a.png", dest)
+    plan = CopyPlan(CopyMode.LINK)
+    plan.add(files / "a.png", dest)
+    assert plan.execute() == {}
+    assert dest.samefile(files / "a.png")
+
+
+def test_missing_source(files, tmp_path):
+    plan = CopyPlan()
+    plan.add(files / "missing.png", tmp_path / "missing.png")
+    plan.add(files / "a.png", tmp_path / "a.png")
+    assert list(plan.execute()) == [files / "missing.png"]
+    assert (tmp_path / "a.png").exists()
+
+
+def test_cp_shared_images(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    shutil.copy(Path(__file__).parent / "example.png", src)
+    for name in ["one.md", "two.md"]:
+        (src / name).write_text(f"# {name}\n\n![Image](example.png)\n")
+    monkeypatch.chdir(src)
+    assert cp([Path("one.md"), Path("two.md")], tmp_path / "out", link=True) == 0
+    for name in ["one.md", "two.md", "example.png"]:
+        assert (tmp_path / "out" / name).samefile(src / name)
+
+
+def test_content_dedupe(files, tmp_path):
+    shutil.copy(files / "a.png", files / "a-copy.png")
+    out = tmp_path / "out"
+    plan = CopyPlan(dedupe=True, hash_cache=HashCache(tmp_path / "hashes.json"))
+    for name in ["a.png", "b.png", "a-copy.png"]:
+        plan.add(files / name, out / name)
+    assert plan.execute() == {}
+    assert (out / "a-copy.png").samefile(out / "a.png")
+    assert not (out / "b.png").samefile(out / "a.png")
+    assert not (out / "a.png").samefile(files / "a.png")
+
+    stats.reset()
+    assert plan.execute() == {}
+    assert stats.counters["hash cache hits"] == 3
+    assert "bytes hashed" not in stats.counters
+
+    # copying without dedupe must not write through the link
+    (files / "a-copy.png").write_bytes(b"changed")
+    plan = CopyPlan()
+    plan.add(files / "a-copy.png", out / "a-copy.png")
+    plan.execute()
+    assert (out / "a.png").read_bytes() == (files / "a.png").read_bytes()
+    assert (out / "a-copy.png").read_bytes() == b"changed"
+
+
+def test_symlink_fallback(files, tmp_path, monkeypatch):
+    def no_link(*args):
+        raise OSError("no hard links here")
+
+    monkeypatch.setattr(os, "link", no_link)
+    shutil.copy(files / "a.png", files / "a-copy.png")
+    plan = CopyPlan(dedupe=True)
+    plan.add(files / "a.png", tmp_path / "a.png")
+    plan.add(files / "a-copy.png", tmp_path / "sub" / "a-copy.png")
+    assert plan.execute() == {}
+    assert os.readlink(tmp_path / "sub" / "a-copy.png") == os.path.join("..", "a.png")
+
+
+def test_dedupe_into_sources(files, tmp_path):
+    shutil.copy(files / "a.png", files / "a-copy.png")
+    plan = CopyPlan(dedupe=True)
+    for name in ["a.png", "a-copy.png"]:
+        plan.add(files / name, files / name)  # e.g., cp into the source directory
+        plan.add(files / name, tmp_path / "out" / name)
+    assert plan.execute() == {}
+    assert (files / "a.png").stat().st_nlink == 1
+    assert (files / "a-copy.png").stat().st_nlink == 1
+    assert (tmp_path / "out" / "a-copy.png").samefile(tmp_path / "out" / "a.png")
+
+
+def test_hash_cache(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"content")
+    cache = HashCache(tmp_path / "hashes.json")
+    digest = hash_file(path, cache)
+    assert digest == hashlib.sha256(b"content").hexdigest()
+    cache.save()
+    assert HashCache(tmp_path / "hashes.json").get(path.stat()) == digest
+    path.write_bytes(b"new content")
+    assert HashCache(tmp_path / "hashes.json").get(path.stat()) is None
+
+
+@pytest.mark.parametrize("name", ["out.zip", "out.tar.gz", "out.tar"])
+def test_archive(files, tmp_path, name):
+    (files / "copy.png").write_bytes((files / "a.png").read_bytes())
+    plan = CopyPlan(dedupe=True)
+    plan.add(files / "a.png", tmp_path / "out" / "img" / "a.png")
+    plan.add(files / "b.png", tmp_path / "out" / "b.png")
+    plan.add(files / "copy.png", tmp_path / "out" / "img" / "copy.png")
+    archive = tmp_path / name
+    assert plan.write_archive(archive, base=tmp_path / "out") == {}
+    assert not (tmp_path / "out").exists()
+    assert [p.name for p in tmp_path.iterdir() if p.is_file()] == [name]
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(archive) as zf:
+            assert zf.namelist() == ["b.png", "img/a.png", "img/copy.png"]
+            assert zf.read("img/copy.png") == (files / "a.png").read_bytes()
+    else:
+        with tarfile.open(archive) as tf:
+            assert tf.getnames() == ["b.png", "img/a.png", "img/copy.png"]
+            assert tf.getmember("img/copy.png").islnk()  # stored only once
+            copy = tf.extractfile("img/copy.png").read()  # follows the link
+        assert copy == (files / "a.png").read_bytes()
+
+
+def test_archive_errors(files, tmp_path):
+    plan = CopyPlan()
+    plan.add(files / "missing.png", tmp_path / "missing.png")
+    plan.add(files / "a.png", tmp_path / "a.png")
+    with pytest.raises(ValueError):
+        plan.write_archive(tmp_path / "out.rar", base=tmp_path)
+    failed = plan.write_archive(tmp_path / "out.zip", base=tmp_path)
+    assert list(failed) == [files / "missing.png"]
+    with zipfile.ZipFile(tmp_path / "out.zip") as zf:
+        assert zf.namelist() == ["a.png"]
+
+
+def test_cp_archive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "texts" / "img").mkdir(parents=True)
+    (tmp_path / "texts" / "img" / "a.png").write_text("a")
+    (tmp_path / "texts" / "one.md").write_text("![](img/a.png)\n")
+    (tmp_path / "texts" / "two.md").write_text("![](img/a.png)\n")
+    texts = [Path("texts/one.md"), Path("texts/two.md")]
+    assert cp(texts, Path("docs.zip"), archive=True, no_cache=True, jobs=1) == 0
+    with zipfile.ZipFile("docs.zip") as zf:
+        assert zf.namelist() == ["img/a.png", "one.md", "two.md"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["docs.zip", "texts"]
+
+
+def test_cp_archive_parent_images(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "book" / "img").mkdir(parents=True)
+    (tmp_path / "book" / "img" / "a.png").write_text("a")
+    (tmp_path / "book" / "chapters").mkdir()
+    (tmp_path / "book" / "chapters" / "one.md").write_text("![](../img/a.png)\n")
+    monkeypatch.chdir(tmp_path / "book" / "chapters")
+    assert (
+        cp(
+            [Path("one.md")],
+            Path("../../docs.tar"),
+            archive=True,
+            no_cache=True,
+            jobs=1,
+        )
+        == 0
+    )
+    with tarfile.open(tmp_path / "docs.tar") as tf:
+        assert tf.getnames() == ["chapters/one.md", "img/a.png"]
@@ -3,7 +3,19 @@ from pathlib import Path
 import pytest
 
 from md_images import load_markdown, resolve_url
-from md_images.core import deppattern, unique
+from md_images.core import (
+    deppattern,
+    find_all,
+    find_images,
+    link_key,
+    load_json,
+    load_json_batch,
+    load_markdown_batch,
+    notebook_markdown,
+    unique,
+)
+from md_images.model import Engine, MdFile
+from md_images.stats import stats
 import panflute as pf
 
 
@@ -35,4 +47,74 @@ def test_deppattern(pattern, expected):
 def test_unique():
     assert unique([]) == []
     assert unique([1, 2, 3]) == [1, 2, 3]
-    assert unique([3, 2, 3]) == [3, 2]
\ No newline at end of file
+    assert unique([3, 2, 3]) == [3, 2]
+
+
+def test_unique_links():
+    doc = pf.convert_text(
+        '[a](x) [*a*](x) [a](x "title") [b](x) [a](y)', standalone=True
+    )
+    links = unique(find_all(doc, pf.Link), key=link_key)
+    assert [link_key(link) for link in links] == [
+        ("x", "", "a"),
+        ("x", "title", "a"),
+        ("x", "", "b"),
+        ("y", "", "a"),
+    ]
+
+
+def test_load_markdown_batch(mdfile, tmp_path):
+    other = mdfile.with_name("urllist-example.md")
+    missing = tmp_path / "missing.md"
+    docs = load_markdown_batch([mdfile, missing, other])
+    assert docs[0] == load_markdown(mdfile)
+    assert isinstance(docs[1], Exception)
+    assert docs[2] == load_markdown(other)
+
+
+def test_load_json_batch_line_separator(mdfile, tmp_path):
+    other = tmp_path / "separator.md"
+    other.write_text("A\u2028B ![](a.png)\n", encoding="utf-8")
+    stats.reset()
+    docs = load_json_batch([mdfile, other])
+    assert stats.counters["pandoc calls"] == 1  # not converted one by one
+    assert docs == [load_json(mdfile), load_json(other)]
+
+
+def test_load_markdown_batch_fallback(mdfile, monkeypatch):
+    monkeypatch.setattr("md_images.core.which", lambda _: None)
+    docs = load_markdown_batch([mdfile, mdfile])
+    assert docs == [load_markdown(mdfile)] * 2
+
+
+@pytest.fixture
+def notebook():
+    return Path(__file__).parent / "notebook.ipynb"
+
+
+def test_notebook_markdown(notebook):
+    text, title = notebook_markdown(notebook)
+    assert title == "notebook"
+    assert "![Example](example.png)" in text
+    assert "code.png" not in text
+    assert "generated.png" not in text
+
+
+@pytest.mark.parametrize("engine", list(Engine))
+def test_notebook_images(notebook, engine):
+    source = MdFile(notebook, engine=engine)
+    assert source.info.title == "notebook"
+    assert source.image_paths == {
+        notebook.parent / "example.png",
+        notebook.parent / "img" / "second.svg",
+    }
+
+
+def test_notebook_doc(notebook):
+    doc = load_markdown(notebook)
+    assert pf.stringify(doc.metadata["title"]) == "notebook"
+    assert [img.url for img in find_images(doc)] == [
+        "example.png",
+        "attachment:inline.png",
+        "img/second.svg",
+    ]
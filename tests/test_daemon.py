@@ -0,0 +1,104 @@
+import os
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from md_images import daemon
+from md_images.cli import check, dep, ls
+from md_images.daemon import QueryServer, ServerError, query
+from md_images.model import SourceSelection
+
+
+@pytest.fixture
+def texts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "a.png").write_text("a")
+    (tmp_path / "img" / "a.svg").write_text("a")
+    (tmp_path / "text.md").write_text("![](img/a.png) ![](missing.png)\n")
+    return [Path("text.md")]
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    path = tmp_path / "md-images.sock"
+    monkeypatch.setenv(daemon.SOCKET_VARIABLE, str(path))
+    server = QueryServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    assert not path.exists()
+
+
+def outputs(capsys, texts) -> list[str]:
+    ls(texts, jobs=1)
+    ls(texts, select=SourceSelection.SOURCE, jobs=1)
+    dep(texts, suffix=[".pdf"], jobs=1)
+    check(texts, quiet=True, select=SourceSelection.BOTH, jobs=1)
+    lines = capsys.readouterr().out.splitlines()
+    target, deps = lines[4].split(" : ")
+    lines[4] = f"{target} : {' '.join(sorted(deps.split()))}"  # rules are unordered
+    return lines
+
+
+def test_same_output(texts, server, capsys, monkeypatch):
+    loaded = []
+
+    def load_infos(texts, *args):
+        loaded.extend(texts)
+        return original(texts, *args)
+
+    original = daemon.load_infos
+    monkeypatch.setattr(daemon, "load_infos", load_infos)
+    served = outputs(capsys, texts)
+    assert served == [
+        "img/a.png",
+        "missing.png",
+        "img/a.svg",
+        "missing.png",
+        "text.pdf : img/a.png missing.png text.md",
+        "missing.png",
+    ]
+    assert outputs(capsys, texts) == served
+    assert loaded == [Path.cwd() / "text.md"]  # parsed once, then from memory
+
+    server.shutdown()
+    server.server_close()
+    assert outputs(capsys, texts) == served  # in-process fallback
+
+
+def test_revalidation(texts, server):
+    assert query(texts)[0].image_urls == {"img/a.png", "missing.png"}
+    Path("text.md").write_text("![](img/b.png)\n")
+    assert query(texts)[0].image_urls == {"img/b.png"}
+    assert query(texts, select=SourceSelection.SOURCE)[0].image_sources(
+        SourceSelection.SOURCE
+    ) == {Path("img/b.png")}
+    Path("img/b.tex").write_text("b")  # new variant, noticed via the directory mtime
+    assert query(texts, select=SourceSelection.SOURCE)[0].image_sources(
+        SourceSelection.SOURCE
+    ) == {Path("img/b.tex")}
+
+
+def test_errors(texts, server):
+    result = query([Path("missing.md"), *texts])
+    assert isinstance(result[0], ServerError)
+    assert result[1].image_urls == {"img/a.png", "missing.png"}
+
+
+def test_no_server(texts, tmp_path):
+    assert query(texts, path=tmp_path / "none.sock") is None
+    stale = tmp_path / "stale.sock"
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(os.fspath(stale))  # bound, but nobody listens
+    assert query(texts, path=stale) is None
+    with QueryServer(stale) as server:  # replaces the stale socket
+        assert daemon.available(stale)
+        with pytest.raises(ServerError):
+            QueryServer(stale)
+    assert not stale.exists()
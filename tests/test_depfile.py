@@ -0,0 +1,78 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from md_images.cli import dep
+from md_images.depfile import dep_header, read_header, write_if_changed
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ["test.md", "example.png"]:
+        shutil.copy(Path(__file__).parent / name, tmp_path)
+    return Path("test.md")
+
+
+def test_header_depends_on_content_and_suffixes():
+    assert dep_header(b"foo") == dep_header(b"foo", [])
+    assert dep_header(b"foo") != dep_header(b"bar")
+    assert dep_header(b"foo", [".pdf"]) != dep_header(b"foo", [".html"])
+
+
+def test_header_depends_on_engine_selection_and_base(tmp_path):
+    header = dep_header(b"foo", [".pdf"], "pandoc", "explicit", tmp_path)
+    assert header == dep_header(b"foo", [".pdf"], "pandoc", "explicit", tmp_path)
+    assert header != dep_header(b"foo", [".pdf"], "fast", "explicit", tmp_path)
+    assert header != dep_header(b"foo", [".pdf"], "pandoc", "source", tmp_path)
+    assert header != dep_header(b"foo", [".pdf"], "pandoc", "explicit", tmp_path / "x")
+
+
+def test_incremental_other_directory(source, monkeypatch):
+    depfile = source.with_suffix(".d").absolute()
+    dep([source], individual_dependencies=".d", incremental=True)
+    assert depfile.read_text().endswith("\ntest.md : example.png\n")
+    (source.parent / "sub").mkdir()
+    monkeypatch.chdir("sub")
+    dep([Path("../test.md")], individual_dependencies=".d", incremental=True)
+    assert depfile.read_text().endswith("\n../test.md : ../example.png\n")
+
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / "test.d"
+    assert write_if_changed(path, "foo\n")
+    os.utime(path, ns=(0, 0))
+    assert not write_if_changed(path, "foo\n")
+    assert path.stat().st_mtime_ns == 0
+    assert write_if_changed(path, "bar\n")
+    assert path.read_text() == "bar\n"
+
+
+def test_incremental(source, caplog):
+    caplog.set_level(logging.INFO)
+    depfile = source.with_suffix(".d")
+    assert dep([source], individual_dependencies=".d", incremental=True) == 0
+    assert read_header(depfile) == dep_header(source.read_bytes())
+    assert depfile.read_text().endswith("test.md : example.png\n")
+    os.utime(depfile, ns=(0, 0))
+
+    caplog.clear()
+    assert dep([source], individual_dependencies=".d", incremental=True) == 0
+    assert depfile.stat().st_mtime_ns == 0
+    assert "0 dependency files written, 0 unchanged, 1 skipped" in caplog.text
+
+    source.write_text(source.read_text() + "\nMore text.\n")
+    caplog.clear()
+    assert dep([source], individual_dependencies=".d", incremental=True) == 0
+    assert depfile.stat().st_mtime_ns != 0
+    assert "1 dependency files written" in caplog.text
+
+
+def test_incremental_options(source):
+    depfile = source.with_suffix(".d")
+    dep([source], individual_dependencies=".d", incremental=True)
+    dep([source], suffix=[".pdf"], individual_dependencies=".d", incremental=True)
+    assert depfile.read_text().endswith("test.pdf : test.md example.png\n")
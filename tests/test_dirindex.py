@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from md_images.dirindex import DirectoryIndex
+from md_images.prefer_variants import rank_variants
+from md_images.stats import stats
+
+
+@pytest.fixture
+def images(tmp_path):
+    for name in [
+        "fig.png",
+        "fig.pdf",
+        "fig.svg",
+        "fig.large.png",
+        "figure.png",
+        "other.png",
+        "[x]*.png",
+        "[x]*.svg",
+        ".hidden.png",
+    ]:
+        (tmp_path / name).touch()
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    "name", ["fig.png", "fig.large.png", "figure.png", "missing.png", ".hidden.png"]
+)
+def test_variants_like_glob(images, name):
+    path = images / name
+    index = DirectoryIndex()
+    assert sorted(index.variants(path)) == sorted(images.glob(path.stem + ".*"))
+
+
+def test_variants_no_pattern(images):
+    index = DirectoryIndex()
+    assert sorted(p.name for p in index.variants(images / "[x]*.png")) == [
+        "[x]*.png",
+        "[x]*.svg",
+    ]
+
+
+def test_exists(images):
+    index = DirectoryIndex()
+    assert index.exists(images / "fig.png")
+    assert not index.exists(images / "fig.gif")
+    assert not index.exists(images / "missing" / "fig.png")
+
+
+def test_exists_like_path_exists(images):
+    (images / "broken.png").symlink_to(images / "nothing.png")
+    (images / "link.png").symlink_to(images / "fig.png")
+    index = DirectoryIndex()
+    for name in ["broken.png", "link.png", "FIG.PNG", "Fig.png"]:
+        assert index.exists(images / name) == (images / name).exists()
+
+
+def test_invalidated_by_mtime(images):
+    index = DirectoryIndex()
+    assert len(index.variants(images / "fig.png")) == 4
+    (images / "fig.jpg").touch()
+    stat = os.stat(images)
+    os.utime(images, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert len(index.variants(images / "fig.png")) == 5
+    assert index.exists(images / "fig.jpg")
+
+
+def test_without_revalidation(images):
+    index = DirectoryIndex(revalidate=False)
+    stats.reset()
+    assert index.exists(images / "fig.png")
+    assert not index.exists(images / "missing" / "fig.png")
+    (images / "fig.jpg").touch()
+    assert not index.exists(images / "fig.jpg")
+    assert len(index.variants(images / "fig.png")) == 4
+    assert not index.exists(images / "missing" / "other.png")
+    assert stats.counters["stat calls"] == 2
+
+
+def test_rank_variants_finds_variants(images):
+    ranked = rank_variants([images / "fig.png"], find_variants=True)
+    assert set(ranked[images / "fig"]) == {
+        images / "fig.png",
+        images / "fig.pdf",
+        images / "fig.svg",
+        images / "fig.large.png",
+    }
+
+
+def test_rank_variants_uses_given_index(images):
+    index = DirectoryIndex(revalidate=False)
+    stats.reset()
+    rank_variants([images / "fig.png", images / "other.png"], True, index=index)
+    index.exists(images / "fig.png")
+    assert stats.counters["directory scans"] == 1
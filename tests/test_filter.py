@@ -0,0 +1,85 @@
+import io
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from md_images import filter as md_filter
+
+TESTS = Path(__file__).parent
+
+
+def pandoc_json(path: Path, *args: str) -> bytes:
+    return subprocess.run(
+        ["pandoc", "-t", "json", *args, path], capture_output=True, check=True
+    ).stdout
+
+
+def run_filter(monkeypatch, data: bytes) -> bytes:
+    stdout = io.TextIOWrapper(io.BytesIO())
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(data)))
+    monkeypatch.setattr(sys, "stdout", stdout)
+    md_filter.main()
+    return stdout.buffer.getvalue()
+
+
+def test_passthrough_and_depfile(tmp_path, monkeypatch):
+    text = tmp_path / "text.md"
+    text.write_text("![](a.png) ![](sub/b.svg) ![](https://example.com/c.png)\n")
+    monkeypatch.chdir(tmp_path)
+    data = pandoc_json(
+        Path("text.md"),
+        "-M",
+        "md-images-source=text.md",
+        "-M",
+        "md-images-target=text.pdf",
+    )
+    assert run_filter(monkeypatch, data) == data
+    depfile = (tmp_path / "text.d").read_text()
+    target, deps = depfile.split(" : ")
+    assert target == "text.pdf"
+    assert sorted(deps.split()) == ["a.png", "sub/b.svg", "text.md"]
+
+
+def test_environment(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MD_IMAGES_TARGET", "out/text.html")
+    monkeypatch.setenv("MD_IMAGES_DEPFILE", "deps.d")
+    (tmp_path / "text.md").write_text("![](a.png)\n")
+    run_filter(monkeypatch, pandoc_json(Path("text.md")))
+    assert (tmp_path / "deps.d").read_text() == "out/text.html : a.png\n"
+
+
+def test_unconfigured(tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "text.md").write_text("![](a.png)\n")
+    data = pandoc_json(Path("text.md"))
+    assert run_filter(monkeypatch, data) == data
+    assert list(tmp_path.iterdir()) == [tmp_path / "text.md"]
+    assert "no source" in caplog.text
+
+
+@pytest.mark.skipif(shutil.which("md-images-deps") is None, reason="not installed")
+def test_pandoc_filter(tmp_path):
+    shutil.copy(TESTS / "test.md", tmp_path)
+    shutil.copy(TESTS / "example.png", tmp_path)
+    subprocess.run(
+        [
+            "pandoc",
+            "--filter",
+            "md-images-deps",
+            "-M",
+            "md-images-source=test.md",
+            "-o",
+            "test.html",
+            "test.md",
+        ],
+        cwd=tmp_path,
+        check=True,
+    )
+    assert (tmp_path / "test.html").exists()
+    rule = (tmp_path / "test.d").read_text()
+    assert rule.startswith("test.md : ")
+    assert "example.png" in rule.split()
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+
+from md_images.index import ImageIndex
+from md_images.model import MdFile
+
+
+@pytest.fixture
+def project(tmp_path):
+    img = tmp_path / "img"
+    img.mkdir()
+    for name in ["a.png", "a.svg", "b.png", "unused.png"]:
+        (img / name).touch()
+    (tmp_path / "one.md").write_text("![A](img/a.png)\n\n![B](img/b.png)\n")
+    (tmp_path / "two.md").write_text("![A](img/a.png)\n")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "three.md").write_text("![B](../img/b.png)\n")
+    return tmp_path
+
+
+@pytest.fixture
+def index(project):
+    texts = [project / "one.md", project / "two.md", project / "sub" / "three.md"]
+    return ImageIndex.build(map(MdFile, texts), root=project)
+
+
+def test_who_uses(index, project):
+    assert index.who_uses(project / "img" / "a.png") == [
+        project / "one.md",
+        project / "two.md",
+    ]
+    assert index.who_uses(project / "img" / "b.png") == [
+        project / "one.md",
+        project / "sub" / "three.md",
+    ]
+    assert index.who_uses(project / "img" / "a.svg") == [
+        project / "one.md",
+        project / "two.md",
+    ]
+    assert index.who_uses(project / "img" / "a.svg", variants=False) == []
+    assert index.who_uses(project / "img" / "unused.png") == []
+
+
+def test_uses(index, project):
+    assert index.uses(project / "sub" / "three.md") == [project / "img" / "b.png"]
+
+
+def test_orphans(index, project):
+    assert list(index.orphans(project / "img")) == [project / "img" / "unused.png"]
+
+
+def test_save_load(index, project, monkeypatch):
+    index.save(project / "index.json")
+    monkeypatch.chdir(project / "sub")
+    loaded = ImageIndex.load(project / "index.json")
+    assert loaded.paths == index.paths
+    assert loaded.who_uses(Path("../img/a.svg")) == index.who_uses(
+        project / "img" / "a.svg"
+    )
+    assert list(loaded.orphans(Path("../img"))) == [Path("../img/unused.png")]
+
+
+def test_load_invalid(tmp_path):
+    (tmp_path / "index.json").write_text("{}")
+    with pytest.raises(ValueError):
+        ImageIndex.load(tmp_path / "index.json")
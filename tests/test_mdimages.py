@@ -43,3 +43,27 @@ def test_image_paths(mdfile):
 def test_relfspath(mdfile):
     space_test = mdfile.with_name("a name with a space.png")
     assert mdi.relative_fspath(space_test, mdfile.parent) == "a name with a space.png"
+
+
+@pytest.mark.parametrize("name", ["test.md", "structures.md", "urllist-example.md"])
+def test_find_json_targets(mdfile, name):
+    """The JSON fast path finds the same images and links as the panflute tree"""
+    source = mdfile.with_name(name)
+    doc = mdi.load_markdown(source)
+    images, links = mdi.find_json_targets(mdi.load_json(source))
+    assert images == [img.url for img in mdi.find_images(doc)]
+    assert links == [link.url for link in mdi.find_all(doc, pf.Link)]
+
+
+def test_find_json_targets_outputs(mdfile):
+    images, _ = mdi.find_json_targets(mdi.load_json(mdfile.with_name("structures.md")))
+    assert "generated.png" not in images
+    assert "span-emph.png" not in images
+    assert "span.png" in images
+
+
+def test_docinfo_from_json(mdfile):
+    source = mdfile.with_name("structures.md")
+    assert mdi.DocInfo.from_json(mdi.load_json(source)) == mdi.DocInfo.from_doc(
+        mdi.load_markdown(source)
+    )
@@ -58,3 +58,29 @@ def test_copy_selection(mdobject, tmp_path):
     img = tmp_path / "example.png"
     assert img.exists()
     assert img.is_file()
+
+
+def test_no_tree_needed(mdfile, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("panflute tree should not be built")
+
+    monkeypatch.setattr("md_images.model.load_markdown", fail)
+    assert MdFile(mdfile).image_urls == {"example.png"}
+
+
+def test_lazy(tmp_path, mdfile, monkeypatch):
+    missing = MdFile(tmp_path / "missing.md")
+    assert missing.path.name == "missing.md"
+    with pytest.raises(OSError):
+        missing.image_urls
+
+    source = MdFile(mdfile)
+    assert source.doc is source.doc
+
+    def fail(*args, **kwargs):
+        raise AssertionError("document should not be loaded again")
+
+    monkeypatch.setattr("md_images.model.load_infos", fail)
+    assert source.image_urls == {"example.png"}
+    assert source.title == "Test file"
+    assert not hasattr(source, "__dict__")
@@ -0,0 +1,102 @@
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+from md_images.cli import ninja
+from md_images.core import DocInfo
+from md_images.model import MdFile
+from md_images.ninja import dyndep, escape, manifest
+
+
+def test_escape():
+    assert escape("a b/c:d$e.md") == "a$ b/c$:d$$e.md"
+
+
+def test_manifest():
+    text = manifest(
+        [Path("a.md"), Path("sub/b.md")],
+        [".pdf", "handout-%.pdf"],
+        "pandoc",
+        Path("md-images.dd"),
+        ["md-images", "ninja", "--dyndep-only", "-d", "$x"],
+    )
+    assert "command = md-images ninja --dyndep-only -d '$$x' --dyndep $out $in" in text
+    assert "build md-images.dd : md_images_dyndep a.md sub/b.md\n" in text
+    assert "build sub/handout-b.pdf : pandoc sub/b.md || md-images.dd\n" in text
+    assert text.count("  dyndep = md-images.dd\n") == 4
+
+
+def test_dyndep():
+    sources = [
+        MdFile(
+            "sub/a.md", info=DocInfo(images=["y.png", "x.png", "http://e.com/z.png"])
+        ),
+        MdFile("b.md", info=DocInfo()),
+    ]
+    assert dyndep(sources, [".pdf"]) == (
+        "ninja_dyndep_version = 1\n"
+        "build sub/a.pdf : dyndep | sub/x.png sub/y.png\n"
+        "build b.pdf : dyndep\n"
+    )
+
+
+def test_dyndep_failure(tmp_path):
+    dd = tmp_path / "md-images.dd"
+    dd.write_text("old\n")
+    assert (
+        ninja(
+            [tmp_path / "missing.md"],
+            suffix=[".pdf"],
+            dyndep=dd,
+            dyndep_only=True,
+            jobs=1,
+        )
+        == 1
+    )
+    assert dd.read_text() == "old\n"
+
+
+def _ninja(cwd: Path) -> str:
+    return subprocess.run(
+        ["ninja"], cwd=cwd, check=True, capture_output=True, encoding="utf-8"
+    ).stdout
+
+
+@pytest.mark.skipif(
+    shutil.which("ninja") is None or shutil.which("md-images") is None,
+    reason="ninja or md-images not installed",
+)
+def test_build(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.md").write_text("![](one.png)\n")
+    (tmp_path / "one.png").write_text("1")
+    (tmp_path / "two.png").write_text("2")
+    (tmp_path / "build.ninja").write_text(
+        "rule pandoc\n  command = cp $in $out\n\ninclude texts.ninja\n"
+    )
+    assert ninja([Path("a.md")], suffix=[".out"], output=Path("texts.ninja")) == 0
+    manifest_mtime = (tmp_path / "texts.ninja").stat().st_mtime_ns
+
+    assert "a.out" in _ninja(tmp_path)
+    assert "no work to do" in _ninja(tmp_path)
+
+    time.sleep(0.01)
+    (tmp_path / "one.png").write_text("1")
+    assert "a.out" in _ninja(tmp_path)
+
+    # the image list changes without regenerating the manifest
+    time.sleep(0.01)
+    (tmp_path / "a.md").write_text("![](two.png)\n")
+    assert "a.out" in _ninja(tmp_path)
+    assert "two.png" in (tmp_path / "md-images.dd").read_text()
+    time.sleep(0.01)
+    (tmp_path / "two.png").write_text("2")
+    assert "a.out" in _ninja(tmp_path)
+    assert "no work to do" in _ninja(tmp_path)
+
+    assert ninja([Path("a.md")], suffix=[".out"], output=Path("texts.ninja")) == 0
+    assert (tmp_path / "texts.ninja").stat().st_mtime_ns == manifest_mtime
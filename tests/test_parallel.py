@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import pytest
+
+from md_images.model import MdFile, load_files
+from md_images.parallel import map_texts
+
+
+def _stem(path: Path) -> str:
+    if path.stem == "fail":
+        raise ValueError(path)
+    return path.stem
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_map_texts_order_and_errors(jobs):
+    texts = [Path(f"{i}.md") for i in range(5)] + [Path("fail.md"), Path("5.md")]
+    results = list(map_texts(_stem, texts, jobs))
+    assert [text for text, _ in results] == texts
+    assert [r for _, r in results if not isinstance(r, Exception)] == [
+        "0",
+        "1",
+        "2",
+        "3",
+        "4",
+        "5",
+    ]
+    assert isinstance(results[5][1], ValueError)
+
+
+def test_load_files(mdfile, tmp_path):
+    texts = [mdfile, tmp_path / "missing.md", mdfile]
+    results = list(load_files(texts, jobs=2))
+    assert isinstance(results[0][1], MdFile)
+    assert results[0][1].image_urls == {"example.png"}
+    assert isinstance(results[1][1], OSError)
+    assert results[2][1].image_urls == {"example.png"}
@@ -0,0 +1,140 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from md_images.cli import check
+from md_images.remote import RemoteCache, RemoteChecker, UrlStatus, is_remote
+from md_images.stats import stats
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive
+    requests: list[tuple[str, str]] = []
+
+    def _respond(self, status: int, headers: dict[str, str] = {}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.requests.append(("HEAD", self.path))
+        if self.path == "/image.png":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self._respond(304)
+            else:
+                self._respond(200, {"ETag": '"v1"'})
+        elif self.path == "/moved.png":
+            self._respond(301, {"Location": "/image.png"})
+        elif self.path == "/get-only.png":
+            self._respond(405)
+        elif self.path == "/%C3%84pfel.png?s=%C3%BC":
+            self._respond(200)
+        else:
+            self._respond(404)
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path))
+        self._respond(200 if self.path == "/get-only.png" else 404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    Handler.requests = []
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_is_remote():
+    assert is_remote("https://example.com/image.png")
+    assert is_remote("http://example.com")
+    assert not is_remote("image.png")
+    assert not is_remote("mailto:someone@example.com")
+
+
+def test_check(server):
+    stats.reset()
+    urls = [
+        f"{server}/image.png",
+        f"{server}/missing.png",
+        f"{server}/moved.png",
+        f"{server}/get-only.png",
+        f"{server}/image.png",
+    ]
+    result = RemoteChecker(per_host=2).check(urls)
+    assert list(result) == urls[:4]
+    assert result[urls[0]].ok and result[urls[0]].etag == '"v1"'
+    assert result[urls[1]].status == 404 and not result[urls[1]].ok
+    assert result[urls[2]].ok  # redirect followed
+    assert result[urls[3]].ok  # GET after 405
+    assert ("GET", "/get-only.png") in Handler.requests
+    assert stats.counters["remote connections"] <= 2
+
+
+def test_unreachable():
+    result = RemoteChecker(timeout=1).check(["http://127.0.0.1:1/image.png"])
+    status = result["http://127.0.0.1:1/image.png"]
+    assert status.status is None and status.error and not status.ok
+
+
+def test_non_ascii_url(server):
+    url = f"{server}/Äpfel.png?s=ü"
+    assert RemoteChecker().check([url])[url].ok
+    assert Handler.requests == [("HEAD", "/%C3%84pfel.png?s=%C3%BC")]
+
+
+def test_invalid_url():
+    urls = ["http://host:abc/image.png", "http:///image.png"]
+    result = RemoteChecker().check(urls)
+    for url in urls:
+        assert result[url].status is None and result[url].error
+
+
+def test_cache(server, tmp_path):
+    url = f"{server}/image.png"
+    cache = RemoteCache(tmp_path / "remote.json")
+    assert RemoteChecker(cache).check([url])[url].ok
+    assert len(Handler.requests) == 1
+
+    # fresh results are taken from the cache file
+    assert RemoteChecker(RemoteCache(tmp_path / "remote.json")).check([url])[url].ok
+    assert len(Handler.requests) == 1
+
+    # stale results are revalidated
+    stats.reset()
+    stale = RemoteCache(tmp_path / "remote.json", ttl=0)
+    assert RemoteChecker(stale).check([url])[url].ok
+    assert len(Handler.requests) == 2
+    assert stats.counters["remote revalidations"] == 1
+
+
+def test_corrupt_cache(tmp_path):
+    path = tmp_path / "remote.json"
+    path.write_text("[1, 2")
+    cache = RemoteCache(path)
+    assert cache.get("http://example.com") is None
+    cache.put(UrlStatus("http://example.com", 200, checked=1e12))
+    cache.save()
+    assert RemoteCache(path).get("http://example.com").status == 200
+
+
+def test_check_command(server, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    text = tmp_path / "text.md"
+    text.write_text(
+        f"![]({server}/image.png) [link]({server}/missing.png) [mail](mailto:x@y.z)\n"
+    )
+    assert check([text], jobs=1) == 0
+    assert Handler.requests == []
+    assert check([text], remote=True, quiet=True, jobs=1) == 1
+    assert capsys.readouterr().out == f"{server}/missing.png\n"
+    assert (tmp_path / "cache" / "md-images" / "remote.json").exists()
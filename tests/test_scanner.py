@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from md_images.core import DocInfo, load_json, load_json_batch
+from md_images.scanner import scan_markdown, scan_file
+
+SNIPPETS = [
+    "A paragraph with ![an image]({img}) and a [link]({url}).",
+    "![A figure caption]({img})",
+    "![]({img})",
+    '![With title]({img} "The title"){{width=50%}}',
+    "Reference style ![image][{ref}] and [link][{ref}] and ![{ref}].",
+    '[{ref}]: {img} "Definition"',
+    "```\n![not an image]({img})\n```",
+    "~~~ python\nprint('![no]({img})')\n~~~",
+    "Inline `![code]({img})` is not an image.",
+    "Escaped \\`![not code]({img})\\` backticks.",
+    "<!-- ![commented]({img}) -->",
+    "- list item with ![image]({img})\n- second item\n\n  continued ![image]({img})",
+    "1. numbered [link]({url})\n2. numbered",
+    "> quoted ![image]({img})\n> more",
+    "## Header with ![icon]({img})",
+    "Text with a footnote.[^{ref}]\n\n[^{ref}]: The note with ![image]({img})",
+    "[![linked image]({img})]({url})",
+    "*emphasised ![image]({img})* and **strong [link]({url})**",
+    "Autolink <{url}> and escaped \\![not]({img}) and \\[not a link]({url})",
+    "::: {{.cell .code}}\n:::: {{.output}}\n![]({img})\n\n![Figure]({img})\n\nText ![inline]({img})\n::::\n:::",
+    "::: note\nA note ![image]({img})\n:::",
+    "[*![generated]({img})*]{{.output}} and [![in span]({img})]{{.output}}",
+    "    ![indented code]({img})",
+]
+
+
+def generate_markdown(rng: random.Random, blocks: int = 12) -> str:
+    parts = []
+    if rng.random() < 0.5:
+        parts.append(f"---\ntitle: Chapter *{rng.randint(1, 99)}*\n---")
+    for _ in range(blocks):
+        snippet = rng.choice(SNIPPETS)
+        n = rng.randint(1, 999)
+        parts.append(
+            snippet.format(
+                img=rng.choice(
+                    [f"img/figure-{n}.png", f"../shared/{n}.svg", f"plot {n}.pdf"]
+                ),
+                url=f"https://example.com/{n}",
+                ref=f"ref{n}",
+            )
+        )
+    return "\n\n".join(parts) + "\n"
+
+
+def assert_same(fast: DocInfo, pandoc: DocInfo, text: str = ""):
+    assert set(fast.images) == set(pandoc.images), text
+    assert set(fast.links) == set(pandoc.links), text
+    assert fast.title == pandoc.title, text
+
+
+@pytest.mark.parametrize("name", ["test.md", "urllist-example.md", "structures.md"])
+def test_scan_test_files(mdfile, name):
+    source = mdfile.with_name(name)
+    assert_same(scan_file(source), DocInfo.from_json(load_json(source)))
+
+
+def test_scan_generated_corpus(tmp_path):
+    rng = random.Random(42)
+    texts = []
+    for i in range(40):
+        text = tmp_path / f"doc-{i}.md"
+        text.write_text(generate_markdown(rng), encoding="utf-8")
+        texts.append(text)
+    for text, ast in zip(texts, load_json_batch(texts)):
+        assert_same(scan_file(text), DocInfo.from_json(ast), text.read_text())
+
+
+def test_unknown_reference():
+    assert scan_markdown("![undefined] ![x][nope]").images == []
+
+
+def test_reference_labels():
+    info = scan_markdown("![Label  One] ![x][label one]\n\n[label one]: <a b.png>\n")
+    assert info.images == ["a%20b.png", "a%20b.png"]
+
+
+def test_html_images():
+    text = 'An <img src="raw.png"> tag'
+    assert scan_markdown(text).images == []
+    assert scan_markdown(text, html_images=True).images == ["raw.png"]
@@ -0,0 +1,39 @@
+import json
+
+import panflute as pf
+import pytest
+
+from md_images import server
+from md_images.server import PandocServer, PandocServerError, convert_json
+
+TEXT = "---\ntitle: Test\n---\n\n# Über\n\n![Image](example.png)\n"
+
+
+def test_convert():
+    with PandocServer() as pandoc:
+        result = pandoc.convert(TEXT, "markdown")
+        assert json.loads(result) == json.loads(
+            pf.convert_text(
+                TEXT, input_format="markdown", output_format="json", standalone=True
+            )
+        )
+        assert json.loads(pandoc.convert("", "markdown"))["blocks"] == []
+        with pytest.raises(OSError, match="nonsense"):
+            pandoc.convert("foo", "nonsense")
+        # still usable after an error
+        assert "Image" in pandoc.convert(TEXT, "markdown")
+
+
+def test_dead_server():
+    pandoc = PandocServer()
+    pandoc.close()
+    with pytest.raises(PandocServerError):
+        pandoc.convert(TEXT, "markdown")
+
+
+def test_fallback(monkeypatch):
+    monkeypatch.setattr(server, "_server", None)
+    monkeypatch.setattr(server, "_server_supported", True)
+    monkeypatch.setattr(server, "which", lambda name: None)
+    assert "Image" in convert_json(TEXT, "markdown")
+    assert server._server_supported is False
@@ -0,0 +1,61 @@
+"""
+md-images is run many times from builds, so its startup should stay cheap:
+heavy modules must only be imported by the commands that need them.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+HEAVY = ["panflute", "rich.syntax", "rich.logging", "rich.table", "pygments", "yaml"]
+
+
+def imported_modules(code: str, *args: str, env: dict | None = None) -> dict[str, int]:
+    """Runs Python with -X importtime and returns the imported modules' cumulative µs."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        capture_output=True,
+        encoding="utf-8",
+        cwd=Path(__file__).parent,
+        env=env,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def heavy(modules: dict[str, int]) -> list[str]:
+    return [
+        name
+        for name in modules
+        if any(name == h or name.startswith(h + ".") for h in HEAVY)
+    ]
+
+
+def test_import_cli():
+    modules = imported_modules("import md_images.cli")
+    assert "md_images.cli" in modules
+    assert heavy(modules) == []
+
+
+def test_import_library():
+    modules = imported_modules("import md_images.prefer_variants, md_images.model")
+    assert heavy(modules) == []
+    assert "cyclopts" not in modules
+
+
+@pytest.mark.parametrize("command", [["dep", "-d", ".pdf"], ["ls"]])
+def test_cached_commands(tmp_path, command):
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path))
+    run = "from md_images.cli import app; app()"
+    imported_modules(run, *command, "-j", "1", "test.md", env=env)  # fill the cache
+    modules = imported_modules(run, *command, "-j", "1", "test.md", env=env)
+    assert "md_images.cli" in modules
+    assert heavy(modules) == []
@@ -0,0 +1,61 @@
+import json
+import pstats
+from pathlib import Path
+
+from md_images.cli import ls
+from md_images.parallel import map_batches
+from md_images.stats import Stats, stats
+
+
+def test_count_and_time():
+    s = Stats()
+    s.count("things")
+    s.count("things", 2)
+    with s.timer("phase"):
+        pass
+    with s.timer("phase"):
+        pass
+    assert s.counters["things"] == 3
+    assert s.calls["phase"] == 2
+    assert s.spans is None
+    names = [row[0] for row in s.rows()]
+    assert names == ["phase", "things"]
+
+
+def test_merge():
+    a, b = Stats(), Stats()
+    a.reset(trace=True)
+    b.reset(trace=True)
+    a.count("x")
+    b.count("x", 2)
+    with b.timer("t"):
+        pass
+    a.merge(b.snapshot())
+    assert a.counters["x"] == 3
+    assert a.calls["t"] == 1
+    assert len(a.spans) == 1
+
+
+def _count(texts):
+    stats.count("texts", len(texts))
+    return list(texts)
+
+
+def test_stats_from_workers():
+    stats.reset()
+    texts = [Path(f"{n}.md") for n in range(10)]
+    assert [text for text, _ in map_batches(_count, texts, jobs=2)] == texts
+    assert stats.counters["texts"] == 10
+
+
+def test_profile_trace(mdfile, tmp_path):
+    trace = tmp_path / "trace.json"
+    assert ls([mdfile], no_cache=True, profile=trace) == 0
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert "pandoc" in {event["name"] for event in events}
+
+
+def test_profile_cprofile(mdfile, tmp_path):
+    profile = tmp_path / "ls.prof"
+    assert ls([mdfile], no_cache=True, profile=profile, stats_=True) == 0
+    assert pstats.Stats(str(profile)).total_calls > 0
@@ -0,0 +1,71 @@
+import sys
+
+import pytest
+
+from md_images.model import SourceSelection
+from md_images.watch import InotifyWatcher, PollingWatcher, WatchSession
+
+
+@pytest.fixture
+def text(tmp_path):
+    text = tmp_path / "text.md"
+    text.write_text("![A](img/a.png)\n\n![B](b.png)\n")
+    return text
+
+
+def test_session(text, tmp_path):
+    reports = []
+    session = WatchSession([text], individual_dependencies=".d", report=reports.append)
+    depfile = tmp_path / "text.d"
+    assert reports == [{text: [tmp_path / "b.png", tmp_path / "img" / "a.png"]}]
+    assert depfile.read_text().count("b.png") == 1
+    assert session.paths() == {text, tmp_path / "b.png", tmp_path / "img" / "a.png"}
+
+    (tmp_path / "b.png").touch()
+    session.update([tmp_path / "b.png"])
+    assert reports[-1] == {text: [tmp_path / "img" / "a.png"]}
+
+    session.update([tmp_path / "unrelated.png"])
+    assert len(reports) == 2
+
+    text.write_text("![B](b.png)\n")
+    session.update([text])
+    assert reports[-1] == {}
+    assert "a.png" not in depfile.read_text()
+    assert session.paths() == {text, tmp_path / "b.png"}
+
+
+def test_session_variants(text, tmp_path):
+    (tmp_path / "b.png").touch()
+    reports = []
+    session = WatchSession([text], select=SourceSelection.SOURCE, report=reports.append)
+    assert tmp_path / "b.png" in session.images[text]
+    (tmp_path / "b.svg").touch()
+    session.update([tmp_path / "b.svg"])
+    assert tmp_path / "b.svg" in session.images[text]
+    assert tmp_path / "b.png" not in session.images[text]
+
+
+def test_polling_watcher(tmp_path):
+    path = tmp_path / "a.png"
+    watcher = PollingWatcher(interval=0.01)
+    watcher.watch({path})
+    assert watcher.changes(timeout=0) == set()
+    path.touch()
+    assert watcher.changes(timeout=1) == {path}
+    assert watcher.changes(timeout=0) == set()
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="inotify is Linux only")
+def test_inotify_watcher(tmp_path):
+    path = tmp_path / "img" / "a.png"
+    watcher = InotifyWatcher()
+    try:
+        watcher.watch({path})
+        assert watcher.changes(timeout=0) == set()
+        path.parent.mkdir()
+        assert path in watcher.changes(timeout=1)
+        path.touch()
+        assert path in watcher.changes(timeout=1)
+    finally:
+        watcher.close()